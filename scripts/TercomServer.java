@@ -0,0 +1,31 @@
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.PrintWriter;
+
+/**
+ * Long-lived tercom process, used by `translate/evaluation.py` to avoid starting a JVM at each call.
+ * Reads "HYPOTHESIS<TAB>REFERENCE" lines on stdin, and writes "NUM_EDITS NUM_WORDS" lines on stdout.
+ *
+ * Usage (Java 11+): java -cp scripts/tercom.jar scripts/TercomServer.java [-s]
+ * -s: case-sensitive (same as tercom's option)
+ */
+public class TercomServer {
+    public static void main(String[] args) throws IOException {
+        TERcalc.setCase(args.length > 0 && args[0].equals("-s"));
+
+        BufferedReader input = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintWriter output = new PrintWriter(new OutputStreamWriter(System.out, "UTF-8"));
+
+        String line;
+        while ((line = input.readLine()) != null) {
+            String[] fields = line.split("\t", -1);
+            TERalignment alignment = TERcalc.TER(fields[0], fields.length > 1 ? fields[1] : "");
+            output.println(alignment.numEdits + " " + alignment.numWords);
+            if (!input.ready()) {   // flush once all the available segments are scored
+                output.flush();
+            }
+        }
+    }
+}
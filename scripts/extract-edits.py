@@ -1,33 +1,49 @@
 #!/usr/bin/env python3
 
 import argparse
-import functools
 
 parser = argparse.ArgumentParser()
 parser.add_argument('source')
 parser.add_argument('target')
 
 
-@functools.lru_cache(maxsize=1024)
 def levenshtein(src, trg):
-    if len(src) == 0:
-        return len(trg), [('insert', w) for w in trg]
-    elif len(trg) == 0:
-        return len(src), ['delete' for _ in src]
-
-    insert = levenshtein(src, trg[1:])
-    delete = levenshtein(src[1:], trg)
-
-    res = [
-        (1 + insert[0], [('insert', trg[0])] + insert[1]),
-        (1 + delete[0], ['delete'] + delete[1])
-    ]
-
-    if src[0] == trg[0]:
-        keep = levenshtein(src[1:], trg[1:])
-        res.append((keep[0], ['keep'] + keep[1]))
-
-    return min(res, key=lambda p: p[0])
+    """
+    Shortest sequence of edits (insertions, deletions and keeps) that transforms `src` into `trg`.
+    Iterative dynamic programming over suffixes, with the same tie-breaking as the recursive
+    version (insert, then delete, then keep).
+    """
+    n, m = len(src), len(trg)
+    # dist[i][j]: edit distance between src[i:] and trg[j:]
+    dist = [[0] * (m + 1) for _ in range(n + 1)]
+    for j in range(m + 1):
+        dist[n][j] = m - j
+    for i in range(n - 1, -1, -1):
+        row, next_row = dist[i], dist[i + 1]
+        row[m] = n - i
+        for j in range(m - 1, -1, -1):
+            cost = min(1 + row[j + 1], 1 + next_row[j])
+            if src[i] == trg[j]:
+                cost = min(cost, next_row[j + 1])
+            row[j] = cost
+
+    edits = []
+    i, j = 0, 0
+    while i < n and j < m:
+        if dist[i][j] == 1 + dist[i][j + 1]:
+            edits.append(('insert', trg[j]))
+            j += 1
+        elif dist[i][j] == 1 + dist[i + 1][j]:
+            edits.append('delete')
+            i += 1
+        else:
+            edits.append('keep')
+            i += 1
+            j += 1
+
+    edits += ['delete' for _ in src[i:]]
+    edits += [('insert', w) for w in trg[j:]]
+    return dist[0][0], edits
 
 
 if __name__ == '__main__':
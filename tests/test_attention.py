@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+
+from translate import utils
+from tests.tiny_model import tf
+
+
+def softmax(x, mask):
+    exp = np.exp(x - np.max(x)) * mask
+    return exp / np.sum(exp)
+
+
+@unittest.skipIf(tf is None, 'TensorFlow is not installed')
+class TestLocalAttention(unittest.TestCase):
+    """
+    Compare `local_attention` and `windowed_local_attention` with NumPy implementations of their
+    definitions (`windowed_local_attention` is not the same model as `local_attention`)
+    """
+
+    batch_size, attn_length, cell_size, attn_size, window_size = 4, 15, 6, 5, 3
+
+    def run_attention(self, windowed):
+        from translate import decoders
+
+        encoder = utils.AttrDict(attention_window_size=self.window_size, windowed_attention=windowed,
+                                 attention_filters=0, attention_filter_length=0, attn_size=self.attn_size)
+        rng = np.random.RandomState(1234)
+        state = rng.normal(size=[self.batch_size, self.cell_size]).astype(np.float32)
+        hidden = rng.normal(size=[self.batch_size, self.attn_length, 1, self.cell_size]).astype(np.float32)
+        input_length = np.array([15, 10, 4, 1])
+        prev_weights = np.zeros([self.batch_size, self.attn_length], dtype=np.float32)
+
+        with tf.Graph().as_default():
+            tf.set_random_seed(1234)
+            _, weights = decoders.attention(tf.constant(state), tf.constant(prev_weights), tf.constant(hidden),
+                                            encoder, encoder_input_length=tf.constant(input_length),
+                                            scope='attention')
+            with tf.variable_scope('attention', reuse=True):
+                # energies of all the positions (same parameters)
+                energies = decoders.compute_energy(tf.constant(hidden), tf.constant(state), attn_size=self.attn_size)
+                wp, vp = tf.get_variable('Wp'), tf.get_variable('vp')
+
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                weights, energies, wp, vp = sess.run([weights, energies, wp, vp])
+
+        sigmoid = 1 / (1 + np.exp(-np.dot(np.tanh(np.dot(state, wp)), vp)))[:, 0]
+        return weights, energies, sigmoid, input_length
+
+    def test_local_attention(self):
+        weights, energies, sigmoid, _ = self.run_attention(windowed=False)
+        idx = np.arange(self.attn_length)
+        sigma = self.window_size / 2
+
+        for i in range(self.batch_size):
+            pt = np.floor(self.attn_length * sigmoid[i])   # scaled by the padded length
+            mask = np.abs(idx - pt) <= self.window_size
+            # the softmax is over all the positions, with an energy of zero outside of the window
+            expected = softmax(energies[i] * mask, np.ones_like(mask)) * np.exp(-(idx - pt) ** 2 / sigma ** 2)
+            np.testing.assert_allclose(weights[i], expected, rtol=1e-4, atol=1e-6)
+
+    def test_windowed_local_attention(self):
+        weights, energies, sigmoid, input_length = self.run_attention(windowed=True)
+        idx = np.arange(self.attn_length)
+        sigma = self.window_size / 2
+
+        for i in range(self.batch_size):
+            pt = np.floor(input_length[i] * sigmoid[i])   # scaled by the true length
+            mask = (np.abs(idx - pt) <= self.window_size) & (idx < input_length[i])
+            expected = softmax(energies[i], mask) * np.exp(-(idx - pt) ** 2 / sigma ** 2)
+            np.testing.assert_allclose(weights[i], expected, rtol=1e-4, atol=1e-6)
+            self.assertTrue(np.all(weights[i][~mask] == 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import random
+import unittest
+
+import numpy as np
+
+from translate import evaluation
+
+
+def edit_distance(src, trg):
+    # reference implementation (dynamic programming)
+    row = list(range(len(trg) + 1))
+    for i, x in enumerate(src):
+        new_row = [i + 1]
+        for j, y in enumerate(trg):
+            new_row.append(min(row[j] + (x != y), row[j + 1] + 1, new_row[j] + 1))
+        row = new_row
+    return row[-1]
+
+
+class TestWER(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(1234)
+        cls.pairs = []
+        for _ in range(300):
+            vocab_size = rng.choice([2, 5, 20])
+            src = [rng.randrange(vocab_size) for _ in range(rng.randint(0, 30))]
+            trg = [rng.randrange(vocab_size) for _ in range(rng.choice([rng.randint(0, 30), 64, 65, 100]))]
+            cls.pairs.append((src, trg))
+
+    def test_levenhstein(self):
+        for src, trg in self.pairs:
+            self.assertEqual(evaluation.levenhstein(src, trg), edit_distance(src, trg))
+
+    def test_batch_levenhstein(self):
+        sources, targets = zip(*self.pairs)
+        distances = evaluation.batch_levenhstein(sources, targets)
+        self.assertEqual(list(distances), [edit_distance(src, trg) for src, trg in self.pairs])
+
+    def test_wer_reward(self):
+        self.assertEqual(evaluation.wer_reward('a b c d'.split(), 'a x c d'.split()), 0.75)
+        self.assertEqual(evaluation.wer_reward([4, 5, 6, 7], [4, 8, 6, 7]), 0.75)
+        self.assertEqual(evaluation.wer_reward(np.array([4, 5]), np.array([4, 5])), 1)
+
+    def test_batch_wer_reward(self):
+        hypotheses = np.array([[4, 5, 6, 7, 1], [4, 4, 4, 0, 0]])
+        references = np.array([[4, 8, 6, 7], [5, 6, 7, 8]])
+        rewards = evaluation.batch_wer_reward(hypotheses, references, hypothesis_length=[4, 3],
+                                              reference_length=[4, 4])
+        expected = [evaluation.wer_reward([4, 5, 6, 7], [4, 8, 6, 7]), evaluation.wer_reward([4, 4, 4], [5, 6, 7, 8])]
+        np.testing.assert_allclose(rewards, expected)
+
+    def test_prefix_wer_reward(self):
+        # partial rewards (REINFORCE with `partial_rewards`) are computed on each prefix of the output
+        for src, trg in self.pairs:
+            src, trg = np.array(src, dtype=np.int64), np.array(trg, dtype=np.int64)
+            rewards = evaluation.prefix_wer_reward(src, trg)
+            expected = [evaluation.wer_reward(src[:i + 1], trg) for i in range(len(src))]
+            self.assertEqual(rewards, expected)
+            expected = [1 - edit_distance(src[:i + 1], trg) / max(len(trg), 1) for i in range(len(src))]
+            np.testing.assert_allclose(rewards, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+import unittest
+
+from tests.tiny_model import tf, create_translator
+
+
+@unittest.skipIf(tf is None, 'TensorFlow is not installed')
+class TestFrozenModel(unittest.TestCase):
+    def test_export_and_import(self):
+        """
+        A model exported with `frozen.export` must give the same translations once imported
+        """
+        from translate import frozen
+        from translate.translator import Translator
+
+        sentences = ['w1 w2 w3', 'w4', 'w5 w6 w7 w8 w9 w10', 'w11 w1 w12']
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            translator = create_translator(tmp_dir)
+            filename = os.path.join(tmp_dir, 'model.pb')
+            try:
+                with translator.sess.graph.as_default():
+                    frozen.export(translator.task, translator.sess, filename)
+                outputs = [translator.translate(sentences, beam_size=beam_size) for beam_size in (1, 4)]
+            finally:
+                translator.close()
+
+            with open(filename + '.json') as f:
+                self.assertIn('tensors', json.load(f))   # plain JSON, no pickled objects
+
+            translator = Translator.from_frozen(filename)
+            try:
+                frozen_outputs = [translator.translate(sentences, beam_size=beam_size) for beam_size in (1, 4)]
+            finally:
+                translator.close()
+
+        self.assertEqual(outputs, frozen_outputs)
+
+
+if __name__ == '__main__':
+    unittest.main()
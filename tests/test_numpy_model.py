@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from translate import evaluation, utils
+from translate.numpy_model import NumpyTranslationModel, quantize_matrix
+from tests.tiny_model import tf, create_translator, random_sentences
+
+
+def random_model(filename, vocab_size=200, embedding_size=16, cell_size=32, attn_size=16, seed=1234):
+    """
+    Write a `.npz` model (same format as `frozen.export_numpy`) with random parameters: one unidirectional
+    GRU encoder, and a GRU decoder with global attention.
+    """
+    rng = np.random.RandomState(seed)
+    vocab = [utils._BOS, utils._EOS, utils._UNK] + ['w{}'.format(i) for i in range(vocab_size - 3)]
+
+    encoder = dict(name='src', cell_size=cell_size, embedding_size=embedding_size, layers=1, bidir=False,
+                   use_lstm=False, binary=False, attention_window_size=0, attention_filters=0,
+                   attention_filter_length=0, input_layers=[], residual_connections=False, time_pooling=None,
+                   pooling_avg=False, vocab_size=vocab_size)
+    decoder = dict(encoder, name='trg')
+
+    params = {}
+
+    def add(name, *shape):
+        params[name] = rng.normal(scale=0.5, size=shape).astype(np.float32)
+
+    def add_gru(scope, input_size):
+        add(scope + '/GRUCell/state_to_gates/Matrix', cell_size, 2 * cell_size)
+        add(scope + '/GRUCell/input_to_gates/Matrix', input_size, 2 * cell_size)
+        add(scope + '/GRUCell/input_to_gates/Bias', 2 * cell_size)
+        add(scope + '/GRUCell/state_to_state/Matrix', cell_size, cell_size)
+        add(scope + '/GRUCell/input_to_state/Matrix', input_size, cell_size)
+        add(scope + '/GRUCell/input_to_state/Bias', cell_size)
+
+    add('embedding_src', vocab_size, embedding_size)
+    add('embedding_trg', vocab_size, embedding_size)
+    add('encoder_src/forward_1/initial_state', cell_size)
+    add_gru('encoder_src/forward_1', embedding_size)
+
+    add('decoder_trg/initial_state_projection/Matrix', cell_size, cell_size)
+    add('decoder_trg/initial_state_projection/Bias', cell_size)
+    add('decoder_trg/attention_src/W_a/Matrix', cell_size, attn_size)
+    add('decoder_trg/attention_src/W_a/Bias', attn_size)
+    add('decoder_trg/attention_src/U_a', cell_size, attn_size)
+    add('decoder_trg/attention_src/v_a', attn_size)
+    add_gru('decoder_trg', embedding_size + cell_size)
+    add('decoder_trg/maxout/Matrix', 2 * cell_size + embedding_size, cell_size)
+    add('decoder_trg/softmax0/Matrix', cell_size // 2, embedding_size)
+    add('decoder_trg/softmax1/Matrix', embedding_size, vocab_size)
+    add('decoder_trg/softmax1/Bias', vocab_size)
+
+    config = dict(encoders=[encoder], decoder=decoder, character_level=[False, False], vocabs=[vocab, vocab],
+                  batch_size=32, max_input_len=None, max_output_len=20, len_normalization=1.0,
+                  softmax_temperature=1.0, softmax_classes=0)
+
+    with open(filename, 'wb') as f:
+        np.savez(f, __config__=json.dumps(config), **params)
+
+    return vocab
+
+
+class TestQuantization(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.filename = os.path.join(cls.tmp_dir.name, 'model.npz')
+        vocab = random_model(cls.filename)
+
+        random.seed(1234)
+        cls.sentences = [' '.join(random.choice(vocab[3:]) for _ in range(random.randint(3, 15)))
+                         for _ in range(200)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_quantize_matrix(self):
+        matrix = np.random.RandomState(1).normal(size=[50, 20]).astype(np.float32)
+        for axis in 0, 1:
+            quantized, scales = quantize_matrix(matrix, axis=axis)
+            self.assertEqual(quantized.dtype, np.int8)
+            max_error = np.max(np.abs(quantized * scales - matrix) / scales)
+            self.assertLessEqual(max_error, 0.5 + 1e-5)   # rounding error of at most half a step
+
+    def test_dequantized_once(self):
+        model = NumpyTranslationModel(self.filename, quantize=True)
+        self.assertTrue(model.quantized)
+        for name in model.quantized:
+            self.assertEqual(model.params[name].dtype, np.float32)
+
+    def test_bleu_and_speed(self):
+        def translate(model):
+            start_time = time.time()
+            hypotheses = model.translate(self.sentences)
+            return hypotheses, time.time() - start_time
+
+        fp32_model = NumpyTranslationModel(self.filename)
+        int8_model = NumpyTranslationModel(self.filename, quantize=True)
+
+        fp32_time, int8_time = [], []
+        for _ in range(3):
+            fp32_hypotheses, elapsed = translate(fp32_model)
+            fp32_time.append(elapsed)
+            int8_hypotheses, elapsed = translate(int8_model)
+            int8_time.append(elapsed)
+
+        # BLEU of the quantized model, with the outputs of the non-quantized model as references
+        score, _ = evaluation.corpus_bleu(int8_hypotheses, fp32_hypotheses)
+        print('int8 vs fp32: BLEU={:.2f} time={:.3f}s vs {:.3f}s'.format(score, min(int8_time), min(fp32_time)))
+
+        self.assertGreater(score, 80)
+        self.assertLess(min(int8_time), 1.5 * min(fp32_time))
+
+
+class TestParameters(unittest.TestCase):
+    def test_missing_parameter(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'model.npz')
+            random_model(filename)
+            with np.load(filename) as data:
+                params = {k: data[k] for k in data.files if k != 'decoder_trg/softmax1/Bias'}
+            with open(filename, 'wb') as f:
+                np.savez(f, **params)
+
+            model = NumpyTranslationModel(filename)
+            with self.assertRaisesRegex(KeyError, 'decoder_trg/softmax1/Bias'):
+                model.translate(['w1 w2'])
+
+    def test_missing_lstm_parameters(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'model.npz')
+            random_model(filename)
+            model = NumpyTranslationModel(filename)
+            with self.assertRaisesRegex(KeyError, 'LSTM parameters are missing'):
+                model.lstm_parameters('encoder_src/forward_1')
+
+
+@unittest.skipIf(tf is None, 'TensorFlow is not installed')
+class TestTensorFlowParity(unittest.TestCase):
+    """
+    The NumPy engine must give the same outputs as `Seq2SeqModel` with the same (exported) parameters
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from translate import frozen
+
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.translator = create_translator(cls.tmp_dir.name)
+        cls.model = cls.translator.task.seq2seq_model
+        cls.sess = cls.translator.sess
+
+        filename = os.path.join(cls.tmp_dir.name, 'model.npz')
+        with cls.sess.graph.as_default():
+            frozen.export_numpy(cls.translator.task, cls.sess, filename)
+        cls.numpy_model = NumpyTranslationModel(filename)
+        cls.sentences = random_sentences()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.translator.close()
+        cls.tmp_dir.cleanup()
+
+    @staticmethod
+    def strip(token_ids):
+        token_ids = list(token_ids)
+        return token_ids[:token_ids.index(utils.EOS_ID) + 1] if utils.EOS_ID in token_ids else token_ids
+
+    def test_greedy_decoding(self):
+        tf_outputs, tf_costs = self.model.greedy_decoding(self.sess, self.sentences, return_scores=True)
+        np_outputs, np_costs = self.numpy_model.greedy_decoding(self.sentences, return_scores=True)
+
+        for tf_output, tf_cost, np_output, np_cost in zip(tf_outputs, tf_costs, np_outputs, np_costs):
+            tf_output, np_output = self.strip(tf_output), self.strip(np_output)
+            self.assertEqual(tf_output, np_output)
+            np.testing.assert_allclose(tf_cost[:len(tf_output)], np_cost[:len(np_output)], rtol=1e-4, atol=1e-5)
+
+    def test_beam_search_decoding(self):
+        for token_ids in self.sentences[:5]:
+            tf_hypotheses, tf_scores = self.model.beam_search_decoding(self.sess, token_ids, beam_size=4)
+            np_hypotheses, np_scores = self.numpy_model.beam_search_decoding(token_ids, beam_size=4)
+
+            self.assertEqual(list(tf_hypotheses[0]), list(np_hypotheses[0]))
+            np.testing.assert_allclose(tf_scores[0], np_scores[0], rtol=1e-4, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from tests.tiny_model import tf, get_config, random_sentences
+
+
+@unittest.skipIf(tf is None, 'TensorFlow is not installed')
+class TestPipelinedReinforce(unittest.TestCase):
+    @staticmethod
+    def train(data_dir, batches, executor=None):
+        """
+        Apply one REINFORCE update per batch to a tiny model (same random seed each time)
+
+        :return: values of the trainable variables after the updates
+        """
+        from translate.multitask_model import MultiTaskModel
+
+        config = get_config(data_dir, loss_function='reinforce')
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.set_random_seed(1234)
+            model = MultiTaskModel(name='main', checkpoint_dir=os.path.join(data_dir, 'checkpoints'), **config)
+            task = model.models[0]
+
+            with tf.Session(graph=graph) as sess:
+                sess.run(tf.global_variables_initializer())
+                for batch in batches:
+                    res = task.seq2seq_model.reinforce_step(sess, batch, vocabs=task.vocabs, executor=executor)
+                    if executor is not None:
+                        res = res.result()   # no stale parameters: wait for this update before the next batch
+                    assert np.isfinite(res.loss)
+                return sess.run(tf.trainable_variables())
+
+    def test_staleness_zero(self):
+        """
+        Without stale parameters, the updates applied by a worker thread must be the same as the
+        updates of the synchronous path
+        """
+        sentences = random_sentences(count=12)
+        batches = [[(src, trg) for (src,), (trg,) in zip(sentences[i:i + 4], sentences[i + 4:i + 8])]
+                   for i in (0, 4)]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            values = self.train(tmp_dir, batches)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                pipelined_values = self.train(tmp_dir, batches, executor=executor)
+
+        self.assertEqual(len(values), len(pipelined_values))
+        for value, pipelined_value in zip(values, pipelined_values):
+            np.testing.assert_allclose(value, pipelined_value, rtol=1e-6, atol=1e-7)
+
+
+if __name__ == '__main__':
+    unittest.main()
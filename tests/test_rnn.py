@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from tests.tiny_model import tf, create_translator
+
+
+@unittest.skipIf(tf is None, 'TensorFlow is not installed')
+class TestProjectedInputGRUCell(unittest.TestCase):
+    def test_same_as_gru_cell(self):
+        """
+        `ProjectedInputGRUCell` must give the same outputs as `GRUCell`, with the same variables
+        """
+        from translate.rnn import GRUCell, ProjectedInputGRUCell
+
+        rng = np.random.RandomState(1234)
+        inputs = rng.normal(size=[3, 7, 5]).astype(np.float32)
+        sequence_length = np.array([7, 4, 1])
+
+        with tf.Graph().as_default():
+            with tf.variable_scope('encoder') as scope:
+                outputs, state = tf.nn.dynamic_rnn(GRUCell(6), tf.constant(inputs), sequence_length=sequence_length,
+                                                   dtype=tf.float32, scope=scope)
+            variables = tf.global_variables()
+
+            with tf.variable_scope('encoder', reuse=True) as scope:
+                cell = ProjectedInputGRUCell(6)
+                projected_outputs, projected_state = tf.nn.dynamic_rnn(
+                    cell, cell.project_inputs(tf.constant(inputs)), sequence_length=sequence_length,
+                    dtype=tf.float32, scope=scope)
+
+            self.assertEqual(tf.global_variables(), variables)   # no new variables
+
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                values = sess.run([outputs, state, projected_outputs, projected_state])
+
+        np.testing.assert_allclose(values[0], values[2], rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(values[1], values[3], rtol=1e-5, atol=1e-6)
+
+    def test_scope_name(self):
+        from translate.rnn import ProjectedInputGRUCell
+
+        with tf.Graph().as_default():
+            cell = ProjectedInputGRUCell(6, scope_name='my_cell')
+            cell.project_inputs(tf.zeros([2, 3, 5]))
+            self.assertTrue(all(var.op.name.startswith('my_cell/') for var in tf.global_variables()))
+
+    def test_lstm_encoder(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaisesRegex(AssertionError, 'precompute_inputs'):
+                create_translator(tmp_dir, use_lstm=True, precompute_inputs=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import random
+import unittest
+
+from translate import pyter, ter
+
+
+class TestTER(unittest.TestCase):
+    """
+    `translate.ter` must give exactly the same scores as the reference implementation (`translate.pyter`)
+    """
+
+    def random_sentence(self, vocab, max_length):
+        return [random.choice(vocab) for _ in range(random.randint(0, max_length))]
+
+    def assert_same_score(self, hypothesis, reference):
+        self.assertEqual(ter.ter(hypothesis, reference), pyter.ter(hypothesis, reference),
+                         msg='hypothesis={} reference={}'.format(hypothesis, reference))
+
+    def test_example(self):
+        ref = 'SAUDI ARABIA denied THIS WEEK information published in the AMERICAN new york times'.split()
+        hyp = 'THIS WEEK THE SAUDIS denied information published in the new york times'.split()
+        self.assert_same_score(hyp, ref)
+        self.assertAlmostEqual(ter.ter(hyp, ref), 4 / 13)
+
+    def test_random_words(self):
+        random.seed(1234)
+        for vocab_size in 2, 4, 10:
+            vocab = ['w{}'.format(i) for i in range(vocab_size)]
+            for _ in range(200):
+                reference = self.random_sentence(vocab, 15) or vocab[:1]
+                hypothesis = self.random_sentence(vocab, 15)
+                self.assert_same_score(hypothesis, reference)
+
+    def test_random_ids(self):
+        random.seed(4321)
+        for _ in range(200):
+            reference = self.random_sentence(list(range(6)), 20) or [0]
+            hypothesis = self.random_sentence(list(range(8)), 20)
+            self.assert_same_score(hypothesis, reference)
+
+    def test_shifted_phrase(self):
+        reference = 'a b c d e f g h'.split()
+        hypothesis = 'e f g h a b c d'.split()
+        self.assert_same_score(hypothesis, reference)
+        self.assertAlmostEqual(ter.ter(hypothesis, reference), 1 / 8)
+
+    def test_identical(self):
+        sentence = 'the cat is on the mat'.split()
+        self.assertEqual(ter.ter(sentence, sentence), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
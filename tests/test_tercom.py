@@ -0,0 +1,91 @@
+import os
+import shutil
+import sys
+import unittest
+
+from translate import evaluation
+
+tercom_jar = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'tercom.jar')
+has_tercom = shutil.which('java') is not None and os.path.isfile(tercom_jar)
+
+hypotheses = [
+    'the cat sat on the mat',
+    'a quick brown fox jumps over the dog',
+    'hello world',
+    'SAUDI ARABIA denied this week information published in the american new york times',
+]
+references = [
+    'the cat is on the mat',
+    'the quick brown fox jumps over the lazy dog',
+    'hello there world',
+    'SAUDI ARABIA denied THIS WEEK information published in the AMERICAN new york times',
+]
+
+
+class TestTercomWorker(unittest.TestCase):
+    def test_dead_worker(self):
+        worker = evaluation.TercomWorker()
+        worker.cmd = [sys.executable, '-c', 'pass']   # exits right away
+        with self.assertRaises(IOError):
+            worker.score(hypotheses, references)
+        self.assertTrue(worker.disabled)
+        self.assertIsNone(worker.process)
+        with self.assertRaisesRegex(IOError, 'disabled'):
+            worker.score(hypotheses, references)
+
+    def test_timeout(self):
+        worker = evaluation.TercomWorker(timeout=0.5)
+        worker.cmd = [sys.executable, '-c', 'import time; time.sleep(60)']   # never answers
+        with self.assertRaises(IOError):
+            worker.score(hypotheses, references)
+        self.assertTrue(worker.disabled)
+
+
+@unittest.skipIf(not has_tercom, 'java or scripts/tercom.jar is missing')
+class TestTercom(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(os.path.dirname(os.path.dirname(tercom_jar)))   # the tercom paths are relative to the repository
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def test_worker(self):
+        """
+        The worker must give the same scores as a tercom process
+        """
+        worker = evaluation.TercomWorker()
+        try:
+            scores = worker.score(hypotheses, references)
+        finally:
+            worker.close()
+
+        total, sentence_scores = evaluation.run_tercom(hypotheses, references)
+        self.assertAlmostEqual(sum(edits for edits, _ in scores) / sum(words for _, words in scores), total, places=4)
+        for (edits, words), score in zip(scores, sentence_scores):
+            self.assertAlmostEqual(edits / words, score, places=4)
+
+    def test_fallback(self):
+        """
+        When the worker can't run, `corpus_tercom` and `batch_tercom_reward` must give the same scores
+        with a new tercom process
+        """
+        score, _ = evaluation.corpus_tercom(hypotheses, references)
+        rewards = evaluation.batch_tercom_reward(hypotheses, references)
+
+        worker = evaluation.get_tercom_worker(case_sensitive=True)
+        worker.close()
+        worker.disabled = True
+        try:
+            fallback_score, _ = evaluation.corpus_tercom(hypotheses, references)
+            fallback_rewards = evaluation.batch_tercom_reward(hypotheses, references)
+        finally:
+            worker.disabled = False
+
+        self.assertAlmostEqual(score, fallback_score, places=2)
+        for reward, fallback_reward in zip(rewards, fallback_rewards):
+            self.assertAlmostEqual(reward, fallback_reward, places=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Tiny TensorFlow models with random parameters, used by the tests which need TensorFlow.
+"""
+
+import os
+import random
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+from translate import utils
+
+
+def write_vocab(data_dir, extensions=('fr', 'en'), vocab_size=50):
+    vocab = [utils._BOS, utils._EOS, utils._UNK] + ['w{}'.format(i) for i in range(vocab_size - 3)]
+    for ext in extensions:
+        with open(os.path.join(data_dir, 'vocab.{}'.format(ext)), 'w') as f:
+            f.writelines(token + '\n' for token in vocab)
+    return vocab
+
+
+def get_config(data_dir, **config):
+    """
+    Configuration of a tiny model, whose data and vocabulary files are in `data_dir`
+
+    :param config: parameters which override the default values
+    """
+    from translate.translator import read_config
+
+    write_vocab(data_dir)
+    parameters = dict(data_dir=data_dir, model_dir=data_dir, cell_size=16, embedding_size=8, attn_size=8,
+                      max_output_len=10, batch_size=4, no_gpu=True)
+    parameters.update(config)
+    return read_config(None, **parameters)
+
+
+def create_translator(data_dir, **config):
+    """
+    Create a decoding model with random parameters (see `get_config`), in its own graph and session
+
+    :return: instance of `Translator`
+    """
+    from translate.translator import Translator
+    return Translator.create(get_config(data_dir, **config))
+
+
+def random_sentences(count=20, vocab_size=50, min_length=1, max_length=12, seed=1234):
+    """
+    :return: list of sentences (one list of token ids for each encoder)
+    """
+    rng = random.Random(seed)
+    return [[[rng.randrange(3, vocab_size) for _ in range(rng.randint(min_length, max_length))]]
+            for _ in range(count)]
@@ -11,13 +11,14 @@ import logging
 import argparse
 import subprocess
 import tensorflow as tf
-import yaml
 import shutil
 
 from pprint import pformat
 from operator import itemgetter
-from translate import utils
+from translate import utils, parallel
 from translate.multitask_model import MultiTaskModel
+from translate.translator import Translator, read_config, get_device, get_session_config
+from translate.translator import model_parameters, task_parameters
 
 parser = argparse.ArgumentParser()
 parser.add_argument('config', help='load a configuration file in the YAML format')
@@ -33,6 +34,10 @@ parser.add_argument('--decode', help='translate this corpus (one filename for ea
 parser.add_argument('--align', help='translate and show alignments by the attention mechanism', nargs=2)
 parser.add_argument('--eval', help='compute BLEU score on this corpus (source files and target file)', nargs='+')
 parser.add_argument('--train', help='train an NMT model', action='store_true')
+parser.add_argument('--serve', help='run a translation server (HTTP over TCP or over a Unix socket)',
+                    action='store_true')
+parser.add_argument('--export', help='export the model to this file (frozen inference graph, with its vocabularies '
+                    'in FILE.json), or its parameters in the NumPy format if the file name ends with .npz')
 
 # TensorFlow configuration
 parser.add_argument('--gpu-id', type=int, help='index of the GPU where to run the computation')
@@ -50,6 +55,19 @@ parser.add_argument('--max-steps', type=int)
 parser.add_argument('--remove-unk', action='store_const', const=True)
 parser.add_argument('--wav-files', nargs='*')
 parser.add_argument('--use-edits', action='store_const', const=True)
+parser.add_argument('--cache-size', type=int)
+parser.add_argument('--cache-file')
+parser.add_argument('--workers', type=int, help='split the file to decode or evaluate between this many processes')
+parser.add_argument('--threads', type=int, help='number of threads used by each TensorFlow op')
+parser.add_argument('--frozen-model', help='decode with this exported model (see --export)')
+parser.add_argument('--quantize', action='store_const', const=True,
+                    help='quantize the embeddings and the output projection to int8 (with --export MODEL.npz)')
+
+# Server options
+parser.add_argument('--host')
+parser.add_argument('--port', type=int)
+parser.add_argument('--unix-socket')
+parser.add_argument('--max-latency', type=float, help='maximum time (in seconds) spent waiting to fill a batch')
 
 """
 Benchmarks:
@@ -80,30 +98,18 @@ TODO:
 def main(args=None):
     args = parser.parse_args(args)
 
+    if args.learning_rate is not None:
+        args.reset_learning_rate = True
+
     # read config file and default config
-    with open('config/default.yaml') as f:
-        default_config = utils.AttrDict(yaml.safe_load(f))
-
-    with open(args.config) as f:
-        config = utils.AttrDict(yaml.safe_load(f))
-        
-        if args.learning_rate is not None:
-            args.reset_learning_rate = True
-        
-        # command-line parameters have higher precedence than config file
-        for k, v in vars(args).items():
-            if v is not None:
-                config[k] = v
-
-        # set default values for parameters that are not defined
-        for k, v in default_config.items():
-            config.setdefault(k, v)
+    # command-line parameters have higher precedence than config file
+    config = read_config(args.config, **vars(args))
 
     # enforce parameter constraints
     assert config.steps_per_eval % config.steps_per_checkpoint == 0, (
         'steps-per-eval should be a multiple of steps-per-checkpoint')
-    assert args.decode is not None or args.eval or args.train or args.align, (
-        'you need to specify at least one action (decode, eval, align, or train)')
+    assert (args.decode is not None or args.eval or args.train or args.align or args.serve or
+            args.export), 'you need to specify at least one action (decode, eval, align, serve, export or train)'
 
     if args.purge:
         utils.log('deleting previous model')
@@ -121,49 +127,6 @@ def main(args=None):
     except:
         pass
 
-    # list of encoder and decoder parameter names (each encoder and decoder can have a different value
-    # for those parameters)
-    model_parameters = [
-        'cell_size', 'layers', 'vocab_size', 'embedding_size', 'attention_filters', 'attention_filter_length',
-        'use_lstm', 'time_pooling', 'attention_window_size', 'dynamic', 'binary', 'character_level', 'bidir',
-        'load_embeddings', 'pooling_avg', 'swap_memory', 'parallel_iterations', 'input_layers',
-        'residual_connections', 'attn_size'
-    ]
-    # TODO: independent model dir for each task
-    task_parameters = [
-        'data_dir', 'train_prefix', 'dev_prefix', 'vocab_prefix', 'ratio', 'lm_file', 'learning_rate',
-        'learning_rate_decay_factor', 'max_input_len', 'max_output_len', 'encoders', 'decoder'
-    ]
-
-    # in case no task is defined (standard mono-task settings), define a "main" task
-    config.setdefault(
-        'tasks', [{'encoders': config.encoders, 'decoder': config.decoder, 'name': 'main', 'ratio': 1.0}]
-    )
-    config.tasks = [utils.AttrDict(task) for task in config.tasks]
-
-    for task in config.tasks:
-        for parameter in task_parameters:
-            task.setdefault(parameter, config.get(parameter))
-
-        if isinstance(task.dev_prefix, str):  # for back-compatibility with old config files
-            task.dev_prefix = [task.dev_prefix]
-
-        # convert dicts to AttrDicts for convenience
-        task.encoders = [utils.AttrDict(encoder) for encoder in task.encoders]
-        task.decoder = utils.AttrDict(task.decoder)
-
-        for encoder_or_decoder in task.encoders + [task.decoder]:
-            # move parameters all the way up from base level to encoder/decoder level:
-            # default values for encoder/decoder parameters can be defined at the task level and base level
-            # default values for tasks can be defined at the base level
-            for parameter in model_parameters:
-                if parameter in encoder_or_decoder:
-                    continue
-                elif parameter in task:
-                    encoder_or_decoder[parameter] = task[parameter]
-                else:
-                    encoder_or_decoder[parameter] = config.get(parameter)
-
     # log parameters
     utils.log('program arguments')
     for k, v in sorted(config.items(), key=itemgetter(0)):
@@ -172,11 +135,25 @@ def main(args=None):
         elif k not in model_parameters and k not in task_parameters:
             utils.log('  {:<20} {}'.format(k, pformat(v)))
 
-    device = None
-    if config.no_gpu:
-        device = '/cpu:0'
-    elif config.gpu_id is not None:
-        device = '/gpu:{}'.format(config.gpu_id)
+    if config.workers > 1 and (args.decode or args.eval) and not config.ensemble:
+        # each worker creates its own model
+        parallel.decode(config, config.workers, log_level=logging_level)
+        return
+
+    if config.frozen_model:
+        assert args.decode is not None or args.eval or args.serve, 'frozen models can only be used for decoding'
+        # no need to build the model or to restore its parameters
+        with Translator.create(config) as translator:
+            model, sess = translator.task, translator.sess
+            if args.decode is not None:
+                model.decode(sess, **config)
+            elif args.eval:
+                model.evaluate(sess, on_dev=False, **config)
+            elif args.serve:
+                model.serve(sess, **config)
+        return
+
+    device = get_device(config)
 
     utils.log('creating model')
     utils.log('using device: {}'.format(device))
@@ -192,7 +169,8 @@ def main(args=None):
             initializer = None
 
         tf.get_variable_scope().set_initializer(initializer)
-        decode_only = args.decode is not None or args.eval or args.align  # exempt from creating gradient ops
+        # exempt from creating gradient ops
+        decode_only = args.decode is not None or args.eval or args.align or args.serve or args.export
         model = MultiTaskModel(name='main', checkpoint_dir=checkpoint_dir, decode_only=decode_only, **config)
 
     utils.log('model parameters ({})'.format(len(tf.global_variables())))
@@ -206,11 +184,7 @@ def main(args=None):
         parameter_count += v
     utils.log('number of parameters: {}'.format(parameter_count))
 
-    tf_config = tf.ConfigProto(log_device_placement=False, allow_soft_placement=True)
-    tf_config.gpu_options.allow_growth = config.allow_growth
-    tf_config.gpu_options.per_process_gpu_memory_fraction = config.mem_fraction
-
-    with tf.Session(config=tf_config) as sess:
+    with tf.Session(config=get_session_config(config)) as sess:
         best_checkpoint = os.path.join(checkpoint_dir, 'best')
 
         if config.ensemble and (args.eval or args.decode is not None):
@@ -218,7 +192,8 @@ def main(args=None):
             sess = [tf.Session() for _ in config.checkpoints]
             for sess_, checkpoint in zip(sess, config.checkpoints):
                 model.initialize(sess_, [checkpoint], reset=True)
-        elif (not config.checkpoints and (args.eval or args.decode is not None or args.align) and
+        elif (not config.checkpoints and (args.eval or args.decode is not None or args.align or args.serve or
+                                          args.export) and
              (os.path.isfile(best_checkpoint + '.index') or os.path.isfile(best_checkpoint + '.index'))):
             # in decoding and evaluation mode, unless specified otherwise (by `checkpoints`),
             # try to load the best checkpoint)
@@ -236,6 +211,10 @@ def main(args=None):
             model.evaluate(sess, on_dev=False, **config)
         elif args.align:
             model.align(sess, **config)
+        elif args.serve:
+            model.serve(sess, **config)
+        elif args.export:
+            model.export(sess, args.export, quantize=config.quantize)
         elif args.train:
             eval_output = os.path.join(config.model_dir, 'eval')
             try:
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import shelve
+
+from collections import OrderedDict
+
+
+class TranslationCache(object):
+    """
+    Cache of translations, indexed by source sentence (one for each encoder).
+
+    Entries are kept in a in-memory LRU dictionary, and optionally in an on-disk store
+    (shared between runs). Because a translation depends on the model and on the decoding
+    parameters, every cache is tied to a `fingerprint` of those: entries on disk that were
+    created with a different fingerprint are never returned.
+
+    Example:
+    >>> cache = TranslationCache({'beam_size': 1}, max_size=2)
+    >>> key = cache.key(['the  cat\\n'])
+    >>> cache.put(key, 'le chat')
+    >>> cache.get(cache.key(['the cat']))
+    'le chat'
+    """
+
+    def __init__(self, fingerprint, max_size=10000, filename=None, character_level=None):
+        """
+        :param fingerprint: dictionary of parameters that affect the output of the decoder
+          (e.g. checkpoint files, beam size, etc.)
+        :param max_size: maximum number of entries kept in memory
+        :param filename: path to the on-disk store, or None to keep the cache in memory only
+        :param character_level: list of booleans (one for each encoder), sentences are normalized
+          differently at the character level
+        """
+        fingerprint = json.dumps(fingerprint, sort_keys=True, default=str)
+        self.fingerprint = hashlib.sha1(fingerprint.encode()).hexdigest()
+        self.max_size = max_size
+        self.character_level = character_level
+        self.memory = OrderedDict()
+        self.store = shelve.open(filename) if filename else None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, sentence_tuple):
+        """
+        Normalize a tuple of source sentences, so that sentences which produce the same
+        token ids have the same key.
+        """
+        character_level = self.character_level or [False] * len(sentence_tuple)
+        return tuple(
+            sentence.rstrip('\n') if char_level else ' '.join(sentence.split())
+            for sentence, char_level in zip(sentence_tuple, character_level)
+        )
+
+    def _store_key(self, key):
+        return '\n'.join((self.fingerprint,) + key)
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+
+        if self.store is not None:
+            value = self.store.get(self._store_key(key))
+            if value is not None:
+                self._put_in_memory(key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._put_in_memory(key, value)
+        if self.store is not None:
+            self.store[self._store_key(key)] = value
+
+    def _put_in_memory(self, key, value):
+        if self.max_size <= 0:
+            return
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
@@ -6,6 +6,7 @@ from tensorflow.contrib.rnn import BasicLSTMCell, DropoutWrapper
 from tensorflow.contrib.layers import fully_connected
 from translate.rnn import get_variable_unsafe, linear_unsafe, multi_rnn_unsafe, orthogonal_initializer
 from translate.rnn import multi_bidirectional_rnn_unsafe, unsafe_decorator, MultiRNNCell, GRUCell
+from translate.rnn import ProjectedInputGRUCell
 from translate import utils
 from collections import namedtuple
 
@@ -52,13 +53,20 @@ def multi_encoder(encoder_inputs, encoders, encoder_input_length, dropout=None,
             encoder_inputs_ = encoder_inputs[i]
             encoder_input_length_ = encoder_input_length[i]
 
+            assert not (encoder.use_lstm and encoder.precompute_inputs), (
+                'precompute_inputs is only supported by GRU encoders')
+
             # TODO: use state_is_tuple=True
             if encoder.use_lstm:
                 cell = BasicLSTMCell(encoder.cell_size, state_is_tuple=False)
+            elif encoder.precompute_inputs:
+                # the input dropout is applied before projecting the inputs of all time steps at once
+                cell = ProjectedInputGRUCell(encoder.cell_size, initializer=orthogonal_initializer(),
+                                             input_keep_prob=dropout)
             else:
                 cell = GRUCell(encoder.cell_size, initializer=orthogonal_initializer())
 
-            if dropout is not None:
+            if dropout is not None and not isinstance(cell, ProjectedInputGRUCell):
                 cell = DropoutWrapper(cell, input_keep_prob=dropout)
 
             embedding = embedding_variables[i]
@@ -220,7 +228,7 @@ def local_attention(state, prev_weights, hidden_states, encoder, scope=None, **k
         compute_energy_ = compute_energy_with_filter if encoder.attention_filters > 0 else compute_energy
         e = compute_energy_(
             hidden_states, state, prev_weights=prev_weights, attention_filters=encoder.attention_filters,
-            attention_filter_length=encoder.attention_filter_length
+            attention_filter_length=encoder.attention_filter_length, attn_size=encoder.attn_size
         )
 
         # we have to use this mask thing, because the slice operation
@@ -237,11 +245,73 @@ def local_attention(state, prev_weights, hidden_states, encoder, scope=None, **k
         return weighted_average, weights
 
 
+def windowed_local_attention(state, prev_weights, hidden_states, encoder, encoder_input_length, scope=None,
+                             **kwargs):
+    """
+    Faster variant of `local_attention` (with `windowed_attention`), whose energies and weighted average
+    are only computed over the `2 * attention_window_size + 1` encoder states around the aligned position,
+    which are gathered for each batch row. Its cost doesn't depend on the length of the input.
+
+    This is not the same model as `local_attention` (which can't be used to decode its checkpoints):
+    the aligned position is scaled by the true length of each input (instead of the padded length),
+    the softmax is only over the valid positions of the window (instead of the entire padded input,
+    where the positions outside of the window have an energy of zero), and the attention filters
+    are applied to the window of previous weights.
+    """
+    attn_length = tf.shape(hidden_states)[1]
+    state_size = state.get_shape()[1].value
+    window_size = encoder.attention_window_size
+
+    with tf.variable_scope(scope or 'attention'):
+        S = tf.reshape(tf.to_float(encoder_input_length), [-1, 1])  # source length
+
+        wp = get_variable_unsafe('Wp', [state_size, state_size])
+        vp = get_variable_unsafe('vp', [state_size, 1])
+
+        pt = tf.nn.sigmoid(tf.matmul(tf.nn.tanh(tf.matmul(state, wp)), vp))
+        pt = tf.floor(S * tf.reshape(pt, [-1, 1]))  # aligned position in the source sentence
+
+        batch_size = tf.shape(state)[0]
+
+        # positions of the window in the source sentence, shape (batch_size, 2 * window_size + 1)
+        offsets = tf.to_float(tf.range(-window_size, window_size + 1))
+        positions = tf.to_int32(pt + offsets)
+
+        mask = tf.to_float(tf.logical_and(positions >= 0, tf.to_float(positions) < S))
+        positions = tf.clip_by_value(positions, 0, attn_length - 1)
+
+        batch_indices = tf.tile(tf.reshape(tf.range(batch_size), [-1, 1]), [1, 2 * window_size + 1])
+        indices = tf.stack([batch_indices, positions], axis=2)
+
+        hidden_window = tf.gather_nd(hidden_states, indices)
+        prev_weights_window = tf.gather_nd(prev_weights, indices)
+
+        compute_energy_ = compute_energy_with_filter if encoder.attention_filters > 0 else compute_energy
+        e = compute_energy_(
+            hidden_window, state, prev_weights=prev_weights_window, attention_filters=encoder.attention_filters,
+            attention_filter_length=encoder.attention_filter_length, attn_size=encoder.attn_size
+        )
+        e = e - tf.reduce_max(e, reduction_indices=(1,), keep_dims=True)
+
+        exp = tf.exp(e) * mask
+        weights = exp / tf.reduce_sum(exp, reduction_indices=(-1,), keep_dims=True)
+
+        sigma = window_size / 2
+        weights = weights * tf.exp(-offsets ** 2 / sigma ** 2)  # result of the truncated normal distribution
+
+        weighted_average = tf.reduce_sum(tf.reshape(weights, [-1, 2 * window_size + 1, 1, 1]) * hidden_window, [1, 2])
+        # masked positions have a weight of zero, so their (clipped) duplicate indices don't change the sum
+        weights = tf.scatter_nd(indices, weights, tf.shape(prev_weights))
+        return weighted_average, weights
+
+
 def attention(state, prev_weights, hidden_states, encoder, **kwargs):
     """
-    Proxy for `local_attention` and `global_attention`
+    Proxy for `local_attention`, `windowed_local_attention` and `global_attention`
     """
-    if encoder.attention_window_size > 0:
+    if encoder.attention_window_size > 0 and encoder.get('windowed_attention'):
+        attention_ = windowed_local_attention
+    elif encoder.attention_window_size > 0:
         attention_ = local_attention
     else:
         attention_ = global_attention
@@ -265,7 +335,8 @@ def multi_attention(state, prev_weights, hidden_states, encoders, encoder_input_
 
 def attention_decoder(targets, initial_state, attention_states, encoders, decoder, encoder_input_length,
                       decoder_input_length=None, dropout=None, feed_previous=0.0, feed_argmax=True,
-                      **kwargs):
+                      output_weights=True, output_states=True, reinforce=True, output_hidden=False, shortlist=None,
+                      softmax_classes=0, class_candidates=None, project_after_loop=False, **kwargs):
     """
     :param targets: tensor of shape (output_length, batch_size)
     :param initial_state: initial state of the decoder (usually the final state of the encoder),
@@ -279,9 +350,27 @@ def attention_decoder(targets, initial_state, attention_states, encoders, decode
     :param dropout: scalar tensor or None, specifying the keep probability (1 - dropout)
     :param feed_previous: scalar tensor corresponding to the probability to use previous decoder output
       instead of the groundtruth as input for the decoder (1 when decoding, between 0 and 1 when training)
+    :param output_weights: return the attention weights (only needed for alignment)
+    :param output_states: return the decoder states at each time step (only needed for MC rollouts)
+    :param reinforce: build the ops that sample from the softmax (when `feed_argmax` is False), and
+      return the samples and the outputs of the last hidden layer (only needed for REINFORCE training)
+    :param output_hidden: return the outputs of the last hidden layer (before the `softmax1` projection),
+      even if `reinforce` is False (needed for sampled softmax)
+    :param shortlist: tensor of shape (shortlist_size,) containing the ids of the target words that can be
+      generated (decoding only). The outputs are computed for those words only, in this order.
+    :param softmax_classes: number of word classes of the class-factored softmax (0 for a regular softmax).
+      Words are split into classes of equal size, by order of id (i.e., by frequency), and the outputs are
+      log-probabilities: log P(class) + log P(word | class).
+    :param class_candidates: scalar tensor, or None. If not None, P(word | class) is only computed for the
+      `class_candidates` most probable classes, and the other outputs are set to a large negative value.
+    :param project_after_loop: compute the output projection for all time steps at once, after the decoder
+      loop, instead of one time step at a time (the loop only computes it when `feed_previous` is used).
+      This is faster for teacher-forced training, but the projection is computed twice for the steps
+      where the previous output is fed.
     :return:
       outputs of the decoder as a tensor of shape (batch_size, output_length, decoder_cell_size)
       attention weights as a tensor of shape (output_length, encoders, batch_size, input_length)
+      (tensors which are not needed according to the above flags are None)
     """
     # TODO: dropout instead of keep probability
     assert decoder.cell_size % 2 == 0, 'cell size must be a multiple of 2'   # because of maxout
@@ -364,33 +453,110 @@ def attention_decoder(targets, initial_state, attention_states, encoders, decode
 
         initial_input = embed(inputs.read(0))   # first symbol is BOS
 
+        # the output projection parameters are created outside of the loop, because the projection can
+        # be computed inside a conditional branch (with `project_after_loop`) or after the loop
+        with tf.variable_scope('softmax1'):
+            matrix = get_variable_unsafe('Matrix', [decoder.embedding_size, output_size])
+            bias = get_variable_unsafe('Bias', [output_size], initializer=tf.constant_initializer(0.0))
+        if softmax_classes:
+            with tf.variable_scope('softmax_class'):
+                get_variable_unsafe('Matrix', [decoder.embedding_size, softmax_classes])
+                get_variable_unsafe('Bias', [softmax_classes], initializer=tf.constant_initializer(0.0))
+
+        if shortlist is not None:
+            # restricted to the words in the shortlist
+            shortlist = tf.cast(shortlist, tf.int64)
+            shortlist_matrix = tf.gather(tf.transpose(matrix), shortlist)
+            shortlist_bias = tf.gather(bias, shortlist)
+
+        if softmax_classes:
+            # the vocabulary is padded with impossible words, so that all classes have the same size
+            class_size = int(math.ceil(output_size / softmax_classes))
+            padding = class_size * softmax_classes - output_size
+            class_matrix = tf.reshape(tf.concat([tf.transpose(matrix), tf.zeros([padding, decoder.embedding_size])], 0),
+                                      [softmax_classes, class_size, decoder.embedding_size])
+            class_bias = tf.reshape(tf.concat([bias, tf.fill([padding], -1e9)], 0), [softmax_classes, class_size])
+
+        def class_factored_softmax(output_):
+            batch_size = tf.shape(output_)[0]
+            class_log_proba = tf.nn.log_softmax(linear_unsafe(output_, softmax_classes, True, scope='softmax_class'))
+
+            if class_candidates is None:
+                word_logits = tf.matmul(output_, tf.reshape(class_matrix, [-1, decoder.embedding_size]),
+                                        transpose_b=True)
+                word_logits = tf.reshape(word_logits, tf.stack([batch_size, softmax_classes, class_size])) + class_bias
+                log_proba = tf.expand_dims(class_log_proba, 2) + tf.nn.log_softmax(word_logits)
+                return tf.reshape(log_proba, tf.stack([batch_size, softmax_classes * class_size]))[:, :output_size]
+
+            class_log_proba, classes = tf.nn.top_k(class_log_proba, k=class_candidates)   # batch_size x k
+
+            # batch_size x k x class_size
+            weights = tf.reshape(tf.gather(class_matrix, classes), tf.stack([batch_size, -1, decoder.embedding_size]))
+            word_logits = tf.reshape(tf.matmul(weights, tf.expand_dims(output_, 2)),
+                                     tf.stack([batch_size, class_candidates, class_size]))
+            word_logits += tf.gather(class_bias, classes)
+            log_proba = tf.expand_dims(class_log_proba, 2) + tf.nn.log_softmax(word_logits)
+
+            word_ids = tf.expand_dims(classes, 2) * class_size + tf.reshape(tf.range(class_size), [1, 1, class_size])
+            batch_ids = tf.tile(tf.reshape(tf.range(batch_size), [-1, 1, 1]),
+                                tf.stack([1, class_candidates, class_size]))
+            indices = tf.reshape(tf.stack([batch_ids, word_ids], axis=3), [-1, 2])
+            shape = tf.stack([batch_size, softmax_classes * class_size])
+
+            log_proba = tf.scatter_nd(indices, tf.reshape(log_proba, [-1]), shape)
+            mask = tf.scatter_nd(indices, tf.ones(tf.shape(indices)[:1]), shape)
+            return (log_proba + (1 - mask) * -1e9)[:, :output_size]
+
+        def project(output_):
+            if shortlist is not None:
+                return tf.matmul(output_, shortlist_matrix, transpose_b=True) + shortlist_bias
+            elif softmax_classes:
+                return class_factored_softmax(output_)
+            else:
+                return linear_unsafe(output_, output_size, True, scope='softmax1')
+
         def _time_step(time, input_, state, output, proj_outputs, decoder_outputs, samples, states, weights,
                        prev_weights):
             context_vector, new_weights = attention_(state, prev_weights=prev_weights)
-            weights = weights.write(time, new_weights)
+            if output_weights:
+                weights = weights.write(time, new_weights)
 
             # FIXME use `output` or `state` here?
             output_ = linear_unsafe([state, input_, context_vector], decoder.cell_size, False, scope='maxout')
             output_ = tf.reduce_max(tf.reshape(output_, tf.stack([batch_size, decoder.cell_size // 2, 2])), axis=2)
             output_ = linear_unsafe(output_, decoder.embedding_size, False, scope='softmax0')
-            decoder_outputs = decoder_outputs.write(time, output_)
-            output_ = linear_unsafe(output_, output_size, True, scope='softmax1')
-            proj_outputs = proj_outputs.write(time, output_)
+            if reinforce or output_hidden or project_after_loop:
+                decoder_outputs = decoder_outputs.write(time, output_)
 
-            argmax = lambda: tf.argmax(output_, 1)
-            softmax = lambda: tf.squeeze(tf.multinomial(tf.log(tf.nn.softmax(output_)), num_samples=1),
-                                         axis=1)
-            target = lambda: inputs.read(time + 1)
+            if project_after_loop:
+                # the projection is only computed in this loop when the previous output is fed
+                argmax = lambda: tf.argmax(project(output_), 1)
+            else:
+                output_ = project(output_)
+                proj_outputs = proj_outputs.write(time, output_)
 
-            sample = tf.case([
-                (tf.logical_and(time < time_steps - 1, tf.random_uniform([]) >= feed_previous), target),
-                (tf.logical_not(feed_argmax), softmax)],
-                default=argmax)   # default case is useful for beam-search
+                if shortlist is not None:
+                    argmax = lambda: tf.gather(shortlist, tf.argmax(output_, 1))
+                else:
+                    argmax = lambda: tf.argmax(output_, 1)
+            target = lambda: inputs.read(time + 1)
+            use_target = tf.logical_and(time < time_steps - 1, tf.random_uniform([]) >= feed_previous)
+
+            if reinforce:
+                softmax = lambda: tf.squeeze(tf.multinomial(tf.log(tf.nn.softmax(output_)), num_samples=1),
+                                             axis=1)
+                sample = tf.case([
+                    (use_target, target),
+                    (tf.logical_not(feed_argmax), softmax)],
+                    default=argmax)   # default case is useful for beam-search
+            else:
+                sample = tf.cond(use_target, target, argmax)
 
             sample.set_shape([None])
             sample = tf.stop_gradient(sample)
 
-            samples = samples.write(time, sample)
+            if reinforce:
+                samples = samples.write(time, sample)
             input_ = embed(sample)
 
             x = tf.concat([input_, context_vector], 1)
@@ -410,7 +576,8 @@ def attention_decoder(targets, initial_state, attention_states, encoders, decode
             else:
                 new_output, new_state = call_cell()
 
-            states = states.write(time, new_state)
+            if output_states:
+                states = states.write(time, new_state)
 
             return (time + 1, input_, new_state, new_output, proj_outputs, decoder_outputs, samples, states, weights,
                     new_weights)
@@ -423,11 +590,23 @@ def attention_decoder(targets, initial_state, attention_states, encoders, decode
             parallel_iterations=decoder.parallel_iterations,
             swap_memory=decoder.swap_memory)
 
-        proj_outputs = proj_outputs.stack()
-        decoder_outputs = decoder_outputs.stack()
-        samples = samples.stack()
-        weights = weights.stack()  # batch_size, encoders, output time, input time
-        states = states.stack()
+        if reinforce or output_hidden or project_after_loop:
+            decoder_outputs = decoder_outputs.stack()
+        else:
+            decoder_outputs = None
+
+        if project_after_loop:
+            # a single (time_steps * batch_size) x vocab_size projection
+            proj_outputs = project(tf.reshape(decoder_outputs, [-1, decoder.embedding_size]))
+            proj_outputs = tf.reshape(proj_outputs, tf.stack([time_steps, batch_size, output_size]))
+        else:
+            proj_outputs = proj_outputs.stack()
+
+        if not (reinforce or output_hidden):
+            decoder_outputs = None
+        samples = samples.stack() if reinforce else None
+        weights = weights.stack() if output_weights else None  # batch_size, encoders, output time, input time
+        states = states.stack() if output_states else None
 
         # weights = tf.Print(weights, [weights[:,0]], summarize=20)
         # tf.control_dependencies()
@@ -448,6 +627,108 @@ def sequence_loss(logits, targets, weights, average_across_timesteps=False, aver
     crossent = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits_, labels=targets_)
     crossent = tf.reshape(crossent, tf.stack([time_steps, batch_size]))
 
+    return _sequence_cost(crossent, weights, average_across_timesteps, average_across_batch, reward)
+
+
+def sampled_sequence_loss(outputs, targets, weights, decoder, num_samples, average_across_timesteps=False,
+                          average_across_batch=True):
+    """
+    Same as `sequence_loss`, but with a sampled softmax (Jean et al., 2015): the cross-entropy is computed
+    over the target words and `num_samples` words sampled from a log-uniform (Zipfian) distribution,
+    instead of the entire vocabulary. This is only meant for training.
+
+    :param outputs: outputs of the last hidden layer of the decoder, before the `softmax1` projection,
+      as a tensor of shape (time_steps, batch_size, embedding_size)
+    :param targets: tensor of shape (time_steps, batch_size)
+    :param weights: tensor of shape (time_steps, batch_size)
+    :param decoder: configuration of the decoder (whose `softmax1` parameters are used)
+    :param num_samples: number of sampled words
+    """
+    time_steps = tf.shape(targets)[0]
+    batch_size = tf.shape(targets)[1]
+
+    outputs_ = tf.reshape(outputs, tf.stack([time_steps * batch_size, outputs.get_shape()[2].value]))
+    targets_ = tf.reshape(tf.to_int64(targets), tf.stack([time_steps * batch_size, 1]))
+
+    with tf.variable_scope('decoder_{}/softmax1'.format(decoder.name), reuse=True):
+        matrix = tf.get_variable('Matrix')
+        bias = tf.get_variable('Bias')
+
+    crossent = tf.nn.sampled_softmax_loss(weights=tf.transpose(matrix), biases=bias, labels=targets_,
+                                          inputs=outputs_, num_sampled=num_samples,
+                                          num_classes=decoder.vocab_size)
+    crossent = tf.reshape(crossent, tf.stack([time_steps, batch_size]))
+
+    return _sequence_cost(crossent, weights, average_across_timesteps, average_across_batch)
+
+
+def chunked_sequence_loss(outputs, targets, weights, decoder, chunk_size, average_across_batch=True):
+    """
+    Same as `sequence_loss` (with the `softmax1` projection), but the logits, the cross-entropy and its
+    gradient are computed by chunks of `chunk_size` time steps, so that the logits of the entire sequence
+    never exist at the same time. The gradients are computed in the forward pass, by a loop which is not
+    differentiated, and are passed to `tf.gradients` through a surrogate loss.
+
+    :param outputs: outputs of the last hidden layer of the decoder, before the `softmax1` projection,
+      as a tensor of shape (time_steps, batch_size, embedding_size)
+    :param targets: tensor of shape (time_steps, batch_size)
+    :param weights: tensor of shape (time_steps, batch_size)
+    :param decoder: configuration of the decoder (whose `softmax1` parameters are used)
+    :param chunk_size: number of time steps in each chunk
+    """
+    with tf.variable_scope('decoder_{}/softmax1'.format(decoder.name), reuse=True):
+        matrix = tf.get_variable('Matrix')
+        bias = tf.get_variable('Bias')
+
+    time_steps = tf.shape(targets)[0]
+    batch_size = tf.shape(targets)[1]
+    embedding_size = outputs.get_shape()[2].value
+
+    if average_across_batch:
+        weights /= tf.cast(batch_size, tf.float32)
+
+    outputs_ = tf.stop_gradient(outputs)
+    matrix_ = tf.stop_gradient(matrix)
+    bias_ = tf.stop_gradient(bias)
+    chunk_count = (time_steps + chunk_size - 1) // chunk_size
+
+    def _chunk(i, loss, grad_outputs, grad_matrix, grad_bias):
+        start = i * chunk_size
+        hidden = tf.reshape(outputs_[start:start + chunk_size], [-1, embedding_size])
+        labels = tf.reshape(targets[start:start + chunk_size], [-1])
+        weights_ = tf.reshape(weights[start:start + chunk_size], [-1, 1])
+
+        logits = tf.matmul(hidden, matrix_) + bias_
+        crossent = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits, labels=labels)
+        loss += tf.reduce_sum(crossent * tf.squeeze(weights_, axis=1))
+
+        # gradient of the weighted cross-entropy w.r.t. the logits
+        grad_logits = (tf.nn.softmax(logits) - tf.one_hot(labels, decoder.vocab_size)) * weights_
+        grad_matrix += tf.matmul(hidden, grad_logits, transpose_a=True)
+        grad_bias += tf.reduce_sum(grad_logits, axis=0)
+        grad_hidden = tf.matmul(grad_logits, matrix_, transpose_b=True)
+        grad_outputs = grad_outputs.write(i, tf.reshape(grad_hidden, tf.stack([-1, batch_size, embedding_size])))
+
+        return i + 1, loss, grad_outputs, grad_matrix, grad_bias
+
+    grad_outputs = tf.TensorArray(dtype=tf.float32, size=chunk_count, infer_shape=False)
+    _, loss, grad_outputs, grad_matrix, grad_bias = tf.while_loop(
+        cond=lambda i, *_: i < chunk_count,
+        body=_chunk,
+        loop_vars=(tf.constant(0), tf.constant(0.0), grad_outputs, tf.zeros_like(matrix), tf.zeros_like(bias))
+    )
+
+    grad_outputs = tf.stop_gradient(grad_outputs.concat())
+    grad_matrix = tf.stop_gradient(grad_matrix)
+    grad_bias = tf.stop_gradient(grad_bias)
+
+    # the value of this surrogate loss is zero, and its gradients are the gradients of the loss
+    surrogate = (tf.reduce_sum(outputs * grad_outputs) + tf.reduce_sum(matrix * grad_matrix) +
+                 tf.reduce_sum(bias * grad_bias))
+    return tf.stop_gradient(loss) + surrogate - tf.stop_gradient(surrogate)
+
+
+def _sequence_cost(crossent, weights, average_across_timesteps=False, average_across_batch=True, reward=None):
     if reward is not None:
         crossent *= tf.stop_gradient(reward)
 
@@ -461,7 +742,7 @@ def sequence_loss(logits, targets, weights, average_across_timesteps=False, aver
     cost = tf.reduce_sum(log_perp)
 
     if average_across_batch:
-        batch_size = tf.shape(targets)[1]
+        batch_size = tf.shape(crossent)[1]
         return cost / tf.cast(batch_size, tf.float32)
     else:
         return cost
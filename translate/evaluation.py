@@ -1,14 +1,15 @@
-import functools
 import subprocess
 import tempfile
+import threading
 import math
+import atexit
 import numpy as np
 import re
 import os
 
 from collections import Counter
 from functools import partial
-from translate import pyter
+from translate import ter, utils
 
 
 def sentence_bleu(hypothesis, reference, smoothing=True, order=4, **kwargs):
@@ -51,6 +52,127 @@ def sentence_bleu(hypothesis, reference, smoothing=True, order=4, **kwargs):
     return math.exp(log_score) * bp
 
 
+def prefix_sentence_bleu(hypothesis, reference, smoothing=True, order=4, **kwargs):
+    """
+    Compute `sentence_bleu` for every prefix of a hypothesis, in a single pass over the hypothesis.
+    The reference n-grams are counted once, and the clipped match counts are updated incrementally
+    each time a token is appended to the prefix.
+
+    :param hypothesis: list of tokens or token ids
+    :param reference: list of tokens or token ids
+    :param smoothing: apply smoothing (recommended, especially for short sequences)
+    :param order: count n-grams up to this value of n.
+    :param kwargs: additional (unused) parameters
+    :return: list of BLEU scores, whose ith element is the score of `hypothesis[:i + 1]`
+    """
+    hypothesis = tuple(hypothesis)
+    reference = tuple(reference)
+
+    ref_ngrams = [Counter(zip(*[reference[j:] for j in range(i + 1)])) for i in range(order)]
+    hyp_ngrams = [Counter() for _ in range(order)]
+    matches = [0] * order
+
+    scores = []
+    for length in range(1, len(hypothesis) + 1):
+        log_score = 0
+
+        for i in range(order):
+            if length > i:
+                ngram = hypothesis[length - i - 1:length]
+                if hyp_ngrams[i][ngram] < ref_ngrams[i][ngram]:  # this n-gram isn't clipped
+                    matches[i] += 1
+                hyp_ngrams[i][ngram] += 1
+
+            numerator = matches[i]
+            denominator = max(length - i, 0)
+
+            if smoothing:
+                numerator += 1
+                denominator += 1
+
+            score = numerator / denominator
+
+            if score == 0:
+                log_score += float('-inf')
+            else:
+                log_score += math.log(score) / order
+
+        bp = min(1, math.exp(1 - len(reference) / length))
+        scores.append(math.exp(log_score) * bp)
+
+    return scores
+
+
+def batch_sentence_bleu(hypotheses, references, hypothesis_length=None, reference_length=None, smoothing=True,
+                        order=4, **kwargs):
+    """
+    Same as `sentence_bleu`, but for an entire batch of token ids at once. Each n-gram of each sentence is
+    given an integer id (computed from the id of its prefix and its last token), so that matches can be
+    counted and clipped with vectorized operations.
+
+    :param hypotheses: matrix of token ids of shape (batch_size, max_length)
+    :param references: matrix of token ids of shape (batch_size, max_length)
+    :param hypothesis_length: length of each hypothesis (default: entire rows)
+    :param reference_length: length of each reference (default: entire rows)
+    :param smoothing: apply smoothing (recommended, especially for short sequences)
+    :param order: count n-grams up to this value of n.
+    :param kwargs: additional (unused) parameters
+    :return: array of BLEU scores of shape (batch_size,)
+    """
+    hypotheses = np.asarray(hypotheses, dtype=np.int64)
+    references = np.asarray(references, dtype=np.int64)
+    batch_size = hypotheses.shape[0]
+
+    hypothesis_length = np.asarray(hypothesis_length if hypothesis_length is not None
+                                   else [hypotheses.shape[1]] * batch_size)
+    reference_length = np.asarray(reference_length if reference_length is not None
+                                  else [references.shape[1]] * batch_size)
+
+    # hypotheses and references in the same matrix, so that the same n-grams get the same ids
+    max_length = max(hypotheses.shape[1], references.shape[1])
+    ids = np.zeros([2 * batch_size, max_length], dtype=np.int64)
+    ids[:batch_size, :hypotheses.shape[1]] = hypotheses
+    ids[batch_size:, :references.shape[1]] = references
+    length = np.concatenate([hypothesis_length, reference_length])
+    sentence = np.tile(np.arange(batch_size), 2)
+
+    base = int(ids.max(initial=0)) + 1
+    keys = np.zeros([2 * batch_size, max_length], dtype=np.int64) + sentence[:, None]  # n-gram ids for n = 0
+
+    log_score = np.zeros(batch_size)
+
+    for n in range(1, order + 1):
+        # id of the n-gram starting at position j: pair of ids ((n-1)-gram at j, token at j + n - 1)
+        keys = keys[:, :max(max_length - n + 1, 0)] * base + ids[:, n - 1:]
+        unique_keys, keys = np.unique(keys, return_inverse=True)
+        keys = keys.reshape([2 * batch_size, -1])
+
+        mask = np.arange(keys.shape[1]) + n <= length[:, None]
+        hyp_counts = np.bincount(keys[:batch_size][mask[:batch_size]], minlength=len(unique_keys))
+        ref_counts = np.bincount(keys[batch_size:][mask[batch_size:]], minlength=len(unique_keys))
+
+        key_sentence = np.zeros(len(unique_keys), dtype=np.int64)
+        key_sentence[keys] = sentence[:, None]
+        matches = np.minimum(hyp_counts, ref_counts)
+
+        numerator = np.bincount(key_sentence, weights=matches, minlength=batch_size)
+        denominator = np.maximum(hypothesis_length - n + 1, 0).astype(np.float64)
+
+        if smoothing:
+            numerator += 1
+            denominator += 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_score += np.log(numerator / denominator) / order
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bp = np.minimum(1, np.exp(1 - reference_length / hypothesis_length))
+        scores = np.exp(log_score) * bp
+
+    scores[hypothesis_length == 0] = 0
+    return scores
+
+
 def score_function_decorator(reversed=False):
     def decorator(func):
         func.reversed = reversed
@@ -110,7 +232,12 @@ def corpus_bleu(hypotheses, references, smoothing=False, order=4, **kwargs):
 
 @score_function_decorator(reversed=True)
 def corpus_ter(hypotheses, references, **kwargs):
-    scores = [pyter.ter(hyp.split(), ref.split()) for hyp, ref in zip(hypotheses, references)]
+    """
+    Average sentence-level TER, compatible with `pyter` (same scores): the shifts are not bounded in size or
+    distance, and words are matched case-sensitively without tercom's normalization. These scores can differ
+    from those of tercom (see `corpus_tercom`), which should be used for reporting.
+    """
+    scores = [ter.ter(hyp.split(), ref.split()) for hyp, ref in zip(hypotheses, references)]
     score = 100 * sum(scores) / len(scores)
 
     hyp_length = sum(len(hyp.split()) for hyp in hypotheses)
@@ -119,8 +246,13 @@ def corpus_ter(hypotheses, references, **kwargs):
     return score, 'ratio={:.3f}'.format(hyp_length / ref_length)
 
 
-@score_function_decorator(reversed=True)
-def corpus_tercom(hypotheses, references, case_sensitive=True, **kwargs):
+def run_tercom(hypotheses, references, case_sensitive=True, tercom_jar='scripts/tercom.jar'):
+    """
+    Score the segments with a new tercom process. This is slower than `TercomWorker` (a JVM is started at
+    each call), but works with any version of Java.
+
+    :return: total TER, and list of sentence-level TER scores
+    """
     with tempfile.NamedTemporaryFile('w') as hypothesis_file, tempfile.NamedTemporaryFile('w') as reference_file:
         for i, (hypothesis, reference) in enumerate(zip(hypotheses, references)):
             hypothesis_file.write('{} ({})\n'.format(hypothesis, i))
@@ -128,27 +260,154 @@ def corpus_tercom(hypotheses, references, case_sensitive=True, **kwargs):
         hypothesis_file.flush()
         reference_file.flush()
 
-        cmd = ['java', '-jar', 'scripts/tercom.jar', '-h', hypothesis_file.name, '-r', reference_file.name]
+        filename = tempfile.mktemp()
+
+        cmd = ['java', '-jar', tercom_jar, '-h', hypothesis_file.name, '-r', reference_file.name,
+               '-o', 'ter', '-n', filename]
         if case_sensitive:
             cmd.append('-s')
 
-        output = subprocess.check_output(cmd).decode()
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode()
+        total = float(re.findall(r'Total TER: (.*?) ', output, re.MULTILINE)[0])
+
+    with open(filename + '.ter') as f:
+        lines = list(f)
+        scores = [float(line.split(' ')[-1]) for line in lines[2:]]
+
+    os.remove(filename + '.ter')
+    return total, scores
+
+
+class TercomWorker(object):
+    """
+    Long-lived tercom process (`scripts/TercomServer.java`), which scores segment pairs sent over a pipe.
+    This avoids starting a new JVM for each evaluation or batch of rewards.
+
+    The server is launched from its source file, which requires Java 11 or newer. If the process dies or
+    doesn't answer in time, it is restarted once. If it fails again, the worker is disabled and `score` raises
+    an `IOError` right away: `corpus_tercom` and `batch_tercom_reward` then fall back to `run_tercom`.
+    """
+    chunk_size = 1000   # segments written before reading their scores (so that no pipe buffer fills up)
+
+    def __init__(self, case_sensitive=True, tercom_jar='scripts/tercom.jar', source='scripts/TercomServer.java',
+                 timeout=300):
+        """
+        :param timeout: maximum time in seconds to score a chunk of segments, after which the process is killed
+        """
+        self.cmd = ['java', '-cp', tercom_jar, source]
+        if case_sensitive:
+            self.cmd.append('-s')
+        self.timeout = timeout
+        self.process = None
+        self.disabled = False
+
+    def start(self):
+        self.close()
+        self.process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1)
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (IOError, OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+            self.process = None
+
+    def _score(self, hypotheses, references):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        scores = []
+        pairs = list(zip(hypotheses, references))
+        for i in range(0, len(pairs), self.chunk_size):
+            chunk = pairs[i:i + self.chunk_size]
+            # `readline` can't time out: a stuck process is killed instead, which closes its output
+            watchdog = threading.Timer(self.timeout, self.process.kill)
+            watchdog.start()
+            try:
+                for hypothesis, reference in chunk:
+                    # one segment pair per line: tabs and line breaks can't be part of the segments
+                    hypothesis, reference = (' '.join(s.split()) for s in (hypothesis, reference))
+                    self.process.stdin.write('{}\t{}\n'.format(hypothesis, reference))
+                self.process.stdin.flush()
+
+                for _ in chunk:
+                    line = self.process.stdout.readline()
+                    if not line:
+                        raise IOError('tercom worker stopped unexpectedly')
+                    edits, words = line.split()
+                    scores.append((float(edits), float(words)))
+            finally:
+                watchdog.cancel()
+
+        return scores
+
+    def score(self, hypotheses, references):
+        """
+        :param hypotheses: list of strings
+        :param references: list of strings
+        :return: list of (number of edits, number of reference words) for each segment
+        """
+        if self.disabled:
+            raise IOError('tercom worker is disabled')
+
+        try:
+            return self._score(hypotheses, references)
+        except (IOError, OSError, ValueError) as e:
+            utils.warn('restarting tercom worker ({})'.format(e))
+
+        try:
+            self.start()
+            return self._score(hypotheses, references)
+        except (IOError, OSError, ValueError):
+            utils.warn('disabling tercom worker (scripts/TercomServer.java needs Java 11 or newer)')
+            self.close()
+            self.disabled = True
+            raise
+
+
+_tercom_workers = {}
+
+
+def get_tercom_worker(case_sensitive=True):
+    """
+    Tercom worker shared by all calls with the same parameters (started at the first call, and closed at exit)
+    """
+    if case_sensitive not in _tercom_workers:
+        worker = TercomWorker(case_sensitive=case_sensitive)
+        atexit.register(worker.close)
+        _tercom_workers[case_sensitive] = worker
+    return _tercom_workers[case_sensitive]
+
+
+@score_function_decorator(reversed=True)
+def corpus_tercom(hypotheses, references, case_sensitive=True, **kwargs):
+    try:
+        scores = get_tercom_worker(case_sensitive).score(hypotheses, references)
+    except (IOError, OSError, ValueError) as e:
+        utils.debug('tercom worker failed ({}), running tercom'.format(e))
+        total, _ = run_tercom(hypotheses, references, case_sensitive=case_sensitive)
+        return 100 * total, ''
 
-        error = re.findall(r'Total TER: (.*?) ', output, re.MULTILINE)[0]
-        return float(error) * 100, ''
+    edits = sum(edits for edits, _ in scores)
+    words = sum(words for _, words in scores)
+
+    return 100 * edits / words, ''   # same as "Total TER" in tercom
 
 
 @score_function_decorator(reversed=True)
 def corpus_wer(hypotheses, references, **kwargs):
-    scores = [
-        levenhstein(tuple(hyp.split()), tuple(ref.split())) / len(ref.split())
-        for hyp, ref in zip(hypotheses, references)
-    ]
+    hypotheses = [hyp.split() for hyp in hypotheses]
+    references = [ref.split() for ref in references]
+    distances = batch_levenhstein(hypotheses, references).tolist()
+    scores = [distance / len(ref) for distance, ref in zip(distances, references)]
 
     score = 100 * sum(scores) / len(scores)
 
-    hyp_length = sum(len(hyp.split()) for hyp in hypotheses)
-    ref_length = sum(len(ref.split()) for ref in references)
+    hyp_length = sum(len(hyp) for hyp in hypotheses)
+    ref_length = sum(len(ref) for ref in references)
 
     return score, 'ratio={:.3f}'.format(hyp_length / ref_length)
 
@@ -180,51 +439,131 @@ def corpus_scores_wer(*args, **kwargs):
 corpus_scores_bleu = corpus_scores
 
 
-@functools.lru_cache(maxsize=1024)
 def levenhstein(src, trg):
-    # Dynamic programming by memoization
-    if len(src) == 0:
-        return len(trg)
-    elif len(trg) == 0:
-        return len(src)
-
-    return min(
-        int(src[0] != trg[0]) + levenhstein(src[1:], trg[1:]),
-        1 + levenhstein(src[1:], trg),
-        1 + levenhstein(src, trg[1:])
-    )
+    """
+    Edit distance between two sequences of tokens, with the bit-parallel algorithm of Myers (1999), in the
+    formulation of Hyyrö (2001). The columns of the dynamic programming matrix are encoded as bit vectors
+    (Python integers of any size), so that each token of `src` only costs a few integer operations.
+    """
+    distances = prefix_levenhstein(src, trg)
+    return distances[-1] if distances else len(trg)
 
 
-# Reward functions
+def prefix_levenhstein(src, trg):
+    """
+    Edit distances between each prefix of `src` and `trg` (which are computed by `levenhstein` anyway)
 
-def batch_tercom_reward(hypotheses, references, case_sensitive=True, **kwargs):
-    # Computes 1 - TER at the sentence-level for an entire batch of sentences.
-    # It is better to process an entire batch at a time because this calls a java program (and the
-    # JVM is slow to start)
+    :return: list of distances, whose ith element is the distance between `src[:i + 1]` and `trg`
+    """
+    if len(trg) == 0:
+        return list(range(1, len(src) + 1))
 
-    with tempfile.NamedTemporaryFile('w') as hypothesis_file, tempfile.NamedTemporaryFile('w') as reference_file:
-        for i, (hypothesis, reference) in enumerate(zip(hypotheses, references)):
-            hypothesis_file.write('{} ({})\n'.format(hypothesis, i))
-            reference_file.write('{} ({})\n'.format(reference, i))
-        hypothesis_file.flush()
-        reference_file.flush()
+    peq = {}   # for each token, bit vector of its positions in `trg`
+    for i, token in enumerate(trg):
+        peq[token] = peq.get(token, 0) | (1 << i)
 
-        filename = tempfile.mktemp()
+    mask = (1 << len(trg)) - 1
+    last_bit = 1 << (len(trg) - 1)
+    pv, mv = mask, 0   # positive and negative vertical deltas
+    distance = len(trg)
+    distances = []
 
-        cmd = ['java', '-jar', 'scripts/tercom.jar', '-h', hypothesis_file.name, '-r', reference_file.name,
-               '-o', 'ter', '-n', filename]
-        if case_sensitive:
-            cmd.append('-s')
+    for token in src:
+        eq = peq.get(token, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)   # positive and negative horizontal deltas
+        mh = pv & xh
 
-        output = open('/dev/null', 'w')
-        subprocess.call(cmd, stdout=output, stderr=output)
+        if ph & last_bit:
+            distance += 1
+        elif mh & last_bit:
+            distance -= 1
 
-    with open(filename + '.ter') as f:
-        lines = list(f)
-        scores = [float(line.split(' ')[-1]) for line in lines[2:]]
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        distances.append(distance)
+
+    return distances
+
+
+def batch_levenhstein(sources, targets):
+    """
+    Same as `levenhstein`, for a batch of sequence pairs. Pairs whose target has at most 64 tokens are processed
+    all at once, with numpy arrays of 64-bit vectors.
+
+    :param sources: list of sequences of tokens
+    :param targets: list of sequences of tokens
+    :return: array of edit distances
+    """
+    vocab = {}
+    sources = [[vocab.setdefault(token, len(vocab)) for token in src] for src in sources]
+    targets = [[vocab.setdefault(token, len(vocab)) for token in trg] for trg in targets]
+
+    distances = np.zeros(len(sources), dtype=np.int64)
+    src_length = np.array([len(src) for src in sources], dtype=np.int64)
+    trg_length = np.array([len(trg) for trg in targets], dtype=np.int64)
+
+    short = np.nonzero((trg_length > 0) & (trg_length <= 64))[0]
+    for i in np.nonzero(trg_length > 64)[0]:
+        distances[i] = levenhstein(sources[i], targets[i])
+    distances[trg_length == 0] = src_length[trg_length == 0]
+
+    if len(short) == 0:
+        return distances
+
+    src_length, trg_length = src_length[short], trg_length[short]
+    src_ids = np.full([len(short), src_length.max(initial=0)], -1, dtype=np.int64)
+    trg_ids = np.full([len(short), trg_length.max()], -2, dtype=np.int64)
+    for k, i in enumerate(short):
+        src_ids[k, :len(sources[i])] = sources[i]
+        trg_ids[k, :len(targets[i])] = targets[i]
+
+    one = np.uint64(1)
+    bits = np.left_shift(one, np.arange(trg_ids.shape[1], dtype=np.uint64))
+    mask = np.where(trg_length == 64, ~np.uint64(0), np.left_shift(one, trg_length.astype(np.uint64)) - one)
+    last_bit = np.left_shift(one, (trg_length - 1).astype(np.uint64))
+
+    pv, mv = mask.copy(), np.zeros_like(mask)
+    distance = trg_length.copy()
+
+    with np.errstate(over='ignore'):
+        for j in range(src_ids.shape[1]):
+            active = j < src_length
+            eq = np.where(trg_ids == src_ids[:, j:j + 1], bits, np.uint64(0)).sum(axis=1, dtype=np.uint64)
+            xv = eq | mv
+            xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+            ph = mv | (~(xh | pv) & mask)
+            mh = pv & xh
+
+            delta = np.where(ph & last_bit != 0, 1, np.where(mh & last_bit != 0, -1, 0))
+            distance += np.where(active, delta, 0)
+
+            ph = ((ph << one) | one) & mask
+            mh = (mh << one) & mask
+            pv = np.where(active, mh | (~(xv | ph) & mask), pv)
+            mv = np.where(active, ph & xv, mv)
+
+    distances[short] = distance
+    return distances
 
-    os.remove(filename + '.ter')
-    return [1 - score for score in scores]
+
+# Reward functions
+
+def batch_tercom_reward(hypotheses, references, case_sensitive=True, **kwargs):
+    # Computes 1 - TER at the sentence-level for an entire batch of sentences.
+    # The whole batch is sent at once to the tercom worker process (or to a new tercom process if the
+    # worker doesn't work, because the JVM is slow to start).
+    try:
+        scores = get_tercom_worker(case_sensitive).score(hypotheses, references)
+    except (IOError, OSError, ValueError) as e:
+        utils.debug('tercom worker failed ({}), running tercom'.format(e))
+        _, scores = run_tercom(hypotheses, references, case_sensitive=case_sensitive)
+        return [1 - score for score in scores]
+
+    return [1 - (edits / words if words > 0 else float(edits > 0)) for edits, words in scores]
 
 
 def ter_reward(hypothesis, reference, **kwargs):
@@ -232,17 +571,49 @@ def ter_reward(hypothesis, reference, **kwargs):
     This is not exactly TER, but 1 - TER,
     which is necessary for this to be a reward function (the higher the better)
     """
-    return 1 - pyter.ter(hypothesis, reference)
+    return 1 - ter.ter(hypothesis, reference)
+
+
+def batch_ter_reward(hypotheses, references, hypothesis_length=None, reference_length=None, **kwargs):
+    """
+    Same as `ter_reward`, for matrices of token ids of shape (batch_size, max_length)
+    """
+    hypothesis_length = [len(hyp) for hyp in hypotheses] if hypothesis_length is None else hypothesis_length
+    reference_length = [len(ref) for ref in references] if reference_length is None else reference_length
+
+    return np.array([1 - ter.ter(hyp[:n], ref[:m]) for hyp, ref, n, m in
+                     zip(hypotheses, references, hypothesis_length, reference_length)])
 
 
 def wer_reward(hypothesis, reference, **kwargs):
     """
     1 - WER
+
+    :param hypothesis: list of tokens or token ids
+    :param reference: list of tokens or token ids
+    """
+    return 1 - levenhstein(hypothesis, reference) / max(len(reference), 1)
+
+
+def prefix_wer_reward(hypothesis, reference, **kwargs):
+    """
+    Same as `wer_reward`, for every prefix of `hypothesis` (in a single pass)
+
+    :return: list of rewards, whose ith element is the reward of `hypothesis[:i + 1]`
+    """
+    return [1 - distance / max(len(reference), 1) for distance in prefix_levenhstein(hypothesis, reference)]
+
+
+def batch_wer_reward(hypotheses, references, hypothesis_length=None, reference_length=None, **kwargs):
+    """
+    1 - WER, for matrices of token ids of shape (batch_size, max_length)
     """
-    reference = tuple(reference.split())
-    hypothesis = tuple(hypothesis.split())
+    hypothesis_length = [len(hyp) for hyp in hypotheses] if hypothesis_length is None else hypothesis_length
+    reference_length = [len(ref) for ref in references] if reference_length is None else reference_length
 
-    return 1 - levenhstein(hypothesis, reference) / len(reference)
+    hypotheses = [list(hyp[:n]) for hyp, n in zip(hypotheses, hypothesis_length)]
+    references = [list(ref[:n]) for ref, n in zip(references, reference_length)]
+    return 1 - batch_levenhstein(hypotheses, references) / np.maximum(reference_length, 1)
 
 
 def bleu_reward(hypothesis, reference, **kwargs):
@@ -0,0 +1,268 @@
+import json
+import numpy as np
+import tensorflow as tf
+
+from collections import namedtuple
+from translate import utils, numpy_model
+from translate.seq2seq_model import Seq2SeqModel
+from translate.translation_model import TranslationModel
+
+
+def _strip_embedding(encoder_or_decoder):
+    # embeddings can be quite large, and are already part of the exported parameters
+    return {k: v for k, v in encoder_or_decoder.items() if k != 'embedding'}
+
+
+def export(model, sess, filename):
+    """
+    Write a frozen inference graph (where variables are replaced by constants) to a binary `GraphDef` file,
+    and the names of its tensors, the vocabularies and the decoding parameters to a JSON file (same
+    name + `.json`). These files can be loaded by `FrozenTranslationModel`, which doesn't need to build
+    the model or to restore a checkpoint.
+
+    :param model: instance of `TranslationModel`, whose parameters are loaded in `sess`
+    :param sess: TensorFlow session
+    :param filename: path to the output `GraphDef` file
+    """
+    seq2seq_model = model.seq2seq_model
+    if seq2seq_model.dropout is not None:
+        sess.run(seq2seq_model.dropout_off)   # the value of dropout is frozen too
+
+    tensors = dict(
+        encoder_inputs=seq2seq_model.encoder_inputs,
+        encoder_input_length=seq2seq_model.encoder_input_length,
+        attention_states=seq2seq_model.attention_states,
+        encoder_state=seq2seq_model.encoder_state,
+        targets=seq2seq_model.targets,
+        target_length=seq2seq_model.target_length,
+        feed_previous=seq2seq_model.feed_previous,
+        outputs=seq2seq_model.outputs,
+        beam_output=seq2seq_model.beam_output,
+        beam_tensors=list(seq2seq_model.beam_tensors)
+    )
+    if seq2seq_model.shortlist is not None:
+        tensors['shortlist'] = seq2seq_model.shortlist
+    if seq2seq_model.class_candidates is not None:
+        tensors['class_candidates'] = seq2seq_model.class_candidates
+    tensor_names = {
+        k: [tensor.name for tensor in v] if isinstance(v, list) else v.name
+        for k, v in tensors.items()
+    }
+    output_nodes = set()
+    for v in tensors.values():
+        output_nodes.update(tensor.op.name for tensor in (v if isinstance(v, list) else [v]))
+
+    # only keeps the nodes that are needed to compute the decoding tensors (no gradients or losses)
+    graph_def = tf.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), list(output_nodes))
+    for node in graph_def.node:
+        node.device = ''   # placement is decided when loading
+
+    data = dict(
+        tensors=tensor_names,
+        name=model.name,
+        encoders=[_strip_embedding(encoder) for encoder in seq2seq_model.encoders],
+        decoder=_strip_embedding(seq2seq_model.decoder),
+        extensions=model.extensions,
+        binary_input=model.binary_input,
+        character_level=model.character_level,
+        vocabs=[vocab.reverse if vocab is not None else None for vocab in model.vocabs],
+        config=dict(
+            batch_size=model.batch_size,
+            max_input_len=model.max_input_len,
+            max_output_len=seq2seq_model.max_output_len,
+            len_normalization=seq2seq_model.len_normalization,
+            lm_weight=seq2seq_model.lm_weight,
+            softmax_classes=seq2seq_model.softmax_classes
+        )
+    )
+
+    utils.log('exporting model to {} ({} nodes)'.format(filename, len(graph_def.node)))
+    with open(filename, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(filename + '.json', 'w') as f:
+        json.dump(data, f)
+
+
+def export_numpy(model, sess, filename, quantize=False):
+    """
+    Write the parameters of the model to a `.npz` file, along with its configuration and vocabularies.
+    This file can be loaded by `numpy_model.NumpyTranslationModel`, which doesn't need TensorFlow.
+
+    :param model: instance of `TranslationModel`, whose parameters are loaded in `sess`
+    :param sess: TensorFlow session
+    :param filename: path to the output file
+    :param quantize: quantize the embeddings and the output projection to int8 (with one scale per token)
+    """
+    seq2seq_model = model.seq2seq_model
+    prefixes = tuple('embedding_{}'.format(name) for name in seq2seq_model.extensions)
+    prefixes += tuple('encoder_{}/'.format(name) for name in seq2seq_model.encoder_names)
+    prefixes += ('decoder_{}/'.format(seq2seq_model.decoder_name),)
+
+    variables = [var for var in tf.global_variables() if var.name.startswith(prefixes)]
+    values = sess.run(variables)
+    params = {var.name.split(':')[0]: value for var, value in zip(variables, values)}
+
+    if quantize:
+        for name, axis in numpy_model.quantized_parameters(seq2seq_model.encoders, seq2seq_model.decoder):
+            if name + '/scales' not in params:   # parameters can be listed twice (e.g. shared embeddings)
+                params[name], params[name + '/scales'] = numpy_model.quantize_matrix(params[name], axis=axis)
+
+    config = dict(
+        encoders=[_strip_embedding(encoder) for encoder in seq2seq_model.encoders],
+        decoder=_strip_embedding(seq2seq_model.decoder),
+        character_level=model.character_level,
+        vocabs=[vocab.reverse if vocab is not None else None for vocab in model.vocabs],
+        batch_size=model.batch_size,
+        max_input_len=model.max_input_len,
+        max_output_len=seq2seq_model.max_output_len,
+        len_normalization=seq2seq_model.len_normalization,
+        softmax_temperature=seq2seq_model.softmax_temperature,
+        softmax_classes=seq2seq_model.softmax_classes
+    )
+
+    utils.log('exporting model to {} ({} variables)'.format(filename, len(params)))
+    with open(filename, 'wb') as f:
+        np.savez(f, __config__=json.dumps(config), **params)
+
+
+def load(filename):
+    """
+    Read the files written by `export`
+
+    :param filename: path to the `GraphDef` file (the other parameters are read from `filename + '.json'`)
+    :return: dictionary containing the parameters, and the parsed `GraphDef` (key `graph_def`)
+    """
+    with open(filename + '.json') as f:
+        data = json.load(f)
+
+    graph_def = tf.GraphDef()
+    with open(filename, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    data['graph_def'] = graph_def
+    return data
+
+
+class FrozenSeq2SeqModel(Seq2SeqModel):
+    """
+    Same decoding interface as `Seq2SeqModel` (`greedy_decoding` and `beam_search_decoding`),
+    but whose tensors are read from an existing graph (imported from a frozen graph).
+    """
+
+    def __init__(self, graph, tensors, encoders, decoder, max_output_len=50, max_input_len=None,
+                 len_normalization=1.0, lm_weight=None, softmax_classes=0, **kwargs):
+        # `Seq2SeqModel.__init__` isn't called: it would build a new graph
+        self.encoders = encoders
+        self.decoder = decoder
+        self.encoder_count = len(encoders)
+        self.trg_vocab_size = decoder.vocab_size
+        self.binary_input = [encoder.name for encoder in encoders if encoder.binary]
+        self.encoder_names = [encoder.name for encoder in encoders]
+        self.decoder_name = decoder.name
+        self.extensions = self.encoder_names + [self.decoder_name]
+
+        self.max_output_len = max_output_len
+        self.max_input_len = max_input_len
+        self.len_normalization = len_normalization
+        self.lm_weight = lm_weight
+        self.dropout = None
+
+        get_tensor = graph.get_tensor_by_name
+        self.encoder_inputs = [get_tensor(name) for name in tensors['encoder_inputs']]
+        self.encoder_input_length = [get_tensor(name) for name in tensors['encoder_input_length']]
+        self.attention_states = [get_tensor(name) for name in tensors['attention_states']]
+        self.encoder_state = get_tensor(tensors['encoder_state'])
+        self.targets = get_tensor(tensors['targets'])
+        self.target_length = get_tensor(tensors['target_length'])
+        self.feed_previous = get_tensor(tensors['feed_previous'])
+        self.outputs = get_tensor(tensors['outputs'])
+        self.beam_output = get_tensor(tensors['beam_output'])
+
+        beam_tensors = namedtuple('beam_tensors', 'state new_state output new_output')
+        self.beam_tensors = beam_tensors(*[get_tensor(name) for name in tensors['beam_tensors']])
+        self.shortlist = get_tensor(tensors['shortlist']) if 'shortlist' in tensors else None
+        self.class_candidates = get_tensor(tensors['class_candidates']) if 'class_candidates' in tensors else None
+        self.softmax_classes = softmax_classes
+
+
+class FrozenTranslationModel(TranslationModel):
+    """
+    Translation model loaded from a file written by `export`. It has the same decoding interface as
+    `TranslationModel` (`decode`, `evaluate`, `serve`), but cannot be trained.
+    The parameters that are not specified (e.g. `batch_size`) are set to their value at export time.
+
+    Example:
+        model = FrozenTranslationModel('model.frozen')
+        with tf.Session(graph=model.graph) as sess:
+            model.decode(sess, beam_size=1)
+    """
+
+    def __init__(self, filename, data=None, name=None, batch_size=None, max_input_len=None, max_output_len=None,
+                 len_normalization=None, lm_weight=None, lm_file=None, shortlist_size=0, lexical_table=None,
+                 lexical_candidates=10, **kwargs):
+        """
+        :param filename: path to the `GraphDef` file written by `export`
+        :param data: content of the exported files, if they were already read by `load`
+        :param kwargs: other parameters, e.g. `decode` or `eval` (files to translate)
+        """
+        data = data or load(filename)
+
+        super(TranslationModel, self).__init__(name or data['name'], checkpoint_dir=None, **kwargs)
+        self.loaded_checkpoints = [filename]
+
+        config = data['config']
+
+        def get_value(key, value):
+            return config[key] if value is None else value
+
+        self.batch_size = get_value('batch_size', batch_size)
+        self.max_input_len = get_value('max_input_len', max_input_len)
+
+        self.extensions = data['extensions']
+        self.src_ext = self.extensions[:-1]
+        self.trg_ext = self.extensions[-1]
+        self.binary_input = data['binary_input']
+        self.character_level = data['character_level']
+
+        vocab = namedtuple('vocab', 'vocab reverse')
+        self.vocabs = [
+            vocab(dict((token, i) for i, token in enumerate(reverse)), reverse) if reverse is not None else None
+            for reverse in data['vocabs']
+        ]
+        self.src_vocab = self.vocabs[:-1]
+        self.trg_vocab = self.vocabs[-1]
+
+        test = kwargs.get('decode')  # empty list means we decode from standard input
+        if test is None:
+            test = kwargs.get('eval')
+        self.filenames = utils.AttrDict(train=None, dev=[], test=test, vocab=None, lm_path=lm_file, embeddings=None)
+        self.ngrams = self.filenames.lm_path and utils.read_ngrams(self.filenames.lm_path, self.trg_vocab.vocab)
+
+        utils.debug('importing frozen graph')
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(data['graph_def'], name='')
+
+        encoders = [utils.AttrDict(encoder) for encoder in data['encoders']]
+        decoder = utils.AttrDict(data['decoder'])
+        self.seq2seq_model = FrozenSeq2SeqModel(
+            self.graph, data['tensors'], encoders, decoder, max_input_len=self.max_input_len,
+            max_output_len=get_value('max_output_len', max_output_len),
+            len_normalization=get_value('len_normalization', len_normalization),
+            lm_weight=get_value('lm_weight', lm_weight),
+            softmax_classes=config.get('softmax_classes', 0)
+        )
+
+        # only used if the model was exported with shortlist support
+        self._read_lexical_table(shortlist_size, lexical_table, lexical_candidates)
+
+        self.global_step = None
+        self.batch_iterator = None
+        self.dev_batches = None
+        self.train_size = None
+
+    def initialize(self, *args, **kwargs):
+        pass   # parameters are constants of the graph
+
+    def read_data(self, *args, **kwargs):
+        raise NotImplementedError('a frozen model cannot be trained')
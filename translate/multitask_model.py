@@ -1,7 +1,9 @@
 import time
 import math
 import numpy as np
-from translate import utils
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from translate import utils, frozen
 from translate.translation_model import TranslationModel, BaseTranslationModel
 
 
@@ -22,6 +24,7 @@ class MultiTaskModel(BaseTranslationModel):
             kwargs_ = dict(**kwargs)
             kwargs_.update(task)
             model = TranslationModel(checkpoint_dir=None, keep_best=keep_best, **kwargs_)
+            model.loaded_checkpoints = self.loaded_checkpoints  # all tasks share the same checkpoints
 
             self.models.append(model)
             self.ratios.append(task.ratio if task.ratio is not None else 1)
@@ -30,12 +33,13 @@ class MultiTaskModel(BaseTranslationModel):
 
         self.main_task = main_task
         self.global_step = 0  # steps of all tasks combined
+        self.pending_steps = deque()  # (model, future, start time) of the REINFORCE updates that are still running
 
 
     def train(self, sess, beam_size, steps_per_checkpoint, steps_per_eval=None, eval_output=None, max_steps=0,
               max_epochs=0, eval_burn_in=0, decay_if_no_progress=5, decay_after_n_epoch=None, decay_every_n_epoch=None,
               sgd_after_n_epoch=None, loss_function='xent', baseline_steps=0, reinforce_baseline=True,
-              reward_function=None, use_edits=False, **kwargs):
+              reward_function=None, use_edits=False, reinforce_staleness=0, **kwargs):
         utils.log('reading training and development data')
 
         self.global_step = 0
@@ -43,7 +47,7 @@ class MultiTaskModel(BaseTranslationModel):
             model.read_data(**kwargs)
             # those parameters are used to track the progress of each task
             model.loss, model.time, model.steps = 0, 0, 0
-            model.baseline_loss = 0
+            model.baseline_loss, model.wait_time = 0, 0
             model.previous_losses = []
             global_step = model.global_step.eval(sess)
             model.epoch = model.batch_size * global_step // model.train_size
@@ -67,6 +71,15 @@ class MultiTaskModel(BaseTranslationModel):
                         baseline_loss = 0
                         utils.log('{} step {} baseline loss {:.4f}'.format(model.name, step, loss))
 
+        # With REINFORCE, the rewards of a batch can be computed (in a worker thread) while the next batches
+        # are being sampled. Those batches are sampled with parameters that are at most `reinforce_staleness`
+        # updates behind. This is off by default (`reinforce_staleness=0`): stale samples bias the updates.
+        if loss_function == 'reinforce' and reinforce_staleness > 0:
+            executor = ThreadPoolExecutor(max_workers=1)   # a single worker applies the updates in order
+        else:
+            executor = None
+        self.pending_steps.clear()
+
         utils.log('starting training')
         while True:
             i = np.random.choice(len(self.models), 1, p=self.ratios)[0]
@@ -74,7 +87,17 @@ class MultiTaskModel(BaseTranslationModel):
 
             start_time = time.time()
             res = model.train_step(sess, loss_function=loss_function, reward_function=reward_function,
-                                   use_edits=use_edits)
+                                   use_edits=use_edits, executor=executor)
+
+            if executor is not None:
+                self.pending_steps.append((model, res, start_time))
+                if len(self.pending_steps) <= reinforce_staleness:
+                    continue
+                model, future, start_time = self.pending_steps.popleft()
+                wait_start = time.time()
+                res = future.result()
+                model.wait_time += time.time() - wait_start
+
             model.loss += res.loss
 
             if loss_function == 'reinforce':
@@ -101,6 +124,7 @@ class MultiTaskModel(BaseTranslationModel):
                     model.use_sgd = True
 
             if steps_per_checkpoint and self.global_step % steps_per_checkpoint == 0:
+                self.wait_for_pending_steps()   # before the dev loss and the checkpoint
                 for model_ in self.models:
                     if model_.steps == 0:
                         continue
@@ -114,7 +138,15 @@ class MultiTaskModel(BaseTranslationModel):
                     else:
                         baseline_loss_ = ''
 
-                    utils.log('{} step {} epoch {} learning rate {:.4f} step-time {:.4f}{} loss {:.4f}'.format(
+                    if executor is not None:
+                        # time spent waiting for the worker thread: the lower, the more the pipeline helps
+                        step_time_ = '{:.4f} (wait-time {:.4f})'.format(step_time_,
+                                                                        model_.wait_time / model_.steps)
+                        model_.wait_time = 0
+                    else:
+                        step_time_ = '{:.4f}'.format(step_time_)
+
+                    utils.log('{} step {} epoch {} learning rate {:.4f} step-time {}{} loss {:.4f}'.format(
                         model_.name, model_.global_step.eval(sess), model.epoch, model_.learning_rate.eval(),
                         step_time_, baseline_loss_, loss_))
                     
@@ -129,6 +161,7 @@ class MultiTaskModel(BaseTranslationModel):
                 self.save(sess)
 
             if steps_per_eval and self.global_step % steps_per_eval == 0 and 0 <= eval_burn_in <= self.global_step:
+                self.wait_for_pending_steps()
                 score = 0
 
                 for ratio, model_ in zip(self.ratios, self.models):
@@ -160,10 +193,25 @@ class MultiTaskModel(BaseTranslationModel):
                 self.manage_best_checkpoints(self.global_step, score)
 
             if 0 < max_steps <= self.global_step or 0 < max_epochs <= epoch:
+                if executor is not None:
+                    self.wait_for_pending_steps()
+                    executor.shutdown()
                 utils.log('finished training')
                 # TODO: save models
                 return
 
+    def wait_for_pending_steps(self):
+        """
+        Wait until all the updates that were started in the worker thread have been applied, so that
+        checkpoints and evaluations see the latest parameters (the updates are still accounted for later)
+        """
+        for _, future, _ in self.pending_steps:
+            future.result()
+
+    def save(self, sess):
+        self.wait_for_pending_steps()   # also called on KeyboardInterrupt
+        super(MultiTaskModel, self).save(sess)
+
     def decode(self, *args, **kwargs):
         if self.main_task is not None:
             model = next(model for model in self.models if model.name == self.main_task)
@@ -184,3 +232,20 @@ class MultiTaskModel(BaseTranslationModel):
         else:
             model = self.models[0]
         return model.align(*args, **kwargs)
+
+    def serve(self, *args, **kwargs):
+        if self.main_task is not None:
+            model = next(model for model in self.models if model.name == self.main_task)
+        else:
+            model = self.models[0]
+        return model.serve(*args, **kwargs)
+
+    def export(self, sess, filename, quantize=False):
+        if self.main_task is not None:
+            model = next(model for model in self.models if model.name == self.main_task)
+        else:
+            model = self.models[0]
+        if filename.endswith('.npz'):
+            return frozen.export_numpy(model, sess, filename, quantize=quantize)
+        else:
+            return frozen.export(model, sess, filename)
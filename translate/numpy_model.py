@@ -0,0 +1,632 @@
+"""
+NumPy implementation of the decoding part of `Seq2SeqModel` (encoders, attention, greedy and beam-search
+decoding), which can be used without TensorFlow. Models are exported with `--export MODEL.npz`.
+
+Usage:
+    python3 -m translate.numpy_model MODEL.npz [--beam-size N] < FILE_TO_TRANSLATE > OUTPUT_FILE
+    python3 -m translate.numpy_model MODEL.npz --quantize --reference REF_FILE < FILE_TO_TRANSLATE
+"""
+import argparse
+import json
+import logging
+import numpy as np
+import sys
+import time
+
+from collections import namedtuple
+from translate import utils, evaluation
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def softmax(logits, temperature=1.0):
+    e = np.exp((logits - np.max(logits, axis=-1, keepdims=True)) / temperature)
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+def quantize_matrix(matrix, axis=1):
+    """
+    Int8 quantization of a matrix, with one scale per row (or per column if `axis` is 0)
+
+    :param axis: axis along which the maximum absolute value is computed
+    :return: int8 matrix, and float32 scales (with the same rank as `matrix`) such that
+      `matrix ~= quantized * scales`
+    """
+    scales = np.max(np.abs(matrix), axis=axis, keepdims=True) / 127
+    scales[scales == 0] = 1
+    quantized = np.round(matrix / scales).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def quantized_parameters(encoders, decoder):
+    """
+    Parameters which are quantized (embeddings and output projection), and the axis along which
+    their scales are computed (one scale per token).
+
+    :return: list of (name, axis) tuples
+    """
+    names = ['embedding_{}'.format(encoder_or_decoder.name) for encoder_or_decoder in encoders + [decoder]]
+    return [(name, 1) for name in names] + [('decoder_{}/softmax1/Matrix'.format(decoder.name), 0)]
+
+
+# names of the weights and biases of `BasicLSTMCell`, which depend on the version of TensorFlow
+lstm_parameter_names = [
+    ('BasicLSTMCell/Linear/Matrix', 'BasicLSTMCell/Linear/Bias'),
+    ('basic_lstm_cell/weights', 'basic_lstm_cell/biases'),
+    ('basic_lstm_cell/kernel', 'basic_lstm_cell/bias'),
+]
+
+
+class Parameters(dict):
+    """
+    Parameters of a model, indexed by variable name (without the ':0' suffix)
+    """
+    def __missing__(self, name):
+        raise KeyError('parameter "{}" is missing from the model file (was the model exported with a different '
+                       'version of the code?)'.format(name))
+
+
+def reverse_sequence(inputs, sequence_length):
+    """
+    Same as `tf.reverse_sequence` with `batch_dim=0` and `seq_dim=1`
+    """
+    outputs = inputs.copy()
+    for i, length in enumerate(sequence_length):
+        outputs[i, :length] = inputs[i, :length][::-1]
+    return outputs
+
+
+class NumpyTranslationModel(object):
+    """
+    Translation model whose parameters are stored in a `.npz` file (written by `frozen.export_numpy`).
+
+    It implements the same computations as `Seq2SeqModel` at decoding time (GRU or LSTM encoders, with
+    optional bidirectional layers, input layers, time pooling and residual connections, global attention
+    with optional convolutional filters, maxout and softmax output layers), and the same greedy and
+    beam-search algorithms.
+
+    Example:
+        model = NumpyTranslationModel('model.npz')
+        model.translate(['hello world'], beam_size=4)
+    """
+
+    def __init__(self, filename, batch_size=None, max_input_len=None, max_output_len=None,
+                 len_normalization=None, quantize=False):
+        """
+        Int8 is only a storage format: quantized parameters are converted back to float32 once, when the
+        model is loaded (NumPy has no int8 matrix product, and converting the matrices at each step is much
+        slower than a float32 product). The outputs are those of the quantized model.
+
+        :param filename: path to the file written by `frozen.export_numpy`
+        :param quantize: quantize the embeddings and the output projection to int8 (this is already
+          the case if the model was exported with `quantize`)
+        """
+        with np.load(filename) as data:
+            config = json.loads(str(data['__config__']))
+            params = {k: data[k] for k in data.files if k != '__config__' and not k.endswith('/scales')}
+            scales = {k[:-len('/scales')]: data[k] for k in data.files if k.endswith('/scales')}
+
+        def get_value(key, value):
+            return config[key] if value is None else value
+
+        self.encoders = [utils.AttrDict(encoder) for encoder in config['encoders']]
+        self.decoder = utils.AttrDict(config['decoder'])
+        self.character_level = config['character_level']
+        self.batch_size = get_value('batch_size', batch_size)
+        self.max_input_len = get_value('max_input_len', max_input_len)
+        self.max_output_len = get_value('max_output_len', max_output_len)
+        self.len_normalization = get_value('len_normalization', len_normalization)
+        self.softmax_temperature = config['softmax_temperature']
+
+        vocab = namedtuple('vocab', 'vocab reverse')
+        self.vocabs = [
+            vocab(dict((token, i) for i, token in enumerate(reverse)), reverse) if reverse is not None else None
+            for reverse in config['vocabs']
+        ]
+        self.src_vocab = self.vocabs[:-1]
+        self.trg_vocab = self.vocabs[-1]
+
+        if config.get('softmax_classes'):
+            raise NotImplementedError('class-factored softmax is not supported')
+
+        for encoder in self.encoders:
+            if encoder.binary:
+                raise NotImplementedError('binary input is not supported')
+            if encoder.attention_window_size > 0:
+                raise NotImplementedError('local attention is not supported')
+
+        self.decoder_scope = 'decoder_{}'.format(self.decoder.name)
+        self.decoder_state_size = self.decoder.cell_size * (2 if self.decoder.use_lstm else 1)
+
+        if quantize:
+            for name, axis in quantized_parameters(self.encoders, self.decoder):
+                if name not in scales:
+                    params[name], scales[name] = quantize_matrix(params[name], axis=axis)
+
+        self.quantized = sorted(scales)   # names of the parameters which are quantized
+        for name, scales_ in scales.items():
+            params[name] = params[name].astype(np.float32) * scales_
+        self.params = Parameters(params)
+
+    def embed(self, name, token_ids):
+        """
+        Look up the embeddings of `token_ids`
+        """
+        return self.params['embedding_{}'.format(name)][token_ids]
+
+    def linear(self, scope, args, bias):
+        """
+        Same as `rnn.linear`, where `scope` is the name of the variable scope
+        """
+        if isinstance(args, (list, tuple)):
+            args = np.concatenate(args, axis=-1)
+        res = np.dot(args, self.params[scope + '/Matrix'])
+        if bias:
+            res += self.params[scope + '/Bias']
+        return res
+
+    def lstm_parameters(self, scope):
+        for matrix_name, bias_name in lstm_parameter_names:
+            matrix_name, bias_name = '{}/{}'.format(scope, matrix_name), '{}/{}'.format(scope, bias_name)
+            if matrix_name in self.params and bias_name in self.params:
+                return self.params[matrix_name], self.params[bias_name]
+
+        names = ', '.join('{}/{}'.format(scope, matrix_name) for matrix_name, _ in lstm_parameter_names)
+        raise KeyError('LSTM parameters are missing from the model file (expected one of: {})'.format(names))
+
+    def cell(self, scope, config, inputs, state):
+        """
+        Same as `GRUCell` or `BasicLSTMCell` (with `state_is_tuple=False`)
+
+        :return: output and new state
+        """
+        if config.use_lstm:
+            matrix, bias = self.lstm_parameters(scope)
+            c, h = np.split(state, 2, axis=1)
+            i, j, f, o = np.split(np.dot(np.concatenate([inputs, h], axis=1), matrix) + bias, 4, axis=1)
+            new_c = c * sigmoid(f + 1.0) + sigmoid(i) * np.tanh(j)   # forget bias of 1
+            new_h = np.tanh(new_c) * sigmoid(o)
+            return new_h, np.concatenate([new_c, new_h], axis=1)
+
+        scope += '/GRUCell'
+        gates = sigmoid(self.linear(scope + '/state_to_gates', state, False) +
+                        self.linear(scope + '/input_to_gates', inputs, True))
+        update, reset = np.split(gates, 2, axis=1)
+        new_state = np.tanh(reset * self.linear(scope + '/state_to_state', state, False) +
+                            self.linear(scope + '/input_to_state', inputs, True))
+        new_state = update * new_state + (1 - update) * state
+        return new_state, new_state
+
+    def rnn(self, scope, config, inputs, sequence_length):
+        """
+        Same as `tf.nn.dynamic_rnn` with a trainable initial state: outputs after `sequence_length` are zero,
+        and the state is copied through.
+        """
+        batch_size, time_steps = inputs.shape[:2]
+        state = np.tile(self.params[scope + '/initial_state'], (batch_size, 1))
+        outputs = np.zeros([batch_size, time_steps, config.cell_size], dtype=np.float32)
+
+        for t in range(time_steps):
+            output, new_state = self.cell(scope, config, inputs[:, t], state)
+            active = (t < sequence_length)[:, None]
+            outputs[:, t] = np.where(active, output, 0)
+            state = np.where(active, new_state, state)
+
+        return outputs
+
+    def encode(self, inputs, input_length):
+        """
+        Same as `decoders.multi_encoder`
+
+        :param inputs: list of arrays of token ids of shape (batch_size, input_length) (one for each encoder)
+        :param input_length: list of arrays of shape (batch_size)
+        :return: list of encoder outputs of shape (batch_size, input_length, output_size), and the
+          final states of the encoders (concatenated)
+        """
+        encoder_outputs = []
+        encoder_states = []
+
+        for encoder, inputs_, input_length_ in zip(self.encoders, inputs, input_length):
+            scope = 'encoder_{}'.format(encoder.name)
+            inputs_ = self.embed(encoder.name, inputs_)
+
+            for j, _ in enumerate(encoder.input_layers or []):
+                inputs_ = np.tanh(self.linear('{}/input_layer_{}'.format(scope, j), inputs_, True))
+
+            sequence_length = input_length_
+            for i in range(encoder.layers):
+                new_inputs = self.rnn('{}/forward_{}'.format(scope, i + 1), encoder, inputs_, sequence_length)
+
+                if encoder.bidir:
+                    inputs_reversed = reverse_sequence(inputs_, sequence_length)
+                    outputs_bw = self.rnn('{}/backward_{}'.format(scope, i + 1), encoder, inputs_reversed,
+                                          sequence_length)
+                    outputs_bw = reverse_sequence(outputs_bw, sequence_length)
+                    new_inputs = np.concatenate([new_inputs, outputs_bw], axis=2)
+
+                if encoder.residual_connections and i < encoder.layers - 1:
+                    if encoder.bidir and i == 0:
+                        inputs_ = np.concatenate([inputs_, inputs_], axis=2)
+                    inputs_ = new_inputs + inputs_
+                else:
+                    inputs_ = new_inputs
+
+                if encoder.time_pooling and i < encoder.layers - 1:
+                    stride = encoder.time_pooling[i]
+                    if encoder.pooling_avg:
+                        pooled = np.zeros_like(inputs_[:, ::stride])
+                        for k in range(stride):
+                            slice_ = inputs_[:, k::stride]
+                            pooled[:, :slice_.shape[1]] += slice_
+                        inputs_ = pooled / stride
+                    else:
+                        inputs_ = inputs_[:, ::stride]
+                    sequence_length = (sequence_length + stride - 1) // stride
+
+            encoder_outputs.append(inputs_)
+            if encoder.bidir:
+                # Like Bahdanau et al., we use the first annotation h_1 of the backward encoder
+                encoder_states.append(inputs_[:, 0, encoder.cell_size:])
+            else:
+                encoder_states.append(inputs_[:, -1, :])
+
+        return encoder_outputs, np.concatenate(encoder_states, axis=1)
+
+    def attention(self, state, prev_weights, attention_states, input_length):
+        """
+        Same as `decoders.multi_attention` (with global attention). The batch dimension of `attention_states`
+        and `input_length` can be 1, in which case they are broadcast (this is used in beam-search).
+
+        :return: context vector (concatenated for all encoders), and list of attention weights
+        """
+        contexts = []
+        weights = []
+
+        for encoder, hidden, length, prev_weights_ in zip(self.encoders, attention_states, input_length,
+                                                          prev_weights):
+            scope = '{}/attention_{}'.format(self.decoder_scope, encoder.name)
+
+            if encoder.attention_filters > 0:
+                # same as `compute_energy_with_filter` (convolution over the previous weights)
+                filter_length = encoder.attention_filter_length
+                filter_ = self.params[scope + '/filter'][:, 0, 0, :]
+                time_steps = prev_weights_.shape[1]
+                padded = np.pad(prev_weights_, [(0, 0), (filter_length, filter_length)], mode='constant')
+                windows = np.stack([padded[:, k:k + time_steps] for k in range(2 * filter_length + 1)], axis=2)
+                z = np.dot(np.dot(windows, filter_), self.params[scope + '/U'])
+                y = self.linear(scope + '/Linear', state, True)
+                f = np.dot(hidden, self.params[scope + '/W'])
+                e = np.dot(np.tanh(f + y[:, None, :] + z), self.params[scope + '/V'])
+            else:
+                # same as `compute_energy`
+                y = self.linear(scope + '/W_a', state, True)
+                f = np.dot(hidden, self.params[scope + '/U_a'])
+                e = np.dot(np.tanh(f + y[:, None, :]), self.params[scope + '/v_a'])
+
+            e = e - np.max(e, axis=1, keepdims=True)
+            mask = np.arange(hidden.shape[1])[None, :] < length[:, None]
+            exp = np.exp(e) * mask
+            weights_ = exp / np.sum(exp, axis=1, keepdims=True)
+
+            contexts.append(np.sum(weights_[:, :, None] * hidden, axis=1))
+            weights.append(weights_)
+
+        return np.concatenate(contexts, axis=1), weights
+
+    def initial_state(self, encoder_state):
+        return np.tanh(self.linear(self.decoder_scope + '/initial_state_projection', encoder_state, True))
+
+    def decoder_output(self, state, token_ids, context):
+        """
+        Maxout and softmax layers of the decoder
+
+        :return: logits of shape (batch_size, vocab_size)
+        """
+        input_ = self.embed(self.decoder.name, token_ids)
+        output = self.linear(self.decoder_scope + '/maxout', [state, input_, context], False)
+        output = np.max(np.reshape(output, [output.shape[0], self.decoder.cell_size // 2, 2]), axis=2)
+        output = self.linear(self.decoder_scope + '/softmax0', output, False)
+        return self.linear(self.decoder_scope + '/softmax1', output, True)
+
+    def decoder_cell(self, state, token_ids, context):
+        """
+        Same as the decoder cell (with `MultiRNNCell` if the decoder has several layers)
+
+        :return: new state of the decoder
+        """
+        inputs = np.concatenate([self.embed(self.decoder.name, token_ids), context], axis=1)
+
+        if self.decoder.layers == 1:
+            _, new_state = self.cell(self.decoder_scope, self.decoder, inputs, state)
+            return new_state
+
+        new_states = []
+        layer_state_size = self.decoder_state_size
+        for i in range(self.decoder.layers):
+            scope = '{}/cell_{}'.format(self.decoder_scope, i + 1)
+            state_ = state[:, i * layer_state_size:(i + 1) * layer_state_size]
+            new_inputs, new_state = self.cell(scope, self.decoder, inputs, state_)
+
+            if self.decoder.residual_connections and i < self.decoder.layers - 1:
+                inputs = inputs + new_inputs
+            else:
+                inputs = new_inputs
+            new_states.append(new_state)
+
+        return np.concatenate(new_states, axis=1)
+
+    def get_batch(self, token_ids):
+        """
+        Same as `Seq2SeqModel.get_batch` (encoder side only)
+
+        :param token_ids: list of tuples of token ids (one for each encoder)
+        """
+        inputs = []
+        input_length = []
+
+        for i in range(len(self.encoders)):
+            sentences = [token_ids_[i] for token_ids_ in token_ids]
+            max_input_len = max(len(sentence) for sentence in sentences)
+            if self.max_input_len is not None:
+                max_input_len = min(max_input_len, self.max_input_len)
+
+            sentences = [sentence[:max_input_len] for sentence in sentences]
+            inputs.append(np.array([sentence + [utils.EOS_ID] * (1 + max_input_len - len(sentence))
+                                    for sentence in sentences], dtype=np.int32))
+            input_length.append(np.array([len(sentence) + 1 for sentence in sentences], dtype=np.int32))
+
+        return inputs, input_length
+
+    def greedy_decoding(self, token_ids, return_scores=False):
+        """
+        Same as `Seq2SeqModel.greedy_decoding`, except that decoding stops as soon as all the outputs
+        contain EOS.
+
+        :param token_ids: list of tuples of token ids (one for each encoder)
+        :return: array of output token ids of shape (batch_size, time_steps), and the cost of each token
+          if `return_scores` is True
+        """
+        inputs, input_length = self.get_batch(token_ids)
+        attention_states, encoder_state = self.encode(inputs, input_length)
+
+        batch_size = len(token_ids)
+        state = self.initial_state(encoder_state)
+        weights = [np.zeros([batch_size, states.shape[1]], dtype=np.float32) for states in attention_states]
+        input_ = np.full([batch_size], utils.BOS_ID, dtype=np.int64)
+        finished = np.zeros([batch_size], dtype=np.bool_)
+
+        outputs = []
+        costs = []
+        for _ in range(self.max_output_len):
+            context, weights = self.attention(state, weights, attention_states, input_length)
+            logits = self.decoder_output(state, input_, context)
+            input_ = np.argmax(logits, axis=1)
+            state = self.decoder_cell(state, input_, context)
+
+            outputs.append(input_)
+            if return_scores:
+                max_logits = np.max(logits, axis=1)
+                log_z = max_logits + np.log(np.sum(np.exp(logits - max_logits[:, None]), axis=1))
+                costs.append(log_z - max_logits)
+
+            finished |= input_ == utils.EOS_ID
+            if finished.all():
+                break
+
+        outputs = np.stack(outputs, axis=1)
+        if return_scores:
+            return outputs, np.stack(costs, axis=1)
+        else:
+            return outputs
+
+    def beam_search_decoding(self, token_ids, beam_size, early_stopping=True):
+        """
+        Same as `Seq2SeqModel.beam_search_decoding` (with a single model and no language model)
+
+        :param token_ids: tuple of token ids (one list for each encoder)
+        :return: list of hypotheses, and their scores (sorted by increasing cost)
+        """
+        inputs, input_length = self.get_batch([token_ids])
+        attention_states, encoder_state = self.encode(inputs, input_length)
+
+        state = self.initial_state(encoder_state)
+        targets = np.array([utils.BOS_ID])
+
+        finished_hypotheses = []
+        finished_scores = []
+
+        hypotheses = [[]]
+        scores = np.zeros([1], dtype=np.float32)
+
+        for _ in range(self.max_output_len):
+            # the attention weights are not carried over between two steps of beam-search
+            weights = [np.zeros([len(hypotheses), states.shape[1]], dtype=np.float32)
+                       for states in attention_states]
+            context, _ = self.attention(state, weights, attention_states, input_length)
+            logits = self.decoder_output(state, targets, context)
+            proba = softmax(logits, temperature=self.softmax_temperature)
+            # like in the TensorFlow graph, the state is updated with the most likely token
+            state = self.decoder_cell(state, np.argmax(logits, axis=1), context)
+
+            # the log-probabilities are averaged with a zero language model score
+            proba = np.maximum(proba, 1e-10)
+            scores_ = (scores[:, None] - np.log(proba) / 2).flatten()
+            flat_ids = np.argsort(scores_)
+
+            token_ids_ = flat_ids % self.decoder.vocab_size
+            hyp_ids = flat_ids // self.decoder.vocab_size
+
+            new_hypotheses = []
+            new_scores = []
+            new_state = []
+            new_input = []
+            new_beam_size = beam_size
+
+            for flat_id, hyp_id, token_id in zip(flat_ids, hyp_ids, token_ids_):
+                hypothesis = hypotheses[hyp_id] + [token_id]
+                score = scores_[flat_id]
+
+                if token_id == utils.EOS_ID:
+                    # hypothesis is finished, it is thus unnecessary to keep expanding it
+                    finished_hypotheses.append(hypothesis)
+                    finished_scores.append(score)
+
+                    # early stop: number of possible hypotheses is reduced by one
+                    if early_stopping:
+                        new_beam_size -= 1
+                else:
+                    new_hypotheses.append(hypothesis)
+                    new_state.append(state[hyp_id])
+                    new_scores.append(score)
+                    new_input.append(token_id)
+
+                if len(new_hypotheses) == beam_size:
+                    break
+
+            beam_size = new_beam_size
+            hypotheses = new_hypotheses
+            state = np.array(new_state)
+            scores = np.array(new_scores)
+            targets = np.array(new_input, dtype=np.int32)
+
+            if beam_size <= 0:
+                break
+
+        hypotheses += finished_hypotheses
+        scores = np.concatenate([scores, finished_scores])
+
+        if self.len_normalization > 0:  # normalize score by length (to encourage longer sentences)
+            scores /= [len(hypothesis) ** self.len_normalization for hypothesis in hypotheses]
+
+        # sort best-list by score
+        sorted_idx = np.argsort(scores)
+        hypotheses = [hypotheses[i] for i in sorted_idx]
+        scores = scores[sorted_idx].tolist()
+        return hypotheses, scores
+
+    def translate(self, sentences, beam_size=1, remove_unk=False, early_stopping=True, use_edits=False,
+                  return_scores=False):
+        """
+        Same as `TranslationModel._decode_batch`
+
+        :param sentences: list of sentences, or list of tuples of sentences (one sentence for each encoder)
+        :return: list of translations, or list of (translation, score) pairs if `return_scores` is True
+        """
+        sentence_tuples = [(sentence,) if isinstance(sentence, str) else tuple(sentence) for sentence in sentences]
+        token_ids = [
+            [utils.sentence_to_token_ids(sentence, vocab.vocab, character_level=char_level)
+             for vocab, sentence, char_level in zip(self.src_vocab, sentence_tuple, self.character_level)]
+            for sentence_tuple in sentence_tuples
+        ]
+
+        outputs = []
+        if beam_size > 1:
+            for token_ids_ in token_ids:
+                hypotheses, scores = self.beam_search_decoding(token_ids_, beam_size, early_stopping=early_stopping)
+                outputs.append((hypotheses[0], scores[0]))
+        else:
+            for i in range(0, len(token_ids), self.batch_size):
+                batch = token_ids[i:i + self.batch_size]
+                batch_token_ids, batch_costs = self.greedy_decoding(batch, return_scores=True)
+                for trg_token_ids, costs in zip(batch_token_ids, batch_costs):
+                    trg_token_ids = list(trg_token_ids)
+                    # the score includes the cost of the EOS symbol
+                    length = trg_token_ids.index(utils.EOS_ID) + 1 if utils.EOS_ID in trg_token_ids else None
+                    outputs.append((trg_token_ids, float(np.sum(costs[:length]))))
+
+        translations = []
+        for sentence_tuple, (trg_token_ids, score) in zip(sentence_tuples, outputs):
+            if utils.EOS_ID in trg_token_ids:
+                trg_token_ids = trg_token_ids[:trg_token_ids.index(utils.EOS_ID)]
+
+            trg_tokens = [self.trg_vocab.reverse[i] if i < len(self.trg_vocab.reverse) else utils._UNK
+                          for i in trg_token_ids]
+
+            if use_edits:
+                trg_tokens = utils.reverse_edits(sentence_tuple[0], ' '.join(trg_tokens)).split()
+
+            if remove_unk:
+                trg_tokens = [token for token in trg_tokens if token != utils._UNK]
+
+            if self.character_level[-1]:
+                hypothesis = ''.join(trg_tokens)
+            else:
+                hypothesis = ' '.join(trg_tokens).replace('@@ ', '')  # merge subword units
+
+            translations.append((hypothesis, score) if return_scores else hypothesis)
+
+        return translations
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='translate standard input with a model exported to NumPy')
+    parser.add_argument('model', help='model exported with --export MODEL.npz')
+    parser.add_argument('--beam-size', type=int, default=1)
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--remove-unk', action='store_true')
+    parser.add_argument('--use-edits', action='store_true')
+    parser.add_argument('--quantize', action='store_true',
+                        help='quantize the embeddings and the output projection to int8')
+    parser.add_argument('--reference', help='compute the BLEU score against this file (with --quantize, '
+                                            'the score of the non-quantized model is computed too)')
+    args = parser.parse_args(args)
+
+    logger = utils.create_logger()
+    logger.setLevel(logging.INFO)
+
+    def translate_lines(model, lines):
+        batch_size = model.batch_size if args.beam_size <= 1 else 1
+        batch = []
+        for line in lines:
+            batch.append(line.rstrip('\n'))
+            if len(batch) == batch_size:
+                yield from model.translate(batch, beam_size=args.beam_size, remove_unk=args.remove_unk,
+                                           use_edits=args.use_edits)
+                batch = []
+        yield from model.translate(batch, beam_size=args.beam_size, remove_unk=args.remove_unk,
+                                   use_edits=args.use_edits)
+
+    model = NumpyTranslationModel(args.model, batch_size=args.batch_size, quantize=args.quantize)
+
+    if args.reference is None:
+        for hypothesis in translate_lines(model, sys.stdin):
+            sys.stdout.write(hypothesis + '\n')
+        return
+
+    lines = list(sys.stdin)
+    hypotheses = []
+    start_time = time.time()
+    for hypothesis in translate_lines(model, lines):
+        sys.stdout.write(hypothesis + '\n')
+        hypotheses.append(hypothesis)
+    elapsed = time.time() - start_time
+
+    references = []
+    with open(args.reference) as f:
+        for source, reference in zip(lines, f):
+            if args.use_edits:
+                reference = utils.reverse_edits(source.strip(), reference)
+            references.append(reference.strip().replace('@@ ', ''))
+
+    score, score_summary = evaluation.corpus_bleu(hypotheses, references)
+    quantized = bool(model.quantized)
+    utils.log('{} score={:.2f} {} time={:.2f}s'.format('int8' if quantized else 'fp32', score, score_summary,
+                                                        elapsed))
+
+    if args.quantize:
+        model = NumpyTranslationModel(args.model, batch_size=args.batch_size)
+        if model.quantized:
+            utils.warn('the model was exported with quantized parameters: no fp32 score')
+        else:
+            start_time = time.time()
+            hypotheses = list(translate_lines(model, lines))
+            elapsed = time.time() - start_time
+            score_, score_summary = evaluation.corpus_bleu(hypotheses, references)
+            utils.log('fp32 score={:.2f} {} time={:.2f}s (int8 difference: {:+.2f})'.format(
+                score_, score_summary, elapsed, score - score_))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+from translate import utils, evaluation
+from translate.translator import Translator, get_task_config
+
+
+def _decode_shard(config, log_level):
+    logger = utils.create_logger()
+    logger.setLevel(log_level)
+
+    with Translator.create(config) as translator:
+        translator.task.decode(translator.sess, **config)
+
+
+def decode(config, workers, log_level=logging.INFO):
+    """
+    Decode (`config.decode`) or evaluate (`config.eval`) a corpus with several processes.
+
+    The source files are split into `workers` contiguous shards, which are translated by independent
+    processes (each with its own TensorFlow session). The outputs are then concatenated in the
+    original order.
+
+    :param config: configuration, as returned by `read_config`
+    :param workers: number of processes
+    :param log_level: logging level of the worker processes
+    :return: score (in evaluation mode), or None
+    """
+    task = get_task_config(config)
+    src_ext = [encoder.get('ext') or encoder.name for encoder in task.encoders]
+    assert not any(encoder.binary for encoder in task.encoders), 'binary input cannot be split into shards'
+
+    decode_only = config.get('decode') is not None
+    filenames = config.decode if decode_only else config.eval
+    src_filenames = filenames[:len(src_ext)]
+    assert len(filenames) == len(src_ext) + (0 if decode_only else 1)
+
+    with open(src_filenames[0]) as f:
+        line_count = sum(1 for _ in f)
+
+    workers = max(1, min(workers, line_count))
+    shard_size = int(math.ceil(line_count / workers))
+    threads = config.threads or max(1, multiprocessing.cpu_count() // workers)
+
+    if config.cache_file:
+        utils.warn('on-disk translation cache is disabled with several workers')
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # write the shards
+        shard_filenames = [[os.path.join(tmp_dir, 'shard{}.{}'.format(i, ext)) for ext in src_ext]
+                           for i in range(workers)]
+        for k, filename in enumerate(src_filenames):
+            with open(filename) as f:
+                for i in range(workers):
+                    with open(shard_filenames[i][k], 'w') as shard_file:
+                        shard_file.writelines(itertools.islice(f, shard_size))
+
+        output_filenames = [os.path.join(tmp_dir, 'shard{}.out'.format(i)) for i in range(workers)]
+
+        utils.log('decoding with {} workers ({} threads each)'.format(workers, threads))
+
+        # "spawn" creates fresh processes: TensorFlow's state is not fork-safe
+        context = multiprocessing.get_context('spawn')
+        processes = []
+        for shard_filenames_, output_filename in zip(shard_filenames, output_filenames):
+            config_ = utils.AttrDict(config)
+            config_.update(decode=shard_filenames_, eval=None, output=output_filename, threads=threads, workers=1,
+                           cache_file=None)
+            process = context.Process(target=_decode_shard, args=(config_, log_level))
+            process.start()
+            processes.append(process)
+
+        for process in processes:
+            process.join()
+
+        if any(process.exitcode != 0 for process in processes):
+            raise Exception('decoding failed in at least one worker')
+
+        # merge the outputs (in order)
+        output_file = sys.stdout if config.output is None else open(config.output, 'w')
+        try:
+            for output_filename in output_filenames:
+                with open(output_filename) as f:
+                    shutil.copyfileobj(f, output_file)
+        finally:
+            if output_file is not sys.stdout:
+                output_file.close()
+
+        if decode_only:
+            return None
+
+        hypotheses = []
+        for output_filename in output_filenames:
+            with open(output_filename) as f:
+                hypotheses += [line.rstrip('\n') for line in f]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    references = []
+    for *sources, reference in utils.read_lines(filenames, src_ext + ['ref']):
+        if config.use_edits:
+            reference = utils.reverse_edits(sources[0], reference)
+        references.append(reference.strip().replace('@@ ', ''))
+
+    score, score_summary = getattr(evaluation, config.score_function)(hypotheses, references,
+                                                                       script_dir=config.script_dir)
+
+    score_info = [task.name, 'score={:.2f}'.format(score)]
+    if score_summary:
+        score_info.append(score_summary)
+
+    utils.log(' '.join(map(str, score_info)))
+    return score
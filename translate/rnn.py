@@ -31,7 +31,8 @@ def multi_bidirectional_rnn(cells, inputs, sequence_length=None, dtype=None, par
                 initial_state = None
 
             inputs_fw, output_state_fw = rnn.dynamic_rnn(
-                cell=cell_fw, inputs=inputs, sequence_length=sequence_length, initial_state=initial_state,
+                cell=cell_fw, inputs=project_inputs(cell_fw, inputs), sequence_length=sequence_length,
+                initial_state=initial_state,
                 dtype=dtype, parallel_iterations=parallel_iterations, swap_memory=swap_memory,
                 time_major=time_major, scope=fw_scope
             )
@@ -51,7 +52,8 @@ def multi_bidirectional_rnn(cells, inputs, sequence_length=None, dtype=None, par
                 initial_state = None
 
             inputs_bw, output_state_bw = rnn.dynamic_rnn(
-                cell=cell_bw, inputs=inputs_reversed, sequence_length=sequence_length, initial_state=initial_state,
+                cell=cell_bw, inputs=project_inputs(cell_bw, inputs_reversed), sequence_length=sequence_length,
+                initial_state=initial_state,
                 dtype=dtype, parallel_iterations=parallel_iterations, swap_memory=swap_memory, time_major=time_major,
                 scope=bw_scope
             )
@@ -98,7 +100,8 @@ def multi_rnn(cells, inputs, sequence_length=None, dtype=None, parallel_iteratio
                 initial_state = None
 
             new_inputs, output_state = rnn.dynamic_rnn(
-                cell=cell, inputs=inputs, sequence_length=sequence_length, initial_state=initial_state, dtype=dtype,
+                cell=cell, inputs=project_inputs(cell, inputs), sequence_length=sequence_length,
+                initial_state=initial_state, dtype=dtype,
                 parallel_iterations=parallel_iterations, swap_memory=swap_memory, time_major=time_major, scope=scope
             )
 
@@ -115,6 +118,16 @@ def multi_rnn(cells, inputs, sequence_length=None, dtype=None, parallel_iteratio
     return inputs, tf.concat(output_states, 1)
 
 
+def project_inputs(cell, inputs):
+    """
+    Project the inputs of all time steps at once, if `cell` supports it (e.g. `ProjectedInputGRUCell`)
+    """
+    if hasattr(cell, 'project_inputs'):
+        return cell.project_inputs(inputs)
+    else:
+        return inputs
+
+
 def apply_time_pooling(inputs, sequence_length, stride, pooling_avg=False):
     shape = [tf.shape(inputs)[0], tf.shape(inputs)[1], inputs.get_shape()[2].value]
 
@@ -214,22 +227,71 @@ class GRUCell(RNNCell):
         return self._num_units
 
     def __call__(self, inputs, state, scope=None):
-        with tf.variable_scope(scope or type(self).__name__):
+        with tf.variable_scope(scope or 'GRUCell'):
             # we start with bias of 1.0 to not reset and not update
-            state_to_gates = linear(state, self._num_units * 2, False, scope='state_to_gates',
-                                    initializer=self._initializer)
             input_to_gates = linear(inputs, self._num_units * 2, True, scope='input_to_gates')
+            input_to_state = linear(inputs, self._num_units, True, scope='input_to_state')
+            new_state = self._step(input_to_gates, input_to_state, state)
+        return new_state, new_state
 
-            gates = tf.nn.sigmoid(state_to_gates + input_to_gates)
-            update = gates[:, :self._num_units]
-            reset = gates[:, self._num_units:]
+    def _step(self, input_to_gates, input_to_state, state):
+        state_to_gates = linear(state, self._num_units * 2, False, scope='state_to_gates',
+                                initializer=self._initializer)
 
-            state_to_state = linear(state, self._num_units, False, scope='state_to_state',
-                                    initializer=self._initializer)
-            input_to_state = linear(inputs, self._num_units, True, scope='input_to_state')
-            new_state = self._activation(reset * state_to_state + input_to_state)
+        gates = tf.nn.sigmoid(state_to_gates + input_to_gates)
+        update = gates[:, :self._num_units]
+        reset = gates[:, self._num_units:]
 
-            new_state = update * new_state + (1 - update) * state
+        state_to_state = linear(state, self._num_units, False, scope='state_to_state',
+                                initializer=self._initializer)
+        new_state = self._activation(reset * state_to_state + input_to_state)
+
+        return update * new_state + (1 - update) * state
+
+
+class ProjectedInputGRUCell(GRUCell):
+    """
+    Same as `GRUCell` (with the same parameters), but whose inputs are projected for all time steps
+    at once by `project_inputs` before the RNN loop. Only the projections of the state are computed
+    at each time step.
+    """
+
+    def __init__(self, num_units, activation=tf.nn.tanh, initializer=None, input_keep_prob=None,
+                 scope_name='GRUCell'):
+        """
+        :param input_keep_prob: scalar tensor or None, keep probability of the dropout applied to the inputs
+          (same as a `DropoutWrapper` with `input_keep_prob`)
+        :param scope_name: default name of the variable scope of the cell (the default value is the same
+          as `GRUCell`'s, so that both cells can load the same checkpoints)
+        """
+        super(ProjectedInputGRUCell, self).__init__(num_units, activation, initializer)
+        self._input_keep_prob = input_keep_prob
+        self._scope_name = scope_name
+
+    def project_inputs(self, inputs, scope=None):
+        """
+        :param inputs: tensor of shape (batch_size, time_steps, input_size)
+        :return: tensor of shape (batch_size, time_steps, 3 * num_units), which is the input of this cell
+        """
+        if self._input_keep_prob is not None:
+            inputs = tf.nn.dropout(inputs, self._input_keep_prob)
+
+        batch_size = tf.shape(inputs)[0]
+        time_steps = tf.shape(inputs)[1]
+        flat_inputs = tf.reshape(inputs, [-1, inputs.get_shape()[2].value])
+
+        with tf.variable_scope(scope or self._scope_name):
+            input_to_gates = linear(flat_inputs, self._num_units * 2, True, scope='input_to_gates')
+            input_to_state = linear(flat_inputs, self._num_units, True, scope='input_to_state')
+
+        projected_inputs = tf.concat([input_to_gates, input_to_state], 1)
+        return tf.reshape(projected_inputs, tf.stack([batch_size, time_steps, self._num_units * 3]))
+
+    def __call__(self, inputs, state, scope=None):
+        with tf.variable_scope(scope or self._scope_name):
+            input_to_gates = inputs[:, :self._num_units * 2]
+            input_to_state = inputs[:, self._num_units * 2:]
+            new_state = self._step(input_to_gates, input_to_state, state)
         return new_state, new_state
 
 
@@ -43,7 +43,8 @@ class Seq2SeqModel(object):
                  freeze_variables=None, lm_weight=None, max_output_len=50, feed_previous=0.0,
                  optimizer='sgd', max_input_len=None, decode_only=False, len_normalization=1.0,
                  reinforce_baseline=True, softmax_temperature=1.0, loss_function='xent', rollouts=None,
-                 partial_rewards=False, **kwargs):
+                 partial_rewards=False, align=None, softmax_samples=0, shortlist=False, softmax_classes=0,
+                 loss_chunk_size=0, rollout_batch_size=512, samples_per_source=1, **kwargs):
         self.lm_weight = lm_weight
         self.encoders = encoders
         self.decoder = decoder
@@ -59,6 +60,7 @@ class Seq2SeqModel(object):
         self.max_output_len = max_output_len
         self.max_input_len = max_input_len
         self.len_normalization = len_normalization
+        self.softmax_temperature = softmax_temperature
 
         if dropout_rate > 0:
             self.dropout = tf.Variable(1 - dropout_rate, trainable=False, name='dropout_keep_prob')
@@ -107,27 +109,104 @@ class Seq2SeqModel(object):
             self.rollouts = rollouts
 
         self.partial_rewards = partial_rewards
+        self.rollout_batch_size = rollout_batch_size
+        self.edit_mapping = None  # source id to target id mapping, used to apply edits on ids (with `use_edits`)
 
         parameters = dict(encoders=encoders, decoder=decoder, dropout=self.dropout,
                           encoder_input_length=self.encoder_input_length, rollouts=1)
 
+        # ids of the target words that can be generated (fed by the decoding functions)
+        if shortlist:
+            self.shortlist = tf.placeholder(tf.int32, shape=[None], name='shortlist')
+        else:
+            self.shortlist = None
+
         self.attention_states, self.encoder_state = decoders.multi_encoder(self.encoder_inputs, **parameters)
 
+        # only build the tensors that are needed by the current action
+        reinforce = loss_function != 'xent' and not decode_only
+        output_states = reinforce and self.rollouts is not None and self.rollouts > 1
+
+        decoder_parameters = dict(parameters, attention_states=self.attention_states,
+                                  initial_state=self.encoder_state, targets=self.targets,
+                                  decoder_input_length=self.target_length)
+
+        # In REINFORCE, several samples can be drawn for each source sentence: the encoder runs only once,
+        # and its outputs are tiled (`source_copies` times) inside the graph, before the decoder.
+        # The batch of samples is ordered by copy, then by source sentence.
+        if reinforce:
+            self.samples_per_source = samples_per_source
+            self.source_copies = tf.placeholder_with_default(1, shape=[], name='source_copies')
+            copies = self.source_copies
+            decoder_parameters.update(
+                attention_states=[tf.tile(states, tf.stack([copies, 1, 1])) for states in self.attention_states],
+                initial_state=tf.tile(self.encoder_state, tf.stack([copies, 1])),
+                encoder_input_length=[tf.tile(length, tf.stack([copies])) for length in self.encoder_input_length],
+                targets=tf.tile(self.targets, tf.stack([1, copies])),
+                decoder_input_length=tf.tile(self.target_length, tf.stack([copies]))
+            )
+        else:
+            self.samples_per_source = 1
+            self.source_copies = None
+
+        # class-factored softmax: the outputs are log-probabilities, which are only computed for the best
+        # classes when decoding (the best class in greedy decoding, `beam_size` classes in beam-search)
+        self.softmax_classes = softmax_classes
+        if softmax_classes and decode_only:
+            self.class_candidates = tf.placeholder_with_default(1, shape=[], name='class_candidates')
+        else:
+            self.class_candidates = None
+        assert not (softmax_classes and shortlist), 'shortlists are not supported with class-factored softmax'
+
+        # sampled softmax is only used for training, the full softmax is used for evaluation and decoding
+        if (loss_function == 'xent' and not decode_only and not softmax_classes and
+                0 < softmax_samples < decoder.vocab_size):
+            self.softmax_samples = softmax_samples
+        else:
+            self.softmax_samples = None
+
+        # the training loss can be computed by chunks of time steps, to reduce memory usage
+        if (loss_function == 'xent' and not decode_only and not softmax_classes and self.softmax_samples is None
+                and loss_chunk_size > 0):
+            self.loss_chunk_size = loss_chunk_size
+        else:
+            self.loss_chunk_size = None
+
+        if not decode_only and loss_function == 'xent':
+            # estimate from the tensor shapes, the actual peak memory usage is measured at the first update
+            logits_size = 4 * max_output_len * decoder.vocab_size / 2 ** 20   # per sentence, in MB
+            chunk_size = min(self.loss_chunk_size or max_output_len, max_output_len)
+            utils.log('estimated size of the logits: {:.1f} MB per sentence (at most {:.1f} MB at once during '
+                      'the loss)'.format(logits_size, logits_size * chunk_size / max_output_len))
+        self.measure_memory = not decode_only and loss_function == 'xent'
+
+        # in xent training, the output projection (and the loss) is computed after the decoder loop, for all
+        # time steps at once
         (self.outputs, self.attention_weights, self.decoder_outputs, self.beam_tensors,
          self.sampled_output, self.states) = decoders.attention_decoder(
-            attention_states=self.attention_states, initial_state=self.encoder_state,
-            targets=self.targets, feed_previous=self.feed_previous,
-            decoder_input_length=self.target_length, feed_argmax=self.feed_argmax, **parameters
+            feed_previous=self.feed_previous, feed_argmax=self.feed_argmax,
+            output_weights=bool(align), output_states=output_states, reinforce=reinforce,
+            output_hidden=self.softmax_samples is not None or self.loss_chunk_size is not None,
+            shortlist=self.shortlist, softmax_classes=softmax_classes,
+            class_candidates=self.class_candidates, project_after_loop=not decode_only and not reinforce,
+            **decoder_parameters
         )
 
-        self.beam_output = decoders.softmax(self.outputs[0, :, :], temperature=softmax_temperature)
-
-        optimizers = self.get_optimizers(optimizer, learning_rate)
+        if softmax_classes:
+            self.beam_output = tf.exp(self.outputs[0, :, :] / softmax_temperature)
+        else:
+            self.beam_output = decoders.softmax(self.outputs[0, :, :], temperature=softmax_temperature)
 
-        self.xent_loss, self.reinforce_loss, self.baseline_loss = None, None, None
+        self.xent_loss, self.reinforce_loss, self.baseline_loss, self.train_loss = None, None, None, None
         self.update_op, self.sgd_update_op, self.baseline_update_op = None, None, None
         self.rewards = None
 
+        if decode_only:
+            self.init_xent(optimizers=None, decode_only=True)   # used for alignment
+            return
+
+        optimizers = self.get_optimizers(optimizer, learning_rate)
+
         if loss_function == 'xent':
             self.init_xent(optimizers, decode_only)
         else:
@@ -168,7 +247,20 @@ class Seq2SeqModel(object):
                                                 weights=self.target_weights)
 
         if not decode_only:
-            self.update_op, self.sgd_update_op = self.get_update_op(self.xent_loss, optimizers, self.global_step)
+            if self.softmax_samples is not None:
+                self.train_loss = decoders.sampled_sequence_loss(outputs=self.decoder_outputs,
+                                                                 targets=self.targets[1:, :],
+                                                                 weights=self.target_weights, decoder=self.decoder,
+                                                                 num_samples=self.softmax_samples)
+            elif self.loss_chunk_size is not None:
+                self.train_loss = decoders.chunked_sequence_loss(outputs=self.decoder_outputs,
+                                                                 targets=self.targets[1:, :],
+                                                                 weights=self.target_weights, decoder=self.decoder,
+                                                                 chunk_size=self.loss_chunk_size)
+            else:
+                self.train_loss = self.xent_loss
+
+            self.update_op, self.sgd_update_op = self.get_update_op(self.train_loss, optimizers, self.global_step)
 
     def init_reinforce(self, optimizers, reinforce_baseline=True, decode_only=False):
         self.rewards = tf.placeholder(tf.float32, [None, None], 'rewards')
@@ -211,24 +303,64 @@ class Seq2SeqModel(object):
             input_feed[self.encoder_input_length[i]] = encoder_input_length[i]
             input_feed[self.encoder_inputs[i]] = encoder_inputs[i]
 
-        output_feed = {'loss': self.xent_loss}
+        # the loss is computed over the entire vocabulary (the targets are not indices in a shortlist)
+        shortlist = self.get_shortlist()
+        if shortlist is not None:
+            input_feed[self.shortlist] = shortlist
+
+        # the training loss (which can be approximated with sampled softmax) is only computed for updates
+        output_feed = {'loss': self.train_loss if update_model else self.xent_loss}
         if update_model:
             output_feed['updates'] = self.sgd_update_op if use_sgd else self.update_op
         if align:
             output_feed['attn_weights'] = self.attention_weights
 
-        res = session.run(output_feed, input_feed)
+        if update_model and self.measure_memory:
+            # measure the peak memory usage of the first update (e.g., to compare values of `loss_chunk_size`)
+            self.measure_memory = False
+            run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            run_metadata = tf.RunMetadata()
+            res = session.run(output_feed, input_feed, options=run_options, run_metadata=run_metadata)
+            self.log_peak_memory(run_metadata)
+        else:
+            res = session.run(output_feed, input_feed)
 
         return namedtuple('output', 'loss attn_weights')(res['loss'], res.get('attn_weights'))
 
+    def log_peak_memory(self, run_metadata):
+        """
+        Log the peak memory usage of each allocator (e.g., CPU and GPU) during a run, as measured by TensorFlow
+        """
+        peak_bytes = {}
+        for device_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in device_stats.node_stats:
+                for memory in node_stats.memory:
+                    peak_bytes[memory.allocator_name] = max(peak_bytes.get(memory.allocator_name, 0),
+                                                            memory.peak_bytes)
+
+        loss = 'chunks of {} steps'.format(self.loss_chunk_size) if self.loss_chunk_size else 'full'
+        for allocator_name, peak in sorted(peak_bytes.items()):
+            utils.log('peak memory usage of the first update ({} loss): {:.1f} MB on {}'.format(
+                loss, peak / 2 ** 20, allocator_name))
+
 
     def reinforce_step(self, session, data, update_model=True, update_baseline=True,
-                       use_sgd=False, reward_function=None, use_edits=False, vocabs=None, **kwargs):
+                       use_sgd=False, reward_function=None, use_edits=False, vocabs=None, executor=None, **kwargs):
+        """
+        :param executor: if not None, the rewards are computed and the model is updated in this executor
+          (e.g. a `ThreadPoolExecutor` with a single worker), and this function returns a `Future` of the result
+          as soon as the batch is sampled. If the next batches are sampled before this `Future` is done, they
+          are sampled with stale parameters (which don't include this update yet). Waiting for the result
+          before the next call gives the same updates as `executor=None`.
+        """
         assert vocabs or not use_edits
 
-        if vocabs:
+        if use_edits:
             src_vocab = vocabs[0]
             trg_vocab = vocabs[-1]
+            keep_id, del_id = trg_vocab.vocab.get(utils._KEEP), trg_vocab.vocab.get(utils._DEL)
+            if self.edit_mapping is None:
+                self.edit_mapping = utils.edit_id_mapping(src_vocab, trg_vocab)
 
         if self.dropout is not None:
             session.run(self.dropout_off)
@@ -258,37 +390,61 @@ class Seq2SeqModel(object):
             input_feed[self.encoder_input_length[i]] = encoder_input_length[i]
             input_feed[self.encoder_inputs[i]] = encoder_inputs[i]
 
-        sampled_output, outputs, states = session.run([self.sampled_output, self.outputs, self.states],
-                                                       input_feed)
+        if self.samples_per_source > 1:
+            input_feed[self.source_copies] = self.samples_per_source
 
-        time_steps = sampled_output.shape[0]
+        sample_feed = {'sampled_output': self.sampled_output}
+        if self.states is not None:   # only needed for rollouts
+            sample_feed['states'] = self.states
+            sample_feed['attention_states'] = self.attention_states
 
-        if reward_function is None:
-            reward_function = 'sentence_bleu'
+        output_feed = {'loss': self.reinforce_loss, 'baseline_loss': self.baseline_loss}
 
-        reward_function = getattr(evaluation, reward_function)
+        if update_model:
+            output_feed['updates'] = self.sgd_update_op if use_sgd else self.update_op
 
-        def compute_reward(output, target, source, partial=False):
-            j, = np.where(output == utils.EOS_ID)  # array of indices whose value is EOS_ID
-            if len(j) > 0:
-                output = output[:j[0]]
+        if update_baseline:
+            output_feed['baseline_updates'] = self.baseline_update_op
 
-            j, = np.where(target == utils.EOS_ID)
-            if len(j) > 0:
-                target = target[:j[0]]
+        # sampling and update are two stages of the same partial run: the decoder runs only once, and its
+        # outputs (time_steps x batch_size x vocab_size) stay inside the graph while the rewards are computed
+        fetches = [self.sampled_output] + list(output_feed.values())
+        if self.states is not None:
+            fetches += [self.states] + self.attention_states
 
-            j, = np.where(source == utils.EOS_ID)
-            if len(j) > 0:
-                source = source[:j[0]]
+        handle = session.partial_run_setup(fetches, list(input_feed.keys()) + [self.rewards])
 
-            if use_edits:   # use source sentence and sequence of edits to reconstruct output and target sequence
-                # It makes more sense to compute the reward on the reconstructed sequences, than on the sequences
-                # of edits.
-                output = utils.reverse_edit_ids(source, output, src_vocab, trg_vocab)
-                target = utils.reverse_edit_ids(source, target, src_vocab, trg_vocab)
+        res = session.partial_run(handle, sample_feed, input_feed)
+        sampled_output, states, attention_states = (res['sampled_output'], res.get('states'),
+                                                    res.get('attention_states'))
 
+        if self.samples_per_source > 1:
+            # same order as the samples: by copy, then by source sentence
+            copies = self.samples_per_source
+            batch_size *= copies
+            targets = np.tile(targets, (1, copies))
+            encoder_inputs = [np.concatenate([inputs] * copies) for inputs in encoder_inputs]
+            encoder_input_length = [np.concatenate([length] * copies) for length in encoder_input_length]
+            if attention_states is not None:
+                attention_states = [np.concatenate([states_] * copies) for states_ in attention_states]
+
+        time_steps = sampled_output.shape[0]
+
+        if reward_function is None:
+            reward_function = 'sentence_bleu'
+
+        # vectorized version of the reward function (which works directly on matrices of ids), if it exists
+        batch_reward_function = getattr(evaluation, 'batch_' + reward_function, None)
+        # incremental version, which scores all the prefixes of a sequence in one pass
+        prefix_reward_function = getattr(evaluation, 'prefix_' + reward_function, None)
+        reward_function = getattr(evaluation, reward_function)
+
+        def compute_reward(output, target, partial=False):
             if partial:
-                reward = [reward_function(output[:i + 1], target) for i in range(len(output))]
+                if prefix_reward_function is not None:
+                    reward = prefix_reward_function(output, target)
+                else:
+                    reward = [reward_function(output[:i + 1], target) for i in range(len(output))]
                 reward = [0] + reward
                 reward += [reward[-1]] * (time_steps - len(reward) + 1)
                 reward = np.array(reward)
@@ -296,67 +452,117 @@ class Seq2SeqModel(object):
             else:
                 return reward_function(output, target)
 
-        def compute_rewards(outputs, targets, partial=False):
-            return np.array([compute_reward(output, target, source, partial=partial)
-                             for output, target, source in zip(outputs.T, targets.T, encoder_inputs[0])])
+        def sequence_length(ids):
+            # number of symbols before the first EOS of each sequence (ids has shape (batch_size, max_length))
+            eos = ids == utils.EOS_ID
+            return np.where(eos.any(axis=1), eos.argmax(axis=1), ids.shape[1])
 
-        targets = targets[1:]
-
-        if self.rollouts is not None and self.rollouts > 1:
-            rewards = []
-
-            for i in range(time_steps):
+        def compute_rewards(outputs, targets, sources=None, partial=False):
+            outputs, targets = outputs.T, targets.T
+            output_length, target_length = sequence_length(outputs), sequence_length(targets)
 
-                if i == time_steps - 1:
-                    rewards.append(compute_rewards(sampled_output, targets))
-                    continue
+            if use_edits:   # use source sentence and sequence of edits to reconstruct output and target sequence
+                # It makes more sense to compute the reward on the reconstructed sequences, than on the sequences
+                # of edits. The edits are applied on ids, for the entire batch at once.
+                sources = encoder_inputs[0] if sources is None else sources
+                source_length = sequence_length(sources)
+                outputs, output_length = utils.reverse_edit_id_batch(sources, source_length, outputs, output_length,
+                                                                     self.edit_mapping, keep_id, del_id)
+                targets, target_length = utils.reverse_edit_id_batch(sources, source_length, targets, target_length,
+                                                                     self.edit_mapping, keep_id, del_id)
 
-                reward = 0
+            if batch_reward_function is not None and not partial:
+                return batch_reward_function(outputs, targets, hypothesis_length=output_length,
+                                             reference_length=target_length)
 
-                for _ in range(self.rollouts):
-                    prefix = sampled_output[:i + 1]
+            return np.array([compute_reward(list(output[:n]), list(target[:m]), partial=partial)
+                             for output, target, n, m in zip(outputs, targets, output_length, target_length)])
 
-                    input_ = np.expand_dims(sampled_output[i], axis=0)
-                    targets_ = targets[i + 1:]
-                    targets_ = np.concatenate([input_, targets_], axis=0)
-                    target_length_ = [time_steps - i - 1] * batch_size
+        targets = targets[1:]
 
-                    input_feed_ = dict(input_feed)
-                    input_feed_[self.targets] = targets_
-                    input_feed_[self.target_length] = target_length_
-                    input_feed_[self.beam_tensors.state] = states[i]
+        def finish_step():
+            # rewards and update (which can run in a worker thread, while the next batch is being sampled)
+            if self.rollouts is not None and self.rollouts > 1:
+                rewards = np.zeros([time_steps, batch_size])
+                rewards[-1] = compute_rewards(sampled_output, targets)
+
+                # The continuations of all prefixes are sampled in a few large runs: each run decodes all the
+                # rollouts for several prefix positions, starting from the decoder states and the encoder outputs
+                # of the first run (the encoder isn't recomputed). Rows are ordered by position, then rollout,
+                # then batch index.
+                rows_per_position = self.rollouts * batch_size
+                positions_per_run = max(1, self.rollout_batch_size // rows_per_position)
+
+                for k in range(0, time_steps - 1, positions_per_run):
+                    positions = range(k, min(k + positions_per_run, time_steps - 1))
+                    copies = len(positions) * self.rollouts
+
+                    targets_ = np.full([time_steps - k, copies * batch_size], utils.EOS_ID,
+                                       dtype=targets.dtype)
+                    targets_[0] = np.concatenate([np.tile(sampled_output[i], self.rollouts)
+                                                  for i in positions])
+                    target_length_ = np.concatenate([[time_steps - i - 1] * rows_per_position
+                                                     for i in positions])
+                    state_ = np.concatenate([np.tile(states[i], (self.rollouts, 1)) for i in positions])
+
+                    input_feed_ = {
+                        self.targets: targets_,
+                        self.target_length: target_length_,
+                        self.feed_previous: 1.0,
+                        self.feed_argmax: False,
+                        self.beam_tensors.state: state_
+                    }
+
+                    for j in range(self.encoder_count):
+                        input_feed_[self.attention_states[j]] = np.tile(attention_states[j], (copies, 1, 1))
+                        input_feed_[self.encoder_input_length[j]] = np.tile(encoder_input_length[j], copies)
 
                     outputs_ = session.run(self.sampled_output, input_feed_)
-                    outputs_ = np.concatenate([prefix, outputs_], axis=0)
-
-                    reward += compute_rewards(outputs_, targets) / self.rollouts
-
-                rewards.append(reward)
-
-            rewards = np.array(rewards)
-        elif self.partial_rewards:
-            rewards = compute_rewards(sampled_output, targets, partial=True).T
-        else:
-            rewards = compute_rewards(sampled_output, targets)
-            rewards = np.stack([rewards] * time_steps)
 
-        input_feed[self.rewards] = rewards
-        input_feed[self.outputs] = outputs
-        input_feed[self.sampled_output] = sampled_output
+                    for n, i in enumerate(positions):
+                        # sequences of all the rollouts for this position: prefix + sampled continuation
+                        columns = slice(n * rows_per_position, (n + 1) * rows_per_position)
+                        continuations = outputs_[:time_steps - i - 1, columns]
+                        prefix = np.tile(sampled_output[:i + 1], (1, self.rollouts))
+                        outputs_i = np.concatenate([prefix, continuations], axis=0)
+
+                        rewards_i = compute_rewards(outputs_i, np.tile(targets, (1, self.rollouts)),
+                                                    sources=np.tile(encoder_inputs[0], (self.rollouts, 1)))
+                        rewards[i] = rewards_i.reshape([self.rollouts, batch_size]).mean(axis=0)
+            elif self.partial_rewards:
+                rewards = compute_rewards(sampled_output, targets, partial=True).T
+            else:
+                rewards = compute_rewards(sampled_output, targets)
+                rewards = np.stack([rewards] * time_steps)
 
-        output_feed = {'loss': self.reinforce_loss, 'baseline_loss': self.baseline_loss}
+            res = session.partial_run(handle, output_feed, {self.rewards: rewards})
 
-        if update_model:
-            output_feed['updates'] = self.sgd_update_op if use_sgd else self.update_op
+            return namedtuple('output', 'loss baseline_loss')(res['loss'], res['baseline_loss'])
 
-        if update_baseline:
-            output_feed['baseline_updates'] = self.baseline_update_op
-
-        res = session.run(output_feed, input_feed)
+        if executor is not None:
+            return executor.submit(finish_step)
+        else:
+            return finish_step()
 
-        return namedtuple('output', 'loss baseline_loss')(res['loss'], res['baseline_loss'])
+    def get_shortlist(self, shortlist=None):
+        """
+        :param shortlist: sorted array of target token ids, or None for the entire vocabulary
+        :return: array of target token ids that can be generated, or None if this model doesn't use shortlists
+        """
+        if self.shortlist is None:
+            assert shortlist is None, 'this model was not created with shortlist support'
+            return None
+        elif shortlist is None:
+            return np.arange(self.trg_vocab_size)
+        else:
+            return np.array(shortlist)
 
-    def greedy_decoding(self, session, token_ids):
+    def greedy_decoding(self, session, token_ids, return_scores=False, shortlist=None):
+        """
+        :param return_scores: also return the cost (negative log-probability) of each output token,
+          as an array of shape (batch_size, time_steps)
+        :param shortlist: ids of the target words which can be generated (when the model supports it)
+        """
         if self.dropout is not None:
             session.run(self.dropout_off)
 
@@ -371,14 +577,34 @@ class Seq2SeqModel(object):
             input_feed[self.encoder_input_length[i]] = encoder_input_length[i]
             input_feed[self.encoder_inputs[i]] = encoder_inputs[i]
 
+        shortlist = self.get_shortlist(shortlist)
+        if shortlist is not None:
+            input_feed[self.shortlist] = shortlist
+
         outputs = session.run(self.outputs, input_feed)
+        token_ids = np.argmax(outputs, axis=2)
+        if shortlist is not None:   # outputs are indices in the shortlist
+            token_ids = shortlist[token_ids]
+
+        if not return_scores:
+            return token_ids.T
 
-        return np.argmax(outputs, axis=2).T
+        max_outputs = np.max(outputs, axis=2)
+        if self.softmax_classes:   # outputs are already log-probabilities
+            return token_ids.T, -max_outputs.T
 
-    def beam_search_decoding(self, session, token_ids, beam_size, ngrams=None, early_stopping=True):
+        # numerically stable log-softmax of the selected tokens
+        log_z = max_outputs + np.log(np.sum(np.exp(outputs - max_outputs[:, :, None]), axis=2))
+        costs = log_z - max_outputs   # the argmax has the largest logit
+        return token_ids.T, costs.T
+
+    def beam_search_decoding(self, session, token_ids, beam_size, ngrams=None, early_stopping=True, shortlist=None):
         if not isinstance(session, list):
             session = [session]
 
+        shortlist = self.get_shortlist(shortlist)
+        output_size = self.trg_vocab_size if shortlist is None else len(shortlist)
+
         if self.dropout is not None:
             for session_ in session:
                 session_.run(self.dropout_off)
@@ -427,6 +653,10 @@ class Seq2SeqModel(object):
             for feed in input_feed:
                 for j in range(self.encoder_count):
                     feed[self.encoder_input_length[j]] = encoder_input_length[j]
+                if shortlist is not None:
+                    feed[self.shortlist] = shortlist
+                if self.class_candidates is not None:
+                    feed[self.class_candidates] = min(beam_size, self.softmax_classes)
 
             if i > 0:
                 for input_feed_, output_ in zip(input_feed, output):
@@ -464,7 +694,7 @@ class Seq2SeqModel(object):
                     history = hypothesis[1 - lm_order:]
                     score_ = []
 
-                    for token_id in range(self.trg_vocab_size):
+                    for token_id in (range(self.trg_vocab_size) if shortlist is None else shortlist):
                         # if token is not in unigrams, this means that either there is something
                         # wrong with the ngrams (e.g. trained on wrong file),
                         # or trg_vocab_size is larger than actual vocabulary
@@ -481,7 +711,7 @@ class Seq2SeqModel(object):
                 lm_weight = self.lm_weight or 0.2
                 weights = [(1 - lm_weight) / len(session)] * len(session) + [lm_weight]
             else:
-                lm_score = np.zeros((1, self.trg_vocab_size))
+                lm_score = np.zeros((1, output_size))
                 weights = None
 
             proba = [np.maximum(proba_, 1e-10) for proba_ in proba]
@@ -490,8 +720,10 @@ class Seq2SeqModel(object):
             scores_ = scores_.flatten()
             flat_ids = np.argsort(scores_)
 
-            token_ids_ = flat_ids % self.trg_vocab_size
-            hyp_ids = flat_ids // self.trg_vocab_size
+            token_ids_ = flat_ids % output_size
+            hyp_ids = flat_ids // output_size
+            if shortlist is not None:
+                token_ids_ = shortlist[token_ids_]
 
             new_hypotheses = []
             new_scores = []
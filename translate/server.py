@@ -0,0 +1,155 @@
+import os
+import queue
+import socketserver
+import threading
+import time
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from translate import utils
+
+
+class TranslationRequest(object):
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.hypotheses = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """
+    Group concurrent translation requests into batches.
+
+    Requests are put into a queue by the server threads, while `run` (which must be called from the
+    thread that owns the TensorFlow session) waits for the first request, and then for at most `max_latency`
+    seconds for other requests, before translating all of them at once.
+    """
+
+    def __init__(self, translate_fun, batch_size, max_latency=0.01):
+        """
+        :param translate_fun: function that takes a list of sentences and returns an iterator over
+          their translations
+        :param batch_size: maximum number of sentences in a batch
+        :param max_latency: maximum time (in seconds) that a request can wait for other requests
+        """
+        self.translate_fun = translate_fun
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+
+    def translate(self, sentences):
+        """
+        Called by the server threads, blocks until the sentences are translated.
+        """
+        request = TranslationRequest(sentences)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.hypotheses
+
+    def next_batch(self):
+        requests = [self.queue.get()]
+        size = len(requests[0].sentences)
+        deadline = time.time() + self.max_latency
+
+        while size < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request.sentences)
+
+        return requests
+
+    def run(self):
+        while True:
+            requests = self.next_batch()
+            sentences = [sentence for request in requests for sentence in request.sentences]
+
+            try:
+                start_time = time.time()
+                hypotheses = list(self.translate_fun(sentences))
+                utils.debug('translated {} sentences ({} requests) in {:.3f}s'.format(
+                    len(sentences), len(requests), time.time() - start_time))
+            except Exception as e:
+                hypotheses = None
+                for request in requests:
+                    request.error = e
+
+            for request in requests:
+                if hypotheses is not None:
+                    request.hypotheses = hypotheses[:len(request.sentences)]
+                    hypotheses = hypotheses[len(request.sentences):]
+                request.done.set()
+
+
+class TranslationRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST requests contain one sentence per line (UTF-8), and receive one translation per line.
+    """
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        sentences = self.rfile.read(length).decode('utf-8').splitlines()
+
+        try:
+            hypotheses = self.server.batcher.translate(sentences)
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+
+        body = ''.join(hypothesis + '\n' for hypothesis in hypotheses).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # `client_address` is empty with Unix sockets
+        utils.debug('server: ' + format % args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(translate_fun, batch_size, host='localhost', port=8000, unix_socket=None, max_latency=0.01):
+    """
+    Start a translation server, and process requests until interrupted.
+    The server listens on `unix_socket` if it is specified, or else on `host`:`port`.
+    """
+    batcher = MicroBatcher(translate_fun, batch_size, max_latency)
+
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, TranslationRequestHandler)
+        address = unix_socket
+    else:
+        server = ThreadingHTTPServer((host, port), TranslationRequestHandler)
+        address = '{}:{}'.format(host, port)
+
+    server.batcher = batcher
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    utils.log('listening on {}'.format(address))
+
+    try:
+        batcher.run()   # TensorFlow calls happen in this thread
+    except KeyboardInterrupt:
+        utils.log('exiting...')
+    finally:
+        server.shutdown()
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
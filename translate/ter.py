@@ -0,0 +1,128 @@
+"""
+Fast implementation of the Translation Error Rate, which gives the same scores as `pyter`: greedy search of
+the best shifts, with an edit distance computed with numpy rows, and cached by hypothesis prefix.
+By default, the shifts are not bounded (as in `pyter`, but unlike tercom).
+"""
+
+import numpy as np
+
+
+def ter(hypothesis, reference, max_shift_size=None, max_shift_distance=None, **kwargs):
+    """
+    Calculate Translation Error Rate
+
+    :param hypothesis: list of tokens or token ids
+    :param reference: list of tokens or token ids
+    :param max_shift_size: if not None, maximum number of words that can be shifted at once (tercom uses 10)
+    :param max_shift_distance: if not None, maximum distance of a shift (tercom uses 50)
+    :param kwargs: additional (unused) parameters
+    :return: TER score (float)
+
+    >>> ref = 'SAUDI ARABIA denied THIS WEEK information published in the AMERICAN new york times'.split()
+    >>> hyp = 'THIS WEEK THE SAUDIS denied information published in the new york times'.split()
+    >>> '{0:.3f}'.format(ter(hyp, ref))
+    '0.308'
+    """
+    hypothesis, reference = list(hypothesis), list(reference)
+
+    # words are replaced by integer ids (words that are not in the reference have negative ids)
+    vocab = {}
+    for word in reference:
+        vocab.setdefault(word, len(vocab))
+    hyp_ids = [vocab.get(word, -1 - i) for i, word in enumerate(hypothesis)]
+    ref_ids = [vocab[word] for word in reference]
+
+    words = dict(zip(hyp_ids, hypothesis))
+    edit_distance = CachedEditDistance(ref_ids)
+
+    shifts = 0
+    while True:
+        delta, shifted_ids = _best_shift(hyp_ids, ref_ids, words, edit_distance, max_shift_size,
+                                         max_shift_distance)
+        if delta <= 0:
+            break
+        shifts += 1
+        hyp_ids = shifted_ids
+
+    return (shifts + edit_distance(hyp_ids)) / len(reference)
+
+
+def _best_shift(hyp_ids, ref_ids, words, edit_distance, max_shift_size=None, max_shift_distance=None):
+    """
+    Find the shift that decreases the edit distance the most (ties are broken as in `pyter`,
+    by comparing the shifted sequences of words)
+
+    :return: decrease of the edit distance, and the shifted sequence
+    """
+    score = edit_distance(hyp_ids)
+    best_delta, best_ids = None, None
+
+    for hyp_pos, ref_pos, length in _find_pairs(hyp_ids, ref_ids, max_shift_size, max_shift_distance):
+        shifted_ids = hyp_ids[:hyp_pos] + hyp_ids[hyp_pos + length:]
+        shifted_ids[ref_pos:ref_pos] = hyp_ids[hyp_pos:hyp_pos + length]
+
+        delta = score - edit_distance(shifted_ids)
+        if (best_delta is None or delta > best_delta or
+                delta == best_delta and [words[i] for i in shifted_ids] > [words[i] for i in best_ids]):
+            best_delta, best_ids = delta, shifted_ids
+
+    if best_delta is None:
+        return 0, hyp_ids
+    return best_delta, best_ids
+
+
+def _find_pairs(hyp_ids, ref_ids, max_shift_size=None, max_shift_distance=None):
+    """
+    Enumerate the shift candidates: for each pair of positions (in hypothesis order, then reference order)
+    where both words are the same, the length of the longest common phrase starting at these positions.
+    """
+    if not hyp_ids or not ref_ids:
+        return []
+
+    matches = np.equal.outer(hyp_ids, ref_ids)
+
+    # length of the common phrase starting at each position (computed backwards, one row at a time)
+    lengths = np.zeros([len(hyp_ids) + 1, len(ref_ids) + 1], dtype=np.int64)
+    for i in range(len(hyp_ids) - 1, -1, -1):
+        lengths[i, :-1] = matches[i] * (1 + lengths[i + 1, 1:])
+
+    np.fill_diagonal(matches, False)
+    hyp_positions, ref_positions = np.nonzero(matches)
+
+    if max_shift_distance is not None:
+        mask = np.abs(hyp_positions - ref_positions) <= max_shift_distance
+        hyp_positions, ref_positions = hyp_positions[mask], ref_positions[mask]
+
+    lengths = lengths[hyp_positions, ref_positions]
+    if max_shift_size is not None:
+        lengths = np.minimum(lengths, max_shift_size)
+
+    return zip(hyp_positions.tolist(), ref_positions.tolist(), lengths.tolist())
+
+
+class CachedEditDistance(object):
+    """
+    Levenshtein distance to a fixed reference. The rows of the dynamic programming matrix are cached
+    in a prefix tree of the hypotheses, so that hypotheses with a common prefix (e.g. shifted versions
+    of the same hypothesis) share their computation.
+    """
+
+    def __init__(self, ref_ids):
+        self.ref_ids = np.array(ref_ids, dtype=np.int64)
+        self.positions = np.arange(len(ref_ids) + 1)
+        self.cache = {}
+
+    def __call__(self, hyp_ids):
+        node, row = self.cache, self.positions
+        for word_id in hyp_ids:
+            if word_id not in node:
+                node[word_id] = ({}, self._next_row(row, word_id))
+            node, row = node[word_id]
+        return int(row[-1])
+
+    def _next_row(self, row, word_id):
+        # deletions and substitutions, then insertions with a cumulative minimum:
+        # new_row[j] = min_k<=j(candidates[k] + j - k)
+        candidates = row + 1
+        candidates[1:] = np.minimum(candidates[1:], row[:-1] + (self.ref_ids != word_id))
+        return np.minimum.accumulate(candidates - self.positions) + self.positions
@@ -6,7 +6,10 @@ import sys
 import math
 import numpy as np
 import shutil
-from translate import utils, evaluation
+import itertools
+from collections import OrderedDict
+from translate import utils, evaluation, server
+from translate.cache import TranslationCache
 from translate.seq2seq_model import Seq2SeqModel
 
 
@@ -17,6 +20,7 @@ class BaseTranslationModel(object):
         self.checkpoint_dir = checkpoint_dir
         self.saver = None
         self.global_step = None
+        self.loaded_checkpoints = []  # checkpoint files loaded by `initialize`
 
         try:
             self.reversed_scores = getattr(evaluation, score_function).reversed  # the lower the better
@@ -88,9 +92,11 @@ class BaseTranslationModel(object):
         
         if checkpoints:  # load partial checkpoints
             for checkpoint in checkpoints:  # checkpoint files to load
-                load_checkpoint(sess, None, checkpoint, blacklist=blacklist)
+                self.loaded_checkpoints.append(load_checkpoint(sess, None, checkpoint, blacklist=blacklist))
         elif not reset:
-            load_checkpoint(sess, self.checkpoint_dir, blacklist=blacklist)
+            filename = load_checkpoint(sess, self.checkpoint_dir, blacklist=blacklist)
+            if filename is not None:
+                self.loaded_checkpoints.append(filename)
 
     def save(self, sess):
         save_checkpoint(sess, self.saver, self.checkpoint_dir, self.global_step)
@@ -98,7 +104,8 @@ class BaseTranslationModel(object):
 
 class TranslationModel(BaseTranslationModel):
     def __init__(self, name, encoders, decoder, checkpoint_dir, learning_rate, learning_rate_decay_factor, batch_size,
-                 keep_best=1, load_embeddings=None, max_input_len=None, **kwargs):
+                 keep_best=1, load_embeddings=None, max_input_len=None, decode_only=False, shortlist_size=0,
+                 lexical_table=None, lexical_candidates=10, **kwargs):
         super(TranslationModel, self).__init__(name, checkpoint_dir, keep_best, **kwargs)
 
         self.batch_size = batch_size
@@ -129,10 +136,14 @@ class TranslationModel(BaseTranslationModel):
         # this adds an `embedding' attribute to each encoder and decoder
         utils.read_embeddings(self.filenames.embeddings, encoders + [decoder], load_embeddings, self.vocabs)
 
+        self._read_lexical_table(shortlist_size, lexical_table, lexical_candidates)
+        shortlist = decode_only and (self.shortlist_size > 0 or self.lexical_table is not None)
+
         # main model
         utils.debug('creating model {}'.format(name))
         self.seq2seq_model = Seq2SeqModel(encoders, decoder, self.learning_rate, self.global_step,
-                                          max_input_len=max_input_len, **kwargs)
+                                          max_input_len=max_input_len, decode_only=decode_only,
+                                          shortlist=shortlist, **kwargs)
 
         self.batch_iterator = None
         self.dev_batches = None
@@ -167,17 +178,49 @@ class TranslationModel(BaseTranslationModel):
         self.trg_vocab = self.vocabs[-1]
         self.ngrams = self.filenames.lm_path and utils.read_ngrams(self.filenames.lm_path, self.trg_vocab.vocab)
 
+    def _read_lexical_table(self, shortlist_size=0, lexical_table=None, lexical_candidates=10):
+        self.shortlist_size = shortlist_size
+        self.lexical_table_path = lexical_table
+        self.lexical_candidates = lexical_candidates
+        if lexical_table is not None:
+            self.lexical_table = utils.read_lexical_table(lexical_table, self.src_vocab[0], self.trg_vocab,
+                                                          candidates=lexical_candidates)
+        else:
+            self.lexical_table = None
+
+    def get_shortlist(self, token_ids):
+        """
+        Target words that can be generated when decoding a batch: the `shortlist_size` most frequent words
+        (assuming that the vocabulary is sorted by frequency), and the translation candidates of the words
+        of the first source (according to the lexical table).
+
+        :param token_ids: list of tuples of token ids (one for each encoder)
+        :return: sorted array of target token ids, or None if the model doesn't use a shortlist
+        """
+        if self.seq2seq_model.shortlist is None:
+            return None
+
+        shortlist = set(range(min(self.shortlist_size, self.seq2seq_model.trg_vocab_size)))
+        shortlist.update([utils.BOS_ID, utils.EOS_ID, utils.UNK_ID])
+
+        if self.lexical_table is not None:
+            for token_ids_ in token_ids:
+                for token_id in token_ids_[0]:
+                    shortlist.update(self.lexical_table.get(token_id, []))
+
+        return np.array(sorted(shortlist))
+
     def train(self, *args, **kwargs):
         raise NotImplementedError('use MultiTaskModel')
 
-    def train_step(self, sess, loss_function='xent', reward_function=None, use_edits=False):
+    def train_step(self, sess, loss_function='xent', reward_function=None, use_edits=False, executor=None):
         if loss_function == 'reinforce':
             fun = self.seq2seq_model.reinforce_step
         else:
             fun = self.seq2seq_model.step
 
         return fun(sess, next(self.batch_iterator), update_model=True, update_baseline=True, use_sgd=self.use_sgd,
-                   reward_function=reward_function, use_edits=use_edits, vocabs=self.vocabs)
+                   reward_function=reward_function, use_edits=use_edits, vocabs=self.vocabs, executor=executor)
 
     def baseline_step(self, sess, reward_function=None, use_edits=False):
         return self.seq2seq_model.reinforce_step(sess,
@@ -202,8 +245,101 @@ class TranslationModel(BaseTranslationModel):
     def _decode_sentence(self, sess, sentence_tuple, beam_size=1, remove_unk=False, early_stopping=True):
         return next(self._decode_batch(sess, [sentence_tuple], beam_size, remove_unk, early_stopping))
 
+    def _get_cache(self, beam_size, remove_unk=False, early_stopping=True, use_edits=False, cache_size=0,
+                   cache_file=None, **kwargs):
+        """
+        Create a translation cache for this model and these decoding parameters, or return None if
+        caching is disabled.
+        """
+        if cache_size <= 0 and not cache_file:
+            return None
+        if any(self.binary_input[:-1]):
+            utils.warn('translation cache is not available with binary input')
+            return None
+
+        checkpoints = []
+        for filename in self.loaded_checkpoints:
+            # same file name doesn't mean same parameters (e.g. `best` is overwritten during training)
+            index_filename = filename + '.index'
+            path = index_filename if os.path.exists(index_filename) else filename
+            mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            checkpoints.append((os.path.abspath(filename), mtime))
+
+        # decoding with a shortlist or with a class-factored softmax doesn't give the same translations
+        shortlist = None
+        if self.seq2seq_model.shortlist is not None:
+            lexical_table = self.lexical_table_path
+            if lexical_table is not None:
+                lexical_table = (os.path.abspath(lexical_table), os.path.getmtime(lexical_table))
+            shortlist = dict(shortlist_size=self.shortlist_size, lexical_table=lexical_table,
+                             lexical_candidates=self.lexical_candidates)
+
+        softmax_classes = self.seq2seq_model.softmax_classes
+        class_candidates = None
+        if softmax_classes and self.seq2seq_model.class_candidates is not None:
+            class_candidates = min(beam_size, softmax_classes)   # same as in `beam_search_decoding`
+
+        fingerprint = dict(
+            name=self.name, checkpoints=checkpoints, beam_size=beam_size, remove_unk=remove_unk,
+            early_stopping=early_stopping, use_edits=use_edits, lm_path=self.filenames.lm_path,
+            lm_weight=self.seq2seq_model.lm_weight, len_normalization=self.seq2seq_model.len_normalization,
+            max_input_len=self.max_input_len, max_output_len=self.seq2seq_model.max_output_len,
+            softmax_temperature=kwargs.get('softmax_temperature'), shortlist=shortlist,
+            softmax_classes=softmax_classes, class_candidates=class_candidates
+        )
+
+        utils.debug('using translation cache (size={}, file={})'.format(cache_size, cache_file))
+        return TranslationCache(fingerprint, max_size=cache_size, filename=cache_file,
+                                character_level=self.character_level[:-1])
+
+    def _decode_batch_with_cache(self, sess, sentence_tuples, batch_size, cache, **kwargs):
+        """
+        Same as `_decode_batch`, except that sentences which are in `cache` are not decoded again.
+        Duplicates inside a batch are only decoded once.
+        """
+        sentence_tuples = iter(sentence_tuples)   # lazy, for interactive mode
+
+        while True:
+            batch = list(itertools.islice(sentence_tuples, batch_size))
+            if not batch:
+                break
+
+            keys = [cache.key(sentence_tuple) for sentence_tuple in batch]
+            hypotheses = {}
+            missing = OrderedDict()
+
+            for key, sentence_tuple in zip(keys, batch):
+                if key in hypotheses or key in missing:
+                    continue
+                hypothesis = cache.get(key)
+                if hypothesis is None:
+                    missing[key] = sentence_tuple
+                else:
+                    hypotheses[key] = hypothesis
+
+            if missing:
+                hypothesis_iter = self._decode_batch(sess, list(missing.values()), batch_size, **kwargs)
+                for key, hypothesis in zip(missing, hypothesis_iter):
+                    cache.put(key, hypothesis)
+                    hypotheses[key] = hypothesis
+
+            for key in keys:
+                yield hypotheses[key]
+
     def _decode_batch(self, sess, sentence_tuples, batch_size, beam_size=1, remove_unk=False, early_stopping=True,
-                      use_edits=False):
+                      use_edits=False, cache=None, return_scores=False):
+        """
+        Translate an iterable of sentence tuples (one sentence for each encoder), and return an iterator
+        over the hypotheses, or over (hypothesis, score) pairs when `return_scores` is true.
+        The score is the cost (negative log-probability) of the hypothesis. With beam-search, it is
+        normalized by length if `len_normalization` is set.
+        """
+        if cache is not None and not return_scores:
+            yield from self._decode_batch_with_cache(sess, sentence_tuples, batch_size, cache, beam_size=beam_size,
+                                                     remove_unk=remove_unk, early_stopping=early_stopping,
+                                                     use_edits=use_edits)
+            return
+
         beam_search = beam_size > 1 or isinstance(sess, list)
 
         if beam_search:
@@ -225,17 +361,30 @@ class TranslationModel(BaseTranslationModel):
 
         for batch in batches:
             token_ids = list(map(map_to_ids, batch))
+            shortlist = self.get_shortlist(token_ids)
 
             if beam_search:
-                hypotheses, _ = self.seq2seq_model.beam_search_decoding(sess, token_ids[0], beam_size,
-                                                                        ngrams=self.ngrams,
-                                                                        early_stopping=early_stopping)
+                hypotheses, scores = self.seq2seq_model.beam_search_decoding(sess, token_ids[0], beam_size,
+                                                                             ngrams=self.ngrams,
+                                                                             early_stopping=early_stopping,
+                                                                             shortlist=shortlist)
                 batch_token_ids = [hypotheses[0]]  # first hypothesis is the highest scoring one
-
+                batch_scores = [scores[0]]
+            elif return_scores:
+                batch_token_ids, batch_costs = self.seq2seq_model.greedy_decoding(sess, token_ids,
+                                                                                  return_scores=True,
+                                                                                  shortlist=shortlist)
+                batch_scores = []
+                for trg_token_ids, costs in zip(batch_token_ids, batch_costs):
+                    trg_token_ids = list(trg_token_ids)
+                    # the score includes the cost of the EOS symbol
+                    length = trg_token_ids.index(utils.EOS_ID) + 1 if utils.EOS_ID in trg_token_ids else None
+                    batch_scores.append(float(np.sum(costs[:length])))
             else:
-                batch_token_ids = self.seq2seq_model.greedy_decoding(sess, token_ids)
+                batch_token_ids = self.seq2seq_model.greedy_decoding(sess, token_ids, shortlist=shortlist)
+                batch_scores = [None] * len(batch_token_ids)
 
-            for src_tokens, trg_token_ids in zip(batch, batch_token_ids):
+            for src_tokens, trg_token_ids, score in zip(batch, batch_token_ids, batch_scores):
                 trg_token_ids = list(trg_token_ids)
 
                 if utils.EOS_ID in trg_token_ids:
@@ -251,9 +400,11 @@ class TranslationModel(BaseTranslationModel):
                     trg_tokens = [token for token in trg_tokens if token != utils._UNK]
 
                 if self.character_level[-1]:
-                    yield ''.join(trg_tokens)
+                    hypothesis = ''.join(trg_tokens)
                 else:
-                    yield ' '.join(trg_tokens).replace('@@ ', '')  # merge subword units
+                    hypothesis = ' '.join(trg_tokens).replace('@@ ', '')  # merge subword units
+
+                yield (hypothesis, score) if return_scores else hypothesis
 
     def align(self, sess, output=None, wav_files=None, **kwargs):
         if len(self.src_ext) != 1:
@@ -301,6 +452,8 @@ class TranslationModel(BaseTranslationModel):
         assert not self.filenames.test or len(self.filenames.test) == len(self.src_ext)
 
         output_file = None
+        cache = self._get_cache(beam_size, remove_unk=remove_unk, early_stopping=early_stopping, use_edits=use_edits,
+                                **kwargs)
         try:
             output_file = sys.stdout if output is None else open(output, 'w')
 
@@ -314,14 +467,45 @@ class TranslationModel(BaseTranslationModel):
 
             hypothesis_iter = self._decode_batch(sess, lines, batch_size, beam_size=beam_size,
                                                  early_stopping=early_stopping, remove_unk=remove_unk,
-                                                 use_edits=use_edits)
+                                                 use_edits=use_edits, cache=cache)
 
             for hypothesis in hypothesis_iter:
                 output_file.write(hypothesis + '\n')
-                output_file.flush()
+                if self.filenames.test is None:  # only flush in interactive mode
+                    output_file.flush()
         finally:
             if output_file is not None:
                 output_file.close()
+            if cache is not None:
+                utils.debug('translation cache: {} hits, {} misses'.format(cache.hits, cache.misses))
+                cache.close()
+
+    def serve(self, sess, beam_size, remove_unk=False, early_stopping=True, use_edits=False, host='localhost',
+              port=8000, unix_socket=None, max_latency=0.01, **kwargs):
+        """
+        Run a translation server. Concurrent requests are grouped into batches of at most `batch_size`
+        sentences, by waiting at most `max_latency` seconds for other requests.
+        """
+        # requests contain text (one sentence per line), which is not possible with multiple encoders
+        assert len(self.src_ext) == 1 and not self.binary_input[0]
+
+        cache = self._get_cache(beam_size, remove_unk=remove_unk, early_stopping=early_stopping, use_edits=use_edits,
+                                **kwargs)
+
+        def translate(sentences, cache=cache):
+            return self._decode_batch(sess, [(sentence,) for sentence in sentences], self.batch_size,
+                                      beam_size=beam_size, early_stopping=early_stopping, remove_unk=remove_unk,
+                                      use_edits=use_edits, cache=cache)
+
+        utils.log('warming up')
+        list(translate([utils._UNK] * self.batch_size, cache=None))   # the warm-up translations aren't cached
+
+        try:
+            server.serve(translate, self.batch_size, host=host, port=port, unix_socket=unix_socket,
+                         max_latency=max_latency)
+        finally:
+            if cache is not None:
+                cache.close()
 
     def evaluate(self, sess, beam_size, score_function, on_dev=True, output=None, remove_unk=False, max_dev_size=None,
                  script_dir='scripts', early_stopping=True, use_edits=False, **kwargs):
@@ -346,6 +530,9 @@ class TranslationModel(BaseTranslationModel):
         elif output is None:
             output = [None] * len(filenames)
 
+        # on the dev set (during training), parameters change between two evaluations
+        cache = None if on_dev else self._get_cache(beam_size, remove_unk=remove_unk, early_stopping=early_stopping,
+                                                    use_edits=use_edits, **kwargs)
         scores = []
 
         for filenames_, output_ in zip(filenames, output):  # evaluation on multiple corpora
@@ -367,7 +554,7 @@ class TranslationModel(BaseTranslationModel):
 
                 hypothesis_iter = self._decode_batch(sess, src_sentences, self.batch_size, beam_size=beam_size,
                                                      early_stopping=early_stopping, remove_unk=remove_unk,
-                                                     use_edits=use_edits)
+                                                     use_edits=use_edits, cache=cache)
                 for sources, hypothesis, reference in zip(src_sentences, hypothesis_iter, trg_sentences):
                     if use_edits:
                         reference = utils.reverse_edits(sources[0], reference)
@@ -377,11 +564,12 @@ class TranslationModel(BaseTranslationModel):
 
                     if output_file is not None:
                         output_file.write(hypothesis + '\n')
-                        output_file.flush()
 
             finally:
                 if output_file is not None:
                     output_file.close()
+                if cache is not None:
+                    utils.debug('translation cache: {} hits, {} misses'.format(cache.hits, cache.misses))
 
             # default scoring function is utils.bleu_score
             score, score_summary = getattr(evaluation, score_function)(hypotheses, references, script_dir=script_dir)
@@ -397,6 +585,9 @@ class TranslationModel(BaseTranslationModel):
             utils.log(' '.join(map(str, score_info)))
             scores.append(score)
 
+        if cache is not None:
+            cache.close()
+
         return scores
 
 
@@ -433,6 +624,8 @@ def load_checkpoint(sess, checkpoint_dir, filename=None, blacklist=()):
         for var in variables:
             utils.debug('  {} {}'.format(var.name, var.get_shape()))
 
+    return filename
+
 
 def save_checkpoint(sess, saver, checkpoint_dir, step=None, name=None):
     """ `checkpoint_dir` should be unique to this model """
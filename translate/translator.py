@@ -0,0 +1,267 @@
+import os
+import tensorflow as tf
+import yaml
+
+from translate import utils
+from translate.multitask_model import MultiTaskModel
+from translate.frozen import FrozenTranslationModel
+
+default_config_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'config', 'default.yaml')
+
+# list of encoder and decoder parameter names (each encoder and decoder can have a different value
+# for those parameters)
+model_parameters = [
+    'cell_size', 'layers', 'vocab_size', 'embedding_size', 'attention_filters', 'attention_filter_length',
+    'use_lstm', 'time_pooling', 'attention_window_size', 'dynamic', 'binary', 'character_level', 'bidir',
+    'load_embeddings', 'pooling_avg', 'swap_memory', 'parallel_iterations', 'input_layers',
+    'residual_connections', 'attn_size', 'precompute_inputs', 'windowed_attention'
+]
+# TODO: independent model dir for each task
+task_parameters = [
+    'data_dir', 'train_prefix', 'dev_prefix', 'vocab_prefix', 'ratio', 'lm_file', 'learning_rate',
+    'learning_rate_decay_factor', 'max_input_len', 'max_output_len', 'encoders', 'decoder'
+]
+# parameters of a frozen model which keep their value at export time, unless they are explicitly set
+frozen_parameters = ['batch_size', 'max_input_len', 'max_output_len', 'len_normalization', 'lm_weight']
+
+
+def read_config(filename, default_filename=default_config_file, **overrides):
+    """
+    Read a configuration file in the YAML format, and set the parameters that are not defined
+    to their default value.
+
+    :param filename: path to the configuration file, or None to only use the default values
+    :param default_filename: path to the file containing the default values
+    :param overrides: parameters with a higher precedence than the configuration file
+      (parameters whose value is None are ignored)
+    :return: configuration, as an `AttrDict`
+    """
+    with open(default_filename) as f:
+        default_config = utils.AttrDict(yaml.safe_load(f))
+
+    if filename is None:
+        config = utils.AttrDict()
+    else:
+        with open(filename) as f:
+            config = utils.AttrDict(yaml.safe_load(f))
+
+    for k, v in overrides.items():
+        if v is not None:
+            config[k] = v
+
+    # parameters set in the configuration file or in `overrides` (as opposed to default values)
+    explicit_parameters = set(config)
+    for task in config.get('tasks') or []:
+        explicit_parameters.update(task)
+
+    # set default values for parameters that are not defined
+    for k, v in default_config.items():
+        config.setdefault(k, v)
+
+    # in case no task is defined (standard mono-task settings), define a "main" task
+    config.setdefault(
+        'tasks', [{'encoders': config.encoders, 'decoder': config.decoder, 'name': 'main', 'ratio': 1.0}]
+    )
+    config.tasks = [utils.AttrDict(task) for task in config.tasks]
+    config.explicit_parameters = sorted(explicit_parameters)
+
+    for task in config.tasks:
+        for parameter in task_parameters:
+            task.setdefault(parameter, config.get(parameter))
+
+        if isinstance(task.dev_prefix, str):  # for back-compatibility with old config files
+            task.dev_prefix = [task.dev_prefix]
+
+        # convert dicts to AttrDicts for convenience
+        task.encoders = [utils.AttrDict(encoder) for encoder in task.encoders]
+        task.decoder = utils.AttrDict(task.decoder)
+
+        for encoder_or_decoder in task.encoders + [task.decoder]:
+            # move parameters all the way up from base level to encoder/decoder level:
+            # default values for encoder/decoder parameters can be defined at the task level and base level
+            # default values for tasks can be defined at the base level
+            for parameter in model_parameters:
+                if parameter in encoder_or_decoder:
+                    continue
+                elif parameter in task:
+                    encoder_or_decoder[parameter] = task[parameter]
+                else:
+                    encoder_or_decoder[parameter] = config.get(parameter)
+
+    return config
+
+
+def get_task_config(config):
+    """
+    Parameters of the main task (or of the first task if no main task is defined), merged with the
+    global parameters (task parameters have a higher precedence).
+    """
+    if config.get('main_task') is not None:
+        task = next(task for task in config.tasks if task.name == config.main_task)
+    else:
+        task = config.tasks[0]
+
+    task_config = utils.AttrDict(config)
+    task_config.update(task)
+    return task_config
+
+
+def get_frozen_config(config):
+    """
+    Same as `get_task_config`, for a frozen model: the parameters in `frozen_parameters` which are not
+    explicitly set are left out, so that they keep their value at export time.
+    """
+    task_config = get_task_config(config)
+    explicit_parameters = config.get('explicit_parameters', frozen_parameters)
+    for parameter in frozen_parameters:
+        if parameter not in explicit_parameters:
+            task_config.pop(parameter, None)
+    return task_config
+
+
+def get_device(config):
+    if config.no_gpu:
+        return '/cpu:0'
+    elif config.gpu_id is not None:
+        return '/gpu:{}'.format(config.gpu_id)
+    else:
+        return None
+
+
+def get_session_config(config):
+    tf_config = tf.ConfigProto(log_device_placement=False, allow_soft_placement=True)
+    tf_config.gpu_options.allow_growth = config.allow_growth
+    tf_config.gpu_options.per_process_gpu_memory_fraction = config.mem_fraction
+    if config.threads:
+        tf_config.intra_op_parallelism_threads = config.threads
+    return tf_config
+
+
+class Translator(object):
+    """
+    Translate sentences from Python code, without reading or writing files.
+
+    The graph, the session (with the model parameters) and the vocabularies are kept alive between
+    calls to `translate`, so that they are only created once. Each translator has its own graph,
+    which means that several models can be used in the same process.
+
+    Example:
+        with Translator.from_config('experiments/WMT14/baseline.yaml') as translator:
+            translator.translate(['hello world', 'see you'], beam_size=4)
+    """
+
+    def __init__(self, task, sess, config):
+        """
+        :param task: instance of `TranslationModel` (whose parameters are already loaded in `sess`)
+        :param sess: TensorFlow session
+        :param config: configuration, as returned by `read_config`
+        """
+        self.task = task
+        self.sess = sess
+        self.config = config
+        self.cache = None   # created by the first call to `translate`
+
+    @classmethod
+    def from_config(cls, filename, **kwargs):
+        """
+        Create the model, and load its parameters (from `checkpoints` if it is specified, else from
+        the best checkpoint if there is one, else from the last checkpoint).
+
+        :param filename: path to a YAML configuration file
+        :param kwargs: parameters which override those of the configuration file (e.g. `checkpoints`,
+          `beam_size`, `no_gpu`)
+        """
+        return cls.create(read_config(filename, **kwargs))
+
+    @classmethod
+    def create(cls, config):
+        """
+        Same as `from_config`, but with a configuration that was already read by `read_config`.
+        If `frozen_model` is set, the model is loaded from this exported model instead.
+        """
+        if config.frozen_model:
+            task = FrozenTranslationModel(config.frozen_model, **get_frozen_config(config))
+            sess = tf.Session(graph=task.graph, config=get_session_config(config))
+            return cls(task, sess, config)
+
+        graph = tf.Graph()
+
+        with graph.as_default():
+            with tf.device(get_device(config)):
+                checkpoint_dir = os.path.join(config.model_dir, 'checkpoints')
+                model = MultiTaskModel(name='main', checkpoint_dir=checkpoint_dir, decode_only=True, **config)
+
+            sess = tf.Session(graph=graph, config=get_session_config(config))
+            best_checkpoint = os.path.join(checkpoint_dir, 'best')
+
+            if not config.checkpoints and os.path.isfile(best_checkpoint + '.index'):
+                model.initialize(sess, [best_checkpoint], reset=True)
+            else:
+                model.initialize(sess, **config)
+
+        if model.main_task is not None:
+            task = next(task for task in model.models if task.name == model.main_task)
+        else:
+            task = model.models[0]
+
+        return cls(task, sess, config)
+
+    @classmethod
+    def from_frozen(cls, filename, **kwargs):
+        """
+        Load a model exported with `--export`. This is much faster than `from_config`, as the model
+        doesn't need to be built, or its parameters to be restored.
+
+        :param filename: path to the exported model
+        :param kwargs: decoding parameters (the default values are those of the model at export time
+          for `batch_size`, `max_output_len`, etc., and those of the default configuration for the others)
+        """
+        config = read_config(None, **kwargs)
+        task = FrozenTranslationModel(filename, **kwargs)
+        sess = tf.Session(graph=task.graph, config=get_session_config(config))
+        return cls(task, sess, config)
+
+    def translate(self, sentences, beam_size=None, remove_unk=None, early_stopping=None, use_edits=None,
+                  return_scores=False):
+        """
+        :param sentences: list of sentences, or list of tuples of sentences (one sentence for each encoder)
+        :param beam_size: beam size (default: value in the configuration)
+        :param return_scores: return (hypothesis, score) pairs instead of hypotheses, where the score
+          is the cost of the hypothesis (the lower the better)
+        :return: list of translations, in the same order as `sentences`
+        """
+        def get_value(name, value):
+            return self.config[name] if value is None else value
+
+        beam_size = get_value('beam_size', beam_size)
+        remove_unk = get_value('remove_unk', remove_unk)
+        early_stopping = get_value('early_stopping', early_stopping)
+        use_edits = get_value('use_edits', use_edits)
+
+        sentence_tuples = [(sentence,) if isinstance(sentence, str) else tuple(sentence) for sentence in sentences]
+
+        # the cache is only valid for the default decoding parameters
+        default_parameters = (beam_size == self.config.beam_size and remove_unk == self.config.remove_unk and
+                              early_stopping == self.config.early_stopping and use_edits == self.config.use_edits)
+        if default_parameters and self.cache is None:
+            self.cache = self.task._get_cache(**self.config)
+        cache = self.cache if default_parameters else None
+
+        with self.sess.graph.as_default():
+            return list(self.task._decode_batch(self.sess, sentence_tuples, self.task.batch_size,
+                                                beam_size=beam_size, remove_unk=remove_unk,
+                                                early_stopping=early_stopping, use_edits=use_edits, cache=cache,
+                                                return_scores=return_scores))
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        self.sess.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
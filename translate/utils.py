@@ -85,6 +85,71 @@ def reverse_edit_ids(src_ids, edit_ids, src_vocab, trg_vocab):
     return reverse_edits(' '.join(src_words), ' '.join(trg_words)).split()
 
 
+def edit_id_mapping(src_vocab, trg_vocab):
+    """
+    Map source token ids to target token ids, so that edits can be applied directly on ids (see
+    `reverse_edit_id_batch`). Source words that are not in the target vocabulary get new ids (after the
+    target vocabulary), so that they can only match the same source word.
+
+    :return: array of target ids, indexed by source id
+    """
+    trg_vocab_size = len(trg_vocab.reverse)
+    return np.array([trg_vocab.vocab.get(word, trg_vocab_size + src_id)
+                     for src_id, word in enumerate(src_vocab.reverse)], dtype=np.int64)
+
+
+def reverse_edit_id_batch(src_ids, src_length, edit_ids, edit_length, mapping, keep_id, del_id):
+    """
+    Same as `reverse_edit_ids`, for an entire batch of id matrices and without going through the vocabularies.
+
+    :param src_ids: matrix of source ids of shape (batch_size, src_max_length)
+    :param src_length: length of each source sequence
+    :param edit_ids: matrix of target (edit) ids of shape (batch_size, edit_max_length)
+    :param edit_length: length of each sequence of edits
+    :param mapping: source id to target id mapping (see `edit_id_mapping`)
+    :param keep_id: target id of the `<KEEP>` symbol
+    :param del_id: target id of the `<DEL>` symbol
+    :return: matrix of target ids of shape (batch_size, max_length) and length of each sequence
+    """
+    src_ids = mapping[np.asarray(src_ids)]
+    edit_ids = np.asarray(edit_ids)
+    src_length = np.asarray(src_length)
+    edit_length = np.asarray(edit_length)
+
+    batch_size, src_max_length = src_ids.shape
+
+    in_edits = np.arange(edit_ids.shape[1]) < edit_length[:, None]
+    keep = (edit_ids == keep_id) & in_edits
+    delete = (edit_ids == del_id) & in_edits
+    words = in_edits & ~keep & ~delete
+
+    # position in the source before each edit (edits past the end of the source don't do anything)
+    moves = keep | delete
+    position = np.cumsum(moves, axis=1) - moves
+    keep &= position < src_length[:, None]
+
+    output = keep | words
+    values = np.where(keep, np.take_along_axis(src_ids, np.minimum(position, src_max_length - 1), axis=1),
+                      edit_ids)
+
+    final_position = np.minimum(moves.sum(axis=1), src_length)
+    output_count = output.sum(axis=1)
+    length = output_count + src_length - final_position
+
+    target_ids = np.zeros([batch_size, length.max(initial=0)], dtype=np.int64)
+
+    rows, cols = np.nonzero(output)
+    target_ids[rows, np.cumsum(output, axis=1)[rows, cols] - 1] = values[rows, cols]
+
+    # the rest of the source is copied at the end
+    positions = np.arange(src_max_length)
+    rest = (positions >= final_position[:, None]) & (positions < src_length[:, None])
+    rows, cols = np.nonzero(rest)
+    target_ids[rows, output_count[rows] + cols - final_position[rows]] = src_ids[rows, cols]
+
+    return target_ids, length
+
+
 def initialize_vocabulary(vocabulary_path):
     """
     Initialize vocabulary from file.
@@ -428,6 +493,31 @@ def read_ngrams(lm_path, vocab):
     return ngrams
 
 
+def read_lexical_table(filename, src_vocab, trg_vocab, candidates=10):
+    """
+    Read a lexical translation table (e.g. obtained with fast_align), with one entry per line:
+    `SOURCE_WORD TARGET_WORD PROBABILITY`
+
+    :param filename: path to the lexical table
+    :param src_vocab: source vocabulary
+    :param trg_vocab: target vocabulary
+    :param candidates: maximum number of translations per source word (the most probable ones)
+    :return: dict mapping source token ids to lists of target token ids
+    """
+    table = {}
+    with open(filename) as f:
+        for line in f:
+            src_word, trg_word, proba = line.split()
+            src_id = src_vocab.vocab.get(src_word)
+            trg_id = trg_vocab.vocab.get(trg_word)
+            if src_id is not None and trg_id is not None:
+                table.setdefault(src_id, []).append((float(proba), trg_id))
+
+    debug('loaded lexical table, {} source words'.format(len(table)))
+    return {src_id: [trg_id for _, trg_id in sorted(entries, reverse=True)[:candidates]]
+            for src_id, entries in table.items()}
+
+
 def create_logger(log_file=None):
     """
     Initialize global logger and return it.